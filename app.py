@@ -5,19 +5,27 @@ from convert_utils import *
 from delteE import *
 from icc_rw import ICCProfile
 from color_test_suit import *
-from color_rw import ColorReader, ColorWriter
+from color_rw import ColorReader, ColorWriter, virtual_panel, simulated_display
+from patch_sequencer import PatchSequencer, Patch, SettlePolicy, AveragingPolicy
+from measure_journal import MeasurementJournal
+from profile_cache import ProfileCache
 from log import logging, TextHandler
 from i18n.i18n_loader import _
 
-from win_display import (
-    get_all_display_config,
-    get_monitor_rect_by_gdi_name,
-    cp_add_display_association,
-    install_icc,
-    uninstall_icc,
-    cp_remove_display_association,
-    luid_from_dict,
-)
+try:
+    from win_display import (
+        get_all_display_config,
+        get_monitor_rect_by_gdi_name,
+        cp_add_display_association,
+        install_icc,
+        uninstall_icc,
+        cp_remove_display_association,
+        luid_from_dict,
+    )
+    HAS_WIN_DISPLAY = True
+except (ImportError, AttributeError, OSError):
+    # not on Windows (ctypes has no WinDLL): only the fake / virtual instruments can run
+    HAS_WIN_DISPLAY = False
 
 from tkinter import filedialog, ttk, Canvas
 import tkinter as tk
@@ -26,10 +34,8 @@ import webbrowser
 import subprocess
 import threading
 import traceback
-import tempfile
 import ctypes
 import time
-import uuid
 import copy
 import sys
 import re
@@ -37,6 +43,11 @@ import os
 
 
 class HDRCalibrationUI:
+    # adaptive grayscale sampling for calibrate_pq
+    ADAPTIVE_PQ_COARSE_POINTS = 17
+    ADAPTIVE_PQ_MAX_READINGS = 256
+    ADAPTIVE_PQ_BUDGET = 1.0  # dE_ITP
+
     def __init__(self, root):
         self.init_base_icc()
         self.target_xyz = []
@@ -52,12 +63,24 @@ class HDRCalibrationUI:
             "black": [0, 0, 0],
         }
         self.measure_gamut_xyz = {}
+        # gray readings taken by measure_gamut_before, keyed by the signal path they were taken on
+        self.gray_readings = {"key": None, "XYZ": {}}
 
         self.preview_icc_name = None
+        # preview profiles installed by content hash; toggling back to a state reuses its profile
+        self.profile_cache = ProfileCache(self.install_cached_icc, self.uninstall_cached_icc)
         self.measured_pq = {"red": [], "green": [], "blue": []}
 
         self.proc_color_write = None
         self.proc_color_reader = None
+        self.sequencer = None
+        # settle constants learned for the display, kept for the whole session
+        self.settle_policy = SettlePolicy()
+        # repeat dark readings until their mean is precise enough
+        self.averaging_policy = AveragingPolicy()
+        self.journal = None
+        # content hash of the preview profile currently applied, None when no preview
+        self.active_profile_hash = None
 
         self.icc_change_delay = 0
 
@@ -76,7 +99,13 @@ class HDRCalibrationUI:
         self.root.title("RealWindowsHDRCalibrator")
         self.set_dpi_awareness()
 
-        self.displays_config = get_all_display_config()
+        if HAS_WIN_DISPLAY:
+            self.displays_config = get_all_display_config()
+        elif simulated_display():
+            self.displays_config = []
+        else:
+            raise RuntimeError("Display configuration requires Windows; "
+                               "set RWHC_INSTRUMENT=fake or sim to run elsewhere")
         hc = {}
         for itm in self.displays_config:
             product_id = itm["target"]["device_path"].split("#")[1]
@@ -98,6 +127,14 @@ class HDRCalibrationUI:
                 hc[h_dname]["color_work_status"] = "hdr"
                 if hc[h_dname]["target"]["advanced_color"]["wide_color_enforced"]:
                     hc[h_dname]["color_work_status"] = "sdr_acm"
+        if not hc:
+            # simulated display off Windows: a single HDR screen covering the desktop
+            hc["0_simulated_display"] = {
+                "color_work_status": "hdr",
+                "monitor_rect": {"left": 0, "top": 0,
+                                 "right": self.root.winfo_screenwidth(),
+                                 "bottom": self.root.winfo_screenheight()},
+            }
         self.human_display_config_map = hc
 
         self.build_ui()
@@ -285,7 +322,7 @@ class HDRCalibrationUI:
         pq_points_menu = ttk.Combobox(
             button_frame,
             textvariable=self.pq_points_var,
-            values=["128", "256", "512", "1024"],
+            values=["128", "256", "512", "1024", _("Adaptive")],
             font=("Microsoft YaHei", 16),
             width=6,
             state="readonly",
@@ -576,8 +613,24 @@ class HDRCalibrationUI:
         associate it with the currently selected display, 
         and set it as that display's default ICC.
         """
+        panel = virtual_panel()
+        if panel is not None:
+            # Virtual panel: load the MHC2 tag instead of touching the system
+            panel.load_icc(path)
+            return
+        if simulated_display():
+            # fake instrument: its panel model ignores profiles, leave the system untouched
+            return
         install_icc(path)
-        icc_name = os.path.basename(path)
+        self.associate_icc(os.path.basename(path))
+
+    def associate_icc(self, icc_name):
+        """
+        icc_name: The file name of an installed ICC profile.
+        Associate it with the currently selected display and set it as that display's default ICC.
+        """
+        if simulated_display():
+            return
         monitor = self.monitor_var.get()
         info = self.human_display_config_map.get(monitor)
         luid = luid_from_dict(info["adapter_luid"])
@@ -589,14 +642,13 @@ class HDRCalibrationUI:
             luid, sid, icc_name, set_as_default=True, associate_as_advanced_color=hdr
         )
 
-    def clean_icc(self, name):
+    def disassociate_icc(self, icc_name):
         """
-        name: The name of the ICC profile to clean (without .icc or .icm).
-        Unassociate the specified ICC file from the currently selected display, 
-        unset it as that display's default profile, 
-        and remove the ICC file from the system.
+        icc_name: The file name of an installed ICC profile.
+        Unassociate it from the currently selected display, keeping it installed.
         """
-        path = f"{name}.icc"
+        if simulated_display():
+            return
         monitor = self.monitor_var.get()
         info = self.human_display_config_map.get(monitor)
         luid = luid_from_dict(info["adapter_luid"])
@@ -604,9 +656,43 @@ class HDRCalibrationUI:
         hdr = False
         if info["color_work_status"] == "hdr":
             hdr = True
-        cp_remove_display_association(luid, sid, path, associate_as_advanced_color=hdr)
+        cp_remove_display_association(luid, sid, icc_name, associate_as_advanced_color=hdr)
+
+    def clean_icc(self, name):
+        """
+        name: The name of the ICC profile to clean (without .icc or .icm).
+        Unassociate the specified ICC file from the currently selected display, 
+        unset it as that display's default profile, 
+        and remove the ICC file from the system.
+        """
+        panel = virtual_panel()
+        if panel is not None:
+            panel.load_mhc2(None)
+            return
+        if simulated_display():
+            return
+        path = f"{name}.icc"
+        self.disassociate_icc(path)
         uninstall_icc(path, force=True)
 
+    def install_cached_icc(self, path):
+        # simulated displays load profiles from the cached bytes (or ignore them) instead
+        if not simulated_display():
+            install_icc(path)
+
+    def uninstall_cached_icc(self, name):
+        if not simulated_display():
+            uninstall_icc(f"{name}.icc", force=True)
+
+    def unload_preview(self):
+        """Detach the preview profile from the display; it stays installed in the profile cache."""
+        panel = virtual_panel()
+        if panel is not None:
+            panel.load_mhc2(None)
+        else:
+            self.disassociate_icc(f"{self.preview_icc_name}.icc")
+        self.preview_icc_name = None
+
     def freeze_ui(self):
         """
         Disable all interactive controls in the window; 
@@ -750,15 +836,58 @@ class HDRCalibrationUI:
             if self.proc_color_reader:
                 self.proc_color_reader.terminate()
                 self.proc_color_reader = None
+            if self.sequencer is not None and self.settle_policy.patches:
+                logging.info(_("Settle time report: {}").format(self.settle_policy.report()))
+            if self.sequencer is not None and self.averaging_policy.patches:
+                logging.info(_("Dark patch averaging report: {}").format(self.averaging_policy.report()))
+            self.sequencer = None
+            if self.journal is not None:
+                logging.info(_("Measurement journal: {} readings replayed, {} recorded").format(
+                    self.journal.replayed, self.journal.recorded))
+                self.journal.close()
+                self.journal = None
         except Exception as e:
             logging.error(_("Error cleaning color read/write processes: {}").format(e))
             logging.error(traceback.format_exc())
 
+    def open_journal(self, kind):
+        """
+        Open the measurement journal for a measurement flow and attach it to the sequencer.
+        If an unfinished session of the same flow exists for this display and instrument,
+        ask whether to resume it; resumed stages replay the recorded readings.
+        """
+        try:
+            journal = MeasurementJournal(display=self.monitor_var.get(),
+                                         instrument=self.instrument_var.get())
+        except Exception as e:
+            logging.error(_("Failed to open measurement journal: {}").format(e))
+            return
+        resume = None
+        unfinished = journal.find_unfinished(kind)
+        if unfinished is not None:
+            msg = _("An interrupted measurement with {} readings was found. Resume from where it stopped?").format(unfinished[1])
+            if tk.messagebox.askyesno(_("Resume measurement"), msg):
+                resume = unfinished[0]
+        session = journal.start(kind, resume)
+        if resume is not None:
+            logging.info(_("Resuming measurement session {}").format(session))
+        self.journal = journal
+        self.sequencer.journal = journal
+
+    def journal_stage(self, name):
+        if self.journal is not None:
+            self.journal.stage(name, self.active_profile_hash)
+
+    def finish_journal(self):
+        if self.journal is not None:
+            self.journal.finish()
+
     def on_exit(self):
         # exit clean
         try:
             if self.preview_icc_name:
-                self.clean_icc(self.preview_icc_name)
+                self.unload_preview()
+            self.profile_cache.clear()
             self.clean_color_rw_process()
         except Exception as e:
             logging.error(_("Error during on_exit: {}").format(e))
@@ -1001,25 +1130,25 @@ class HDRCalibrationUI:
         state = self.preview_var.get()
         if state:
             if self.preview_icc_name:
-                self.clean_icc(self.preview_icc_name)
-                self.preview_icc_name = None
+                self.unload_preview()
                 time.sleep(self.icc_change_delay)
-            self.preview_icc_name = "CC_" + str(uuid.uuid4())
-            temp_dir = tempfile.gettempdir()
-            icc_file_name = self.preview_icc_name + ".icc"
-            path = os.path.join(temp_dir, icc_file_name)
-            desc = [{"lang": "en", "country": "US", "text": self.preview_icc_name}]
-            self.icc_handle.write_desc(desc)
-            self.icc_handle.rebuild()
-            self.icc_handle.save(path)
-            self.set_icc(path)
-            os.remove(path)
+            hits = self.profile_cache.hits
+            key, name, data = self.profile_cache.acquire(self.icc_handle)
+            if self.profile_cache.hits > hits:
+                logging.info(_("Reusing installed preview profile {}").format(name))
+            panel = virtual_panel()
+            if panel is not None:
+                panel.load_mhc2(ICCProfile.from_bytes(data).read_MHC2(as_array=True))
+            else:
+                self.associate_icc(name + ".icc")
+            self.preview_icc_name = name
+            self.active_profile_hash = key
             time.sleep(self.icc_change_delay)
         else:
             if self.preview_icc_name:
-                self.clean_icc(self.preview_icc_name)
-                self.preview_icc_name = None
+                self.unload_preview()
                 time.sleep(self.icc_change_delay)
+            self.active_profile_hash = None
 
     def temp_save_icc(self, path):
         # debug only
@@ -1047,6 +1176,8 @@ class HDRCalibrationUI:
         self.proc_color_write = ColorWriter()
         args = self.get_spotread_args()
         self.proc_color_reader = ColorReader(args)
+        self.sequencer = PatchSequencer(
+            self.proc_color_write, self.proc_color_reader, settle=self.settle_policy)
         if self.proc_color_reader.status == "need_calibration":
             while 1:
                 msg = _("Spot read needs a calibration before continuing \nPlace the instrument on its reflective white reference then click OK.")
@@ -1060,6 +1191,9 @@ class HDRCalibrationUI:
                     return
                 if self.proc_color_reader.status != "need_calibration":
                     break
+        panel = virtual_panel()
+        if panel is not None:
+            panel.reset_stats()
         # Send command to the child process
         self.proc_color_write.write_rgb([800, 800, 800])
         msg = _("Move the white window to the target screen, resize it to fully cover the meter, place the meter on the window, then click OK.")
@@ -1069,6 +1203,7 @@ class HDRCalibrationUI:
             self.clean_color_rw_process()
             self.unfreeze_ui()
             return
+        self.open_journal("calibrate_monitor")
 
         self.init_base_icc()
         origin_preview_status = self.preview_var.get()
@@ -1092,6 +1227,9 @@ class HDRCalibrationUI:
                 tk.messagebox.showerror(_("Error"), msg)
             else:
                 logging.info(_("Matrix LUT generated"))
+                self.finish_journal()
+                if panel is not None:
+                    logging.info(_("Virtual panel report: {}").format(panel.report(mhc2=self.MHC2)))
             self.unfreeze_ui()
             self.clean_color_rw_process()
             self.icc_change_delay = 0
@@ -1104,11 +1242,12 @@ class HDRCalibrationUI:
 
     def measure_gamut_before(self):
         self.preview_var.set(True)
+        self.journal_stage("gamut_before")
         max_lumi = 0
         min_lumi = 0
-        for color, rgb in self.gamut_test_rgb.items():
-            self.proc_color_write.write_rgb(rgb, delay=0.1)
-            XYZ = self.proc_color_reader.read_XYZ()
+        patches = [Patch(rgb, meta=color) for color, rgb in self.gamut_test_rgb.items()]
+        for result in self.sequencer.run(patches, averaging=self.averaging_policy):
+            color, XYZ = result.patch.meta, result.XYZ
             logging.info(_("Color {} measured XYZ: {}").format(color, XYZ))
             eetf = self.eetf_var.get()
             # If EETF is enabled, 
@@ -1134,33 +1273,42 @@ class HDRCalibrationUI:
 
         def measure_gray(code):
             rgb = [code, code, code]
-            self.proc_color_write.write_rgb(rgb, delay=0.1)
-            XYZ = self.proc_color_reader.read_XYZ()
+            XYZ = self.sequencer.measure(rgb, averaging=self.averaging_policy).XYZ
             logging.info(_("Gray test code={} RGB={} measured XYZ: {}").format(code, rgb, XYZ))
             return XYZ
 
-        high_XYZ = measure_gray(255)
-        if high_XYZ[1] <= start_lumi + delta:
+        threshold = start_lumi + delta
+        gray = {0: self.measure_gamut_xyz["black"]}
+        high_XYZ = gray[255] = measure_gray(255)
+        if high_XYZ[1] <= threshold:
             logging.info(_("No significant luminance increase found in 0-255 range; skipping activated black detection"))
             self.measure_gamut_xyz["min_activated_black"] = self.measure_gamut_xyz["black"]
         else:
-            lo, hi = 1, 255
-            found_code = None
-            found_XYZ = None
-            while lo <= hi:
-                mid = (lo + hi) // 2
-                XYZ = measure_gray(mid)
-                if XYZ[1] > start_lumi + delta:
-                    found_code = mid
-                    found_XYZ = XYZ
-                    hi = mid - 1  
+            # lo: highest code known not to lift, hi: lowest code known to lift.
+            # Predict the activation code from a PQ toe model fitted to the lifted readings,
+            # then confirm it with the neighbouring code; fall back to bisection if the model keeps missing.
+            lo, hi = 0, 255
+            use_model = True
+            while hi - lo > 1:
+                width = hi - lo
+                if use_model:
+                    lifted = [(c, XYZ[1]) for c, XYZ in gray.items() if XYZ[1] > threshold]
+                    guess = predict_activation_code(lifted, start_lumi, delta)
                 else:
-                    lo = mid + 1
-            if found_XYZ is not None:
-                self.measure_gamut_xyz["min_activated_black"] = found_XYZ
-                logging.info(_("Activated black level found: code={} XYZ={}").format(found_code, found_XYZ))
-            else:
-                logging.info(_("Activated black not found (grayscale differences may be below threshold)"))
+                    guess = (lo + hi) // 2
+                guess = min(max(guess, lo + 1), hi - 1)
+                XYZ = gray[guess] = measure_gray(guess)
+                if XYZ[1] > threshold:
+                    hi = guess
+                else:
+                    lo = guess
+                # a model step that did not halve the bracket is followed by a bisection step
+                use_model = not use_model or hi - lo <= width // 2
+            found_XYZ = gray[hi]
+            self.measure_gamut_xyz["min_activated_black"] = found_XYZ
+            logging.info(_("Activated black level found: code={} XYZ={}").format(hi, found_XYZ))
+        for color in ("white_200nit", "white"):
+            gray[self.gamut_test_rgb[color][0]] = self.measure_gamut_xyz[color]
 
         """
         FIXME 
@@ -1184,16 +1332,26 @@ class HDRCalibrationUI:
         self.icc_handle.write_XYZType("wtpt", [w])
         
         self.icc_handle.write_MHC2(self.MHC2)
+        # gray readings are reused by the PQ sweep as long as the signal path is unchanged;
+        # the key is taken after the luminance metadata derived from them has been written
+        self.gray_readings = {"key": self.signal_path_key(), "XYZ": gray}
 
         logging.info(_("Gamut measurement finished"))
     
+    def signal_path_key(self):
+        """Identify the MHC2 matrix, LUTs and luminance metadata applied to the measured signal."""
+        tables = tuple(tuple(float(v) for v in self.MHC2[k] or ())
+                       for k in ("matrix", "red_lut", "green_lut", "blue_lut"))
+        return tables + (float(self.MHC2["min_luminance"]), float(self.MHC2["peak_luminance"]))
+
     def measure_gamut_after(self):
         self.preview_var.set(True)
+        self.journal_stage("gamut_after")
         max_lumi = 0
         min_lumi = 0
-        for color, rgb in self.gamut_test_rgb.items():
-            self.proc_color_write.write_rgb(rgb, delay=0.1)
-            XYZ = self.proc_color_reader.read_XYZ()
+        patches = [Patch(rgb, meta=color) for color, rgb in self.gamut_test_rgb.items()]
+        for result in self.sequencer.run(patches):
+            color, XYZ = result.patch.meta, result.XYZ
             logging.info(_("Color {} measured XYZ: {}").format(color, XYZ))
             if color == "white":
                 max_lumi = XYZ[1]
@@ -1243,6 +1401,7 @@ class HDRCalibrationUI:
     def calibrate_chromaticity(self):
         # measure and build matrix
         self.preview_var.set(True)
+        self.journal_stage("chromaticity")
         logging.info(_("Start color measurement and generate matrix"))
         self.target_xyz = get_srgb_calibrate_XYZ_suit(self.measure_gamut_xyz)
         if self.color_space_var.get() == "sRGB+DisplayP3":
@@ -1255,17 +1414,47 @@ class HDRCalibrationUI:
         
         wp = [float(x.strip()) for x in self.white_point_var.get().split(",")]
         m = calculate_bradford_matrix(wp, D65_WHITE_POINT)
-        for itm in self.target_xyz:
-            pq = XYZ_to_BT2020_PQ_rgb(itm)
-            rgb = (pq * 1023).round().astype(int)
-            self.proc_color_write.write_rgb(rgb, delay=0.1)
-            XYZ = self.proc_color_reader.read_XYZ()
+
+        def target_rgb(target):
+            pq = XYZ_to_BT2020_PQ_rgb(target)
+            return (pq * 1023).round().astype(int)
+
+        def convert(XYZ):
             XYZ = [float(itm) / 10000 for itm in XYZ]
-            XYZ = m@XYZ
+            return m@XYZ
+
+        def measure(target):
+            rgb = target_rgb(target)
+            return rgb, convert(self.sequencer.measure(rgb).XYZ)
+
+        patches = [Patch(target_rgb(itm), meta=itm) for itm in self.target_xyz]
+        for result in self.sequencer.run(patches):
+            rgb, itm, XYZ = result.patch.rgb, result.patch.meta, convert(result.XYZ)
             logging.info(_("({}) Color: {} Target XYZ:{} Measured: {}").format(i/l, rgb , itm, XYZ))
             self.measured_xyz.append(XYZ)
             i += 1
-        matrix = fit_XYZ2XYZ_wlock_dropY(self.measured_xyz, self.target_xyz,self.measured_xyz[-1], self.target_xyz[-1])
+
+        def fit():
+            return fit_XYZ2XYZ_wlock_dropY_robust(
+                self.measured_xyz, self.target_xyz, self.measured_xyz[-1], self.target_xyz[-1])
+
+        # Robust (IRLS) fit: a single bad reading is down-weighted and flagged,
+        # and only the flagged patches are measured again.
+        matrix, fit_info = fit()
+        outliers = np.flatnonzero(fit_info["outliers"]).tolist()
+        if outliers:
+            logging.warning(_("Outlier patches detected: {}, re-measuring only these").format(outliers))
+            for idx in outliers:
+                rgb, XYZ = measure(self.target_xyz[idx])
+                logging.info(_("Re-measured patch {} Color: {} Target XYZ:{} Measured: {}").format(
+                    idx, rgb, self.target_xyz[idx], XYZ))
+                self.measured_xyz[idx] = XYZ
+            matrix, fit_info = fit()
+            outliers = np.flatnonzero(fit_info["outliers"]).tolist()
+            if outliers:
+                logging.warning(_("Patches still flagged after re-measurement (down-weighted in fit): {}").format(outliers))
+        logging.info(_("Matrix fit residuals (scaled): {}").format(
+            np.round(fit_info["scaled_residuals"], 2).tolist()))
         # matrix = fit_XYZ2XYZ(self.measure_convert_xyz, self.convert_xyz)
         ori_matrix = np.array(self.MHC2["matrix"]).reshape(3, 3)
         matrix2 = ori_matrix @ matrix
@@ -1275,13 +1464,13 @@ class HDRCalibrationUI:
     
     def calibrate_white_by_lut(self):
         logging.info(_("Start calibrating grayscale chromaticity to D65"))
+        self.journal_stage("white_by_lut")
         MEASURE_POINTS_COUNT = 32
         pq_lut_origin = {"red": copy.deepcopy(self.MHC2["red_lut"]),
                          "green": copy.deepcopy(self.MHC2["green_lut"]),
                          "blue": copy.deepcopy(self.MHC2["blue_lut"])}
         max_nit = 0
-        self.proc_color_write.write_rgb([1023,1023,1023], delay=0.3)
-        XYZ = self.proc_color_reader.read_XYZ()
+        XYZ = self.sequencer.measure(Patch([1023, 1023, 1023], settle=0.3)).XYZ
         max_nit = XYZ[1]
         min_nit = 10
         logging.info(_("Measured display peak luminance: {} nit").format(max_nit))
@@ -1294,6 +1483,9 @@ class HDRCalibrationUI:
         measure_points.append(1023)
         logging.info(_("Grayscale points measured this run ({}): {}".format(len(measure_points), measure_points)))
         scales = []
+        last_scales = None
+        solver_readings = 0
+        walk_readings = 0
         for grayscale in measure_points:
             nit = pq_eotf(grayscale / 1023)
             if nit > max_nit:
@@ -1305,87 +1497,49 @@ class HDRCalibrationUI:
                 logging.info(_("Grayscale {} target {} nit is 0, skip").format(grayscale, nit))
                 scales.append({"grayscale":grayscale, "red": None, "green": None, "blue": None})
                 continue
-            self.MHC2["red_lut"]     = copy.deepcopy(pq_lut_origin["red"])
-            self.MHC2["green_lut"]   = copy.deepcopy(pq_lut_origin["green"])
-            self.MHC2["blue_lut"]    = copy.deepcopy(pq_lut_origin["blue"])
-            self.MHC2["entry_count"] = len(pq_lut_origin["red"])
-            self.icc_handle.write_MHC2(self.MHC2)
             rgb_pq = [int(grayscale)] * 3
             target_rgb_pq = np.array(rgb_pq)/1023
-            channel_scale = {"grayscale": grayscale, "red": 1, "green": 1, "blue": 1}
-            for loop_count in range(2):
-                for idx, channel in enumerate(["red","green", "blue"]):
-                    logging.info(_("Adjust {} channel").format(channel))
-                    total_scale = channel_scale[channel]
-                    current_scale = 1
-                    step = 0.00390625
-                    target = target_rgb_pq[idx]
-                    done = False
-                    last_ratio = None
-                    while 1:
-                        self.preview_var.set(True)
-                        logging.info(_("Grayscale {} loop {} channel {} target: PQ->{} RGB->{}").format(
-                            grayscale, loop_count, channel, target_rgb_pq, rgb_pq))
-                        self.proc_color_write.write_rgb(rgb_pq, delay=0.1)
-                        measure_xyz = np.array(self.proc_color_reader.read_XYZ())
-                        measure_rgb_pq = XYZ_to_BT2020_PQ_rgb(measure_xyz/10000)
-                        measure = measure_rgb_pq[idx]
-                        ratio = measure / target
-                        total_ratio = (measure_rgb_pq / target_rgb_pq).round(4).tolist()
-                        if last_ratio is None:
-                            last_ratio = ratio
-                        logging.info(_("Grayscale {} loop {} channel {} measured: XYZ->{} PQ->{} "
-                                       "ratio->{} total_ratio->{} scale->{}").format(
-                            grayscale, loop_count, channel,
-                            measure_xyz.round(4).tolist(),
-                            measure_rgb_pq,
-                            round(ratio, 4),
-                            total_ratio,
-                            round(current_scale, 4)))
-
-                        if ratio > 1:
-                            if current_scale > 1:
-                                # 加超了
-                                last = abs(last_ratio - 1)
-                                current = abs(ratio - 1)
-                                if current >= last:
-                                    current_scale -= step
-                                done = True
-                            else:
-                                current_scale -= step
-                        elif ratio < 1:
-                            if current_scale < 1:
-                                # 减超了
-                                last = abs(last_ratio - 1)
-                                current = abs(ratio - 1)
-                                if current >= last:
-                                    current_scale += step
-                                done = True
-                            else:
-                                current_scale += step
-                        else:
-                            done = True
-                        scale = total_scale + current_scale - 1
-                        pq_lut_scale = lut_scale(pq_lut_origin[channel], scale)
-                        pq_lut_scale[0] = 0
-                        self.MHC2[f"{channel}_lut"] = pq_lut_scale.tolist()
-                        self.icc_handle.write_MHC2(self.MHC2)
-                        last_ratio = ratio
-                        if done:
-                            channel_scale[channel] = scale
-                            logging.info(_("Grayscale {} loop {} channel {} adjusted, scale {}").format(
-                                grayscale, loop_count, channel, scale))
-                            break
-                logging.info(_("Grayscale {} loop {} calibration done, red {} green {} blue {}").format(
-                    grayscale, loop_count,
-                    channel_scale["red"], channel_scale["green"], channel_scale["blue"]))
+            # solve all three channel scales together, starting from the previous gray level
+            solver = WhiteScaleSolver(target_rgb_pq[0], scales=last_scales)
+            while not solver.done:
+                for idx, channel in enumerate(["red", "green", "blue"]):
+                    pq_lut_scale = lut_scale(pq_lut_origin[channel], solver.scales[idx])
+                    pq_lut_scale[0] = 0
+                    self.MHC2[f"{channel}_lut"] = pq_lut_scale.tolist()
+                self.MHC2["entry_count"] = len(pq_lut_origin["red"])
+                self.icc_handle.write_MHC2(self.MHC2)
+                self.preview_var.set(True)
+                measure_xyz = np.array(self.sequencer.measure(rgb_pq).XYZ)
+                current_scales = solver.scales.round(5).tolist()
+                solver.update(measure_xyz)
+                logging.info(_("Grayscale {} reading {} scales {} measured: XYZ->{} ratio->{}").format(
+                    grayscale, solver.readings, current_scales,
+                    measure_xyz.round(4).tolist(), solver.ratio.round(4).tolist()))
+            if solver.best_error > solver.tol:
+                logging.warning(_("Grayscale {} did not converge within {} readings, best ratio error {}").format(
+                    grayscale, solver.readings, round(solver.best_error, 4)))
+            last_scales = solver.best_scales
+            solver_readings += solver.readings
+            walk_readings += fixed_step_readings(solver.best_scales)
+            channel_scale = {"grayscale": grayscale, "red": float(last_scales[0]),
+                             "green": float(last_scales[1]), "blue": float(last_scales[2])}
+            for idx, channel in enumerate(["red", "green", "blue"]):
+                pq_lut_scale = lut_scale(pq_lut_origin[channel], last_scales[idx])
+                pq_lut_scale[0] = 0
+                self.MHC2[f"{channel}_lut"] = pq_lut_scale.tolist()
+            self.icc_handle.write_MHC2(self.MHC2)
+            self.preview_var.set(True)
+            logging.info(_("Grayscale {} calibration done in {} readings, red {} green {} blue {}").format(
+                grayscale, solver.readings,
+                channel_scale["red"], channel_scale["green"], channel_scale["blue"]))
             scales.append(channel_scale)
-            self.proc_color_write.write_rgb(rgb_pq, delay=0.3)
-            measure_xyz = np.array(self.proc_color_reader.read_XYZ())
+            measure_xyz = np.array(self.sequencer.measure(Patch(rgb_pq, settle=0.3)).XYZ)
             measure_rgb_pq = XYZ_to_bt2020_linear(measure_xyz/10000)
             logging.info(_("Grayscale {} post-calibration: CIEXYZ->{} Linear RGB:{}->{}").format(
                 grayscale, measure_xyz, target_rgb_pq, measure_rgb_pq))
         logging.info(_("All grayscale calibration finished, scales: {}").format(scales))
+        logging.info(_("White balance used {} readings, the fixed-step walk needs about {} ({} saved)").format(
+            solver_readings, walk_readings, walk_readings - solver_readings))
         last_activated_scale = None
         target_pq_lut_red = copy.deepcopy(pq_lut_origin["red"])
         target_pq_lut_green = copy.deepcopy(pq_lut_origin["green"])
@@ -1448,24 +1602,61 @@ class HDRCalibrationUI:
     
     def calibrate_pq(self, eetf=False):
         self.preview_var.set(True)
+        self.journal_stage("calibrate_pq")
         logging.info(_("Start calibrating PQ grayscale curve"))
-        self.measured_pq["red"] = []
-        self.measured_pq["green"] = []
-        self.measured_pq["blue"] = []
         wp = [float(x.strip()) for x in self.white_point_var.get().split(",")]
         m = calculate_bradford_matrix(wp, D65_WHITE_POINT)
-        num = int(self.pq_points_var.get())
-        for idx, grayscale in enumerate(np.linspace(0, 1023, num, endpoint=True).round().astype(np.int32)):
-            grayscale = int(grayscale)
-            rgb = [grayscale, grayscale, grayscale]
-            self.proc_color_write.write_rgb(rgb, delay=0.03)
-            XYZ = self.proc_color_reader.read_XYZ()
+        adaptive = self.pq_points_var.get() == _("Adaptive")
+        num = self.ADAPTIVE_PQ_MAX_READINGS if adaptive else int(self.pq_points_var.get())
+        measured = {}
+        reuse = {}
+        if self.gray_readings["key"] == self.signal_path_key():
+            reuse = self.gray_readings["XYZ"]
+
+        def add(code, XYZ):
             XYZ_converted = m@XYZ
             rgb_measured = XYZ_to_BT2020_PQ_rgb(XYZ_converted/10000)
-            logging.info(_("({}/{}) Output RGB: {} Measured XYZ: {} RGB: {}").format(idx+1, num, rgb, XYZ, rgb_measured*1023))
-            self.measured_pq["red"].append(float(rgb_measured[0]))
-            self.measured_pq["green"].append(float(rgb_measured[1]))
-            self.measured_pq["blue"].append(float(rgb_measured[2]))
+            measured[code] = rgb_measured
+            logging.info(_("({}/{}) Output RGB: {} Measured XYZ: {} RGB: {}").format(
+                len(measured), num, [code] * 3, XYZ, rgb_measured*1023))
+
+        def measure(codes):
+            codes = [int(g) for g in codes if int(g) not in measured]
+            for g in codes:
+                if g in reuse:
+                    add(g, reuse[g])
+            patches = [Patch([g] * 3, settle=0.03) for g in codes if g not in reuse]
+            for result in self.sequencer.run(patches, averaging=self.averaging_policy):
+                add(result.patch.rgb[0], result.XYZ)
+
+        if reuse:
+            logging.info(_("Reusing {} gray readings from the gamut measurement").format(len(reuse)))
+        if adaptive:
+            # every reused reading is a valid sample of the curve
+            for g, XYZ in reuse.items():
+                add(g, XYZ)
+            # coarse sweep, then add codes only where the predicted interpolation error exceeds the budget
+            measure(np.linspace(0, 1023, self.ADAPTIVE_PQ_COARSE_POINTS).round().astype(np.int32).tolist())
+            while len(measured) < num:
+                codes = sorted(measured)
+                new_codes, predicted = plan_gray_refinement(
+                    codes, [measured[c] for c in codes],
+                    budget=self.ADAPTIVE_PQ_BUDGET, max_new=num - len(measured))
+                logging.info(_("Adaptive grayscale: {} readings, predicted max dE_ITP {:.2f}, {} codes added").format(
+                    len(measured), predicted, len(new_codes)))
+                if not new_codes:
+                    break
+                # start from the end nearest to the last patch to avoid a large transition
+                last = next(reversed(measured))
+                measure(new_codes[::-1] if last > 511 else new_codes)
+            codes = sorted(measured)
+            curves = resample_measured_pq(codes, [measured[c] for c in codes])
+        else:
+            measure(np.linspace(0, 1023, num, endpoint=True).round().astype(np.int32).tolist())
+            curves = np.array([measured[c] for c in sorted(measured)])
+        self.measured_pq["red"] = curves[:, 0].tolist()
+        self.measured_pq["green"] = curves[:, 1].tolist()
+        self.measured_pq["blue"] = curves[:, 2].tolist()
 
         eetf_args = None
         if eetf:
@@ -1509,6 +1700,8 @@ class HDRCalibrationUI:
         self.proc_color_write = ColorWriter()
         args = self.get_spotread_args()
         self.proc_color_reader = ColorReader(args)
+        self.sequencer = PatchSequencer(
+            self.proc_color_write, self.proc_color_reader, settle=self.settle_policy)
         if self.proc_color_reader.status == "need_calibration":
             while 1:
                 msg = _("Spot read needs a calibration before continuing \nPlace the instrument on its reflective white reference then click OK.")
@@ -1533,23 +1726,25 @@ class HDRCalibrationUI:
             self.clean_color_rw_process()
             logging.info(_("User canceled measurement"))
             return
+        self.open_journal("measure_pq")
         self.freeze_ui()
         logging.info(_("Start measuring PQ response"))
         def m():
+            self.journal_stage("measure_pq")
             target_white_xyz = []
             target_pq = []
             measured_pq = []
             measured_white_xyz = []
             num = 256
 
-            for idx, grayscale in enumerate(np.linspace(0, 1023, num, endpoint=True).round().astype(np.int32)):
-                grayscale = int(grayscale)
-                pq = grayscale / 1023
+            grayscales = np.linspace(0, 1023, num, endpoint=True).round().astype(np.int32)
+            patches = [[int(g)] * 3 for g in grayscales]
+            for idx, result in enumerate(self.sequencer.run(patches)):
+                rgb = result.patch.rgb
+                pq = rgb[0] / 1023
                 target_white_xyz.append(BT2020_PQ_rgb_to_XYZ([pq, pq, pq]))
                 target_pq.append(pq)
-                rgb = [grayscale, grayscale , grayscale]
-                self.proc_color_write.write_rgb(rgb, delay=0.1)
-                XYZ = np.array(self.proc_color_reader.read_XYZ())
+                XYZ = np.array(result.XYZ)
                 logging.info(_("({}/{}) Measure RGB: {} Result: {}").format(idx+1, num, rgb, XYZ))
                 measured_white_xyz.append([itm/10000 for itm in XYZ])
                 nit = float(XYZ[1])
@@ -1565,15 +1760,17 @@ class HDRCalibrationUI:
             measured_colored_xyz = []
             num = len(target_colored_xyz)
             logging.info(_("Start measuring color points"))
-            for idx, xyz in enumerate(target_colored_xyz):
-                rgb = (XYZ_to_BT2020_PQ_rgb(xyz) * 1023).round().astype(int).tolist()
-                self.proc_color_write.write_rgb(rgb, delay=0.1)
-                XYZ = np.array(self.proc_color_reader.read_XYZ())
+            patches = [Patch((XYZ_to_BT2020_PQ_rgb(xyz) * 1023).round().astype(int).tolist(), meta=xyz)
+                       for xyz in target_colored_xyz]
+            for idx, result in enumerate(self.sequencer.run(patches)):
+                rgb, xyz = result.patch.rgb, result.patch.meta
+                XYZ = np.array(result.XYZ)
                 logging.info(_("({}/{}) Measure RGB: {} Target XYZ:{} Result: {}").format(
                     idx+1, num, rgb, xyz, XYZ/10000))
                 measured_colored_xyz.append([itm/10000 for itm in XYZ])
             
             logging.info(_("Measurement finished: {}").format(len(measured_colored_xyz)))
+            self.finish_journal()
 
             return {
                 "target_xyz": np.array(target_white_xyz),
@@ -1755,6 +1952,8 @@ class HDRCalibrationUI:
         self.proc_color_write = ColorWriter()
         args = self.get_spotread_args()
         self.proc_color_reader = ColorReader(args)
+        self.sequencer = PatchSequencer(
+            self.proc_color_write, self.proc_color_reader, settle=self.settle_policy)
         if self.proc_color_reader.status == "need_calibration":
             while 1:
                 msg = _("Spot read needs a calibration before continuing \nPlace the instrument on its reflective white reference then click OK.")
@@ -1780,19 +1979,21 @@ class HDRCalibrationUI:
             self.clean_color_rw_process()
             logging.info(_("User canceled measurement"))
             return
+        self.open_journal("color_accuracy")
         def cb(result):
             pass
         def m():
+            self.journal_stage("color_accuracy")
             real_xyz = []
             logging.info(_("Measured RGB list: {}").format(rgb_list))
             l = len(rgb_list)
-            for i, rgb in enumerate(rgb_list):
-                self.proc_color_write.write_rgb(rgb, delay=0.1)
-                XYZ = self.proc_color_reader.read_XYZ()
+            for i, result in enumerate(self.sequencer.run(rgb_list)):
+                rgb, XYZ = result.patch.rgb, result.XYZ
                 logging.info(_("({}/{}) Measure RGB: {} Target XYZ:{} Result: {}").format(
                     i+1, l, rgb, xyz_list[i], XYZ))
                 real_xyz.append([float(itm) / 10000 for itm in XYZ])
 
+            self.finish_journal()
             self.clean_color_rw_process()
             de_list = []
             for idx in range(len(real_xyz)):
@@ -1,137 +1,360 @@
 import subprocess
-import wexpect
+import threading
+import queue
+import collections
+import codecs
+import shlex
+import logging
+import tempfile
 import time
 import sys
 import re
 import os
 import numpy as np
+try:
+    import wexpect
+except ImportError:
+    # 非 Windows 环境只能使用 PipeTransport / 模拟仪器
+    wexpect = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# 设置 RWHC_INSTRUMENT=fake 时 ColorReader/ColorWriter 改用 fake_instrument.py 模拟的
+# spotread/dogegen（管道后端），可在无仪器、非 Windows 环境跑完整测量流程；
+# RWHC_INSTRUMENT=sim 时改用进程内虚拟 HDR 面板（panel_sim.py），带模拟时钟与统计
+# 两种模式下都不安装 / 关联系统配置文件（见 simulated_display）
+INSTRUMENT_ENV = "RWHC_INSTRUMENT"
+FAKE_INSTRUMENT = os.path.join(BASE_DIR, "fake_instrument.py")
+
+# 传输后端协议：
+#   读数端（ColorReader / spotread）：read(size)、send(s)、close()
+#   画面端（ColorWriter / dogegen）：send(s)、readline()、sleep(seconds)、now()、close()
+# 每个后端只实现其使用方需要的协议；PipeTransport 两端通用。
+
+
+class TransportEOF(EOFError):
+    """子进程输出结束或管道已关闭。"""
+
+
+class SpawnTransport:
+    """
+    wexpect 控制台后端（读数端协议）：spotread 只在真实控制台下输出提示符，需要用它。
+    read 在 wexpect 管道上阻塞，空闲时约 20ms 返回一次空串。
+    """
+    def __init__(self, command, args=(), env=None, timeout=10):
+        if wexpect is None:
+            raise RuntimeError("wexpect is not available, use PipeTransport instead")
+        self.instance = wexpect.spawn(command, args,
+                                      env=env or os.environ.copy(), timeout=timeout)
+
+    def read(self, size=1000):
+        try:
+            return self.instance.read_nonblocking(size=size)
+        except wexpect.EOF as e:
+            raise TransportEOF(str(e)) from e
+
+    def send(self, s):
+        try:
+            self.instance.send(s)
+        except wexpect.EOF as e:
+            raise TransportEOF(str(e)) from e
+
+    def close(self):
+        if self.instance.isalive():
+            self.instance.terminate()
+
+
+class PipeTransport:
+    """
+    stdin/stdout 管道后端（dogegen 以及 Python 模拟仪器），读数端与画面端协议都支持。
+    read 阻塞到有数据为止，返回已到达的部分；readline 读一整行。
+    sleep 为画面稳定等待，虚拟面板后端会改为推进模拟时钟。
+    """
+    def __init__(self, command, args=(), env=None):
+        if isinstance(args, str):
+            args = shlex.split(args)
+        self.instance = subprocess.Popen(
+            [command, *args],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            env=env,
+            bufsize=0,
+        )
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    def read(self, size=1000):
+        data = os.read(self.instance.stdout.fileno(), size)
+        if not data:
+            raise TransportEOF("pipe closed")
+        return self._decoder.decode(data)
+
+    def send(self, s):
+        try:
+            self.instance.stdin.write(s.encode())
+            self.instance.stdin.flush()
+        except (BrokenPipeError, OSError) as e:
+            raise TransportEOF(str(e)) from e
+
+    def readline(self):
+        line = self.instance.stdout.readline()
+        if not line:
+            raise TransportEOF("pipe closed")
+        return line.decode(errors="replace")
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def now(self):
+        return time.monotonic()
+
+    def close(self):
+        if self.instance.poll() is None:
+            self.instance.terminate()
+
+
+def use_fake_instrument():
+    return os.environ.get(INSTRUMENT_ENV, "").lower() == "fake"
+
+
+def simulated_display():
+    """RWHC_INSTRUMENT 为 fake 或 sim 时画面由模拟仪器显示，不应安装 / 关联系统配置文件。"""
+    return os.environ.get(INSTRUMENT_ENV, "").lower() in ("fake", "sim")
+
+
+def virtual_panel():
+    """RWHC_INSTRUMENT=sim 时返回进程内共享的虚拟面板（panel_sim.VirtualPanel），否则 None。"""
+    if os.environ.get(INSTRUMENT_ENV, "").lower() != "sim":
+        return None
+    from panel_sim import shared_panel
+    return shared_panel()
+
+
+def fake_instrument_transport(role, args=()):
+    """启动模拟仪器，role 为 "spotread" 或 "dogegen"。两个进程通过状态文件共享当前画面。"""
+    if isinstance(args, str):
+        args = shlex.split(args)
+    os.environ.setdefault("RWHC_FAKE_STATE", os.path.join(
+        tempfile.gettempdir(), f"rwhc_fake_display_{os.getpid()}.json"))
+    return PipeTransport(sys.executable, [FAKE_INSTRUMENT, role, *args],
+                         env=os.environ.copy())
+
+# spotread 输出匹配（预编译）
+_LINE_SPLIT = re.compile(r"\r\n|\r|\n")
+_PROMPT_PATTERNS = (
+    ("prompt", re.compile(r"key to take a reading:")),
+    ("need_calibration", re.compile(r"Spot read needs a calibration before continuing")),
+    ("calibration_failed", re.compile(r"Calibration failed")),
+)
+_RESULT_RE = re.compile(r"Result is XYZ:\s*([-+0-9.eE]+)\s+([-+0-9.eE]+)\s+([-+0-9.eE]+)")
+# 未换行的残余输出（提示符不换行）最多保留的字符数
+_MAX_PARTIAL = 4096
+# 读到空数据时的等待；wexpect 管道本身阻塞读，约 20ms 推送一次，这里只是兜底
+_IDLE_WAIT = 0.005
+
 
 class ColorReader:
-    def __init__(self, args):
+    """
+    spotread 会话。后台线程阻塞读取输出、按行切分并匹配提示符/读数，
+    解析结果通过队列交给调用方，等待期间不占用 CPU。
+    事件：("prompt",) ("need_calibration",) ("calibration_failed",)
+         ("xyz", ndarray) ("eof", 异常或 None)
+    """
+    def __init__(self, args, transport=None):
+        """
+        args: spotread 参数
+        transport: 读数端传输后端（read/send/close）；默认 spawn spotread.exe，
+                   RWHC_INSTRUMENT=fake 时使用模拟仪器
+        """
         self.args_list = args
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        execute = os.path.join(base_dir, "bin", "spotread.exe")
-        print(execute, self.args_list)
-        self.instance = wexpect.spawn(execute, self.args_list,
-                                    env=os.environ.copy(), timeout=10)
+        if transport is None:
+            panel = virtual_panel()
+            if panel is not None:
+                transport = panel.spotread_transport()
+            elif use_fake_instrument():
+                transport = fake_instrument_transport("spotread", args)
+            else:
+                execute = os.path.join(BASE_DIR, "bin", "spotread.exe")
+                logging.debug("spotread: %s %s", execute, self.args_list)
+                transport = SpawnTransport(execute, self.args_list)
+        self.instance = transport
         self.status = "init"
-        s = ""
-        timeout = 15
-        start = time.time()
+        self.events = queue.Queue()
+        # 最近的输出行，出错时写入日志
+        self.recent_lines = collections.deque(maxlen=200)
+        self._partial = ""
+        self._partial_emitted = set()
+        # read_XYZ 拿到读数后提前返回，其后的提示符属于上一次读数，需要跳过
+        self._stale_prompts = 0
+        self._eof = False
+        self._reader = threading.Thread(target=self._read_loop, daemon=True)
+        self._reader.start()
+
+        event = self._wait_event(("prompt", "need_calibration"), 15, "init ColorReader time out")
+        if event[0] == "prompt":
+            self.status = "ready"
+        else:
+            self.status = "need_calibration"
+
+    def _read_loop(self):
+        while True:
+            try:
+                chunk = self.instance.read(size=1000)
+            except TransportEOF:
+                self._flush_partial()
+                self.events.put(("eof", None))
+                return
+            except Exception as e:
+                self._flush_partial()
+                self.events.put(("eof", e))
+                return
+            if not chunk:
+                time.sleep(_IDLE_WAIT)
+                continue
+            self._feed(chunk)
+
+    def _feed(self, chunk):
+        *lines, partial = _LINE_SPLIT.split(self._partial + chunk)
+        for line in lines:
+            self._scan(line, self._partial_emitted)
+            self._partial_emitted = set()
+            self.recent_lines.append(line)
+        if len(partial) > _MAX_PARTIAL:
+            partial = partial[-_MAX_PARTIAL:]
+        self._partial = partial
+        if partial:
+            # 提示符不带换行，残余部分也要匹配；同一行只触发一次
+            self._scan(partial, self._partial_emitted, complete=False)
+
+    def _flush_partial(self):
+        if self._partial:
+            self._scan(self._partial, self._partial_emitted)
+            self.recent_lines.append(self._partial)
+            self._partial = ""
+
+    def _scan(self, line, emitted, complete=True):
+        for name, pattern in _PROMPT_PATTERNS:
+            if name not in emitted and pattern.search(line):
+                emitted.add(name)
+                self.events.put((name,))
+        if complete:
+            match = _RESULT_RE.search(line)
+            if match:
+                self.events.put(("xyz", np.array([float(v) for v in match.groups()])))
+
+    def _drain(self):
+        while True:
+            try:
+                event = self.events.get_nowait()
+            except queue.Empty:
+                return
+            if event[0] == "prompt" and self._stale_prompts > 0:
+                self._stale_prompts -= 1
+            elif event[0] == "eof":
+                self._eof = True
+        if self._eof:
+            raise RuntimeError("spotread exit unexpectedly")
+
+    def _wait_event(self, names, timeout, timeout_msg):
+        deadline = time.time() + timeout
         while 1:
+            if self._eof:
+                raise RuntimeError("spotread exit unexpectedly")
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise TimeoutError(timeout_msg)
             try:
-                ret = self.instance.read_nonblocking()
-                if ret:
-                    s += ret
-            except wexpect.EOF:
-                print(s)
+                event = self.events.get(timeout=remaining)
+            except queue.Empty:
+                raise TimeoutError(timeout_msg)
+            if event[0] == "eof":
+                self._eof = True
+                if "eof" in names:
+                    return event
+                logging.error("spotread exit unexpectedly, recent output:\n%s", "\n".join(self.recent_lines))
                 raise RuntimeError("spotread exit unexpectedly")
-            if time.time() - start > timeout:
-                raise TimeoutError("init ColorReader time out")
-            if "key to take a reading:" in s:
-                self.status = "ready"
-                break
-            if "Spot read needs a calibration before continuing" in s:
-                self.status = "need_calibration"
-                break
-    
+            if event[0] == "prompt" and self._stale_prompts > 0:
+                self._stale_prompts -= 1
+                continue
+            if event[0] in names:
+                return event
+
     def calibrate(self):
+        self._drain()
         self.instance.send("x")
-        s = ""
-        timeout = 15
-        start = time.time()
-        while 1:
-            try:
-                ret = self.instance.read_nonblocking(size=1000)
-                if ret:
-                    s += ret
-            except wexpect.EOF:
-                raise RuntimeError("spotread exit unexpectedly during calibration")
-            if "key to take a reading:" in s:
-                self.status = "ready"
-                break
-            if "Calibration failed" in s:
-                self.status = "need_calibration"
-                break
-            time.sleep(0.0001)
-            if time.time() - start > timeout:
-                raise TimeoutError("calibrate time out")
+        event = self._wait_event(("prompt", "calibration_failed"), 15, "calibrate time out")
+        if event[0] == "prompt":
+            self.status = "ready"
+        else:
+            self.status = "need_calibration"
         return
 
     def read_XYZ(self):
+        self._drain()
         self.instance.send("x")
-        # Implement an expect-like mechanism to facilitate checking spotread's output.
-        s = ""
-        timeout = 30
-        start = time.time()
-        while 1:
-            ret = self.instance.read_nonblocking(size=1000)
-            s += ret
-            if "Place instrument on" in s:
-                for itm in s.splitlines():
-                    if "Result is XYZ:" in itm:
-                        s = itm
-                        match = re.search(r"XYZ: (.+), Yxy: (.+)", s)
-                        return np.array([float(itm) for itm in match.group(1).split(" ")])
-                break
-            time.sleep(0.0001)
-            if time.time() - start > timeout:
-                raise TimeoutError("read XYZ time out")
-        return 
+        event = self._wait_event(("xyz", "prompt"), 30, "read XYZ time out")
+        if event[0] == "xyz":
+            # 读数一出来就返回，随后的提示符由下一次等待跳过
+            self._stale_prompts += 1
+            return event[1]
+        # 出现提示符但没有读数（读数失败）
+        return
 
     def terminate(self):
-        self.instance.send("q")
-        self.instance.send("q")
-        s = ""
-        timeout = 50
-        start = time.time()
-        while 1:
-            try:
-                ret = self.instance.read_nonblocking()
-                if ret:
-                    s += ret
-            except wexpect.EOF:
-                # print(time.time()-start)
-                print(s)
-                break
-            time.sleep(0.0001)
-            if time.time() - start > timeout:
-                raise TimeoutError("terminate time out")
+        try:
+            self.instance.send("q")
+            self.instance.send("q")
+        except TransportEOF:
+            pass
+        if not self._eof:
+            self._wait_event(("eof",), 50, "terminate time out")
+        self._reader.join(timeout=1)
+        self.instance.close()
+        logging.debug("spotread output:\n%s", "\n".join(self.recent_lines))
         return
 
 class ColorWriter:
-    def __init__(self, mode="hdr_10"):
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        execute = os.path.join(base_dir, "bin", "dogegen.exe")
-        self.instance = subprocess.Popen(
-            [execute],                
-            stdin=subprocess.PIPE,     
-            stdout=subprocess.PIPE,    
-            stderr=subprocess.PIPE, 
-            text=True,                              
-        )
+    def __init__(self, mode="hdr_10", transport=None):
+        """
+        transport: 画面端传输后端（send/readline/sleep/now/close）；默认管道启动 dogegen.exe，
+                   RWHC_INSTRUMENT=fake 时使用模拟仪器
+        """
+        if transport is None:
+            panel = virtual_panel()
+            if panel is not None:
+                transport = panel.dogegen_transport()
+            elif use_fake_instrument():
+                transport = fake_instrument_transport("dogegen")
+            else:
+                transport = PipeTransport(os.path.join(BASE_DIR, "bin", "dogegen.exe"))
+        self.instance = transport
         self.mode = mode
         if self.mode == "hdr_10":
             # 10bit HDR，0-1023
-            self.instance.stdin.write("mode 10_hdr \n")  
+            self.instance.send("mode 10_hdr \n")
         elif self.mode == "hdr_8":
             # 8bit HDR，0-255
-            self.instance.stdin.write("mode 8_hdr \n") 
+            self.instance.send("mode 8_hdr \n")
         elif self.mode == "sdr_10":
-            self.instance.stdin.write("mode 10 \n")
+            self.instance.send("mode 10 \n")
         elif self.mode == "sdr_8":
-            self.instance.stdin.write("mode 8 \n")
-        self.instance.stdin.flush()
-        self.instance.stdout.readline()
+            self.instance.send("mode 8 \n")
+        self.instance.readline()
         self.count = 0
 
     def write_rgb(self, rgb, delay=0):
         command = f"window 100 {rgb[0]} {rgb[1]} {rgb[2]} \r\n"
-        self.instance.stdin.write(command)
-        self.instance.stdin.flush()
-        ret = self.instance.stdout.readline()
+        self.instance.send(command)
+        ret = self.instance.readline()
         self.count += 1
-        time.sleep(delay)
+        self.instance.sleep(delay)
+
+    def wait(self, seconds):
+        """等待画面稳定（虚拟面板下推进模拟时钟）。"""
+        self.instance.sleep(seconds)
+
+    def now(self):
+        """与 wait 同一时钟的当前时间（秒）。"""
+        return self.instance.now()
 
     def write_grayscale(self, color="white"):
         rgb_target = {"white": (1, 1, 1),
@@ -147,10 +370,8 @@ class ColorWriter:
         elif self.mode in ["hdr_8", "sdr_8"]:
             rgb_real = [itm * 255 for itm in rgb_target]
         command = f"draw -1 1 1 -1 0 0 0 {rgb_real[0]} {rgb_real[1]} {rgb_real[2]} 0 0 0 {rgb_real[0]} {rgb_real[1]} {rgb_real[2]} 1 \r\n"
-        self.instance.stdin.write(command)
-        self.instance.stdin.flush()
-        ret = self.instance.stdout.readline()
+        self.instance.send(command)
+        ret = self.instance.readline()
 
     def terminate(self):
-        if self.instance.poll() is None:
-            self.instance.terminate()
\ No newline at end of file
+        self.instance.close()
\ No newline at end of file
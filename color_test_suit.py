@@ -33,32 +33,41 @@ def ymax_for_xy_with_M(M_device, xy, caps=(1.0, 1.0, 1.0), tol=1e-12):
     xy: (x, y)
     caps: 每通道线性上限（考虑提前夹顶；默认全 1）
     """
-    M = np.array(M_device, float)
-    Minv = np.linalg.inv(M)
-    x, y = xy
-    if y <= 0:
-        return 0.0
+    return float(ymax_for_many_with_M(M_device, [xy], caps, tol)[0])
+
+def ymax_for_many_with_M(M_device, xys, caps=(1.0, 1.0, 1.0), tol=1e-12):
+    """
+    批量版本：xys 为 [(x1,y1), (x2,y2), ...] 或 (..., 2) 数组，返回 Ymax 数组（形状为 xys 去掉最后一维）。
+    M 只求逆一次，所有色度一次矩阵乘完成；y<=0、色域外（需要负通道）、无正分量的点返回 0。
+    """
+    Minv = np.linalg.inv(np.array(M_device, float))
+    xys = np.asarray(xys, dtype=float)
+    if xys.size == 0:
+        xys = xys.reshape(0, 2)
+    if xys.shape[-1:] != (2,):
+        raise ValueError("xys must have shape (..., 2)")
+    shape = xys.shape[:-1]
+    xys = xys.reshape(-1, 2)
+    x, y = xys[:, 0], xys[:, 1]
 
-    # 每 1 nit 该色所需的设备线性 RGB
-    X_unit = np.array([x/y, 1.0, (1-x-y)/y], float)
-    r_perY = Minv @ X_unit
+    valid = y > 0
+    y_safe = np.where(valid, y, 1.0)
+    # 每 1 nit 该色所需的设备线性 RGB，(N,3)
+    X_unit = np.column_stack([x / y_safe, np.ones_like(x), (1 - x - y) / y_safe])
+    r_perY = X_unit @ Minv.T
 
     # 色域外：需要负通道
-    if np.any(r_perY < -tol):
-        return 0.0
+    valid &= ~np.any(r_perY < -tol, axis=1)
 
     # 仅正分量限制缩放
     pos = r_perY > tol
-    if not np.any(pos):
-        return 0.0
+    valid &= np.any(pos, axis=1)
 
-    caps = np.array(caps, float)
-    Y_max = np.min(caps[pos] / r_perY[pos])  
-    return float(max(0.0, Y_max))
-
-def ymax_for_many_with_M(M_device, xys, caps=(1.0, 1.0, 1.0), tol=1e-12):
-    """批量版本：xys 为 [(x1,y1), (x2,y2), ...]，返回 numpy.array([Ymax...])"""
-    return np.array([ymax_for_xy_with_M(M_device, xy, caps, tol) for xy in xys], dtype=float)
+    caps = np.broadcast_to(np.asarray(caps, float), (3,))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = np.where(pos, caps / np.where(pos, r_perY, 1.0), np.inf)
+    Y_max = np.where(valid, np.maximum(ratio.min(axis=1), 0.0), 0.0)
+    return Y_max.reshape(shape)
 
 
 def ymax_from_defined_primaries(xy_R, xy_G, xy_B, xy_W, xy, caps=(1.0,1.0,1.0)):
@@ -77,7 +86,7 @@ def ymax_many_from_defined_primaries(xy_R, xy_G, xy_B, xy_W, xys, caps=(1.0,1.0,
         M = build_rgb_to_xyz_from_primaries(xy_R, xy_G, xy_B, xy_W)
     except np.linalg.LinAlgError:
         return np.zeros(len(xys), dtype=float)
-    return np.array([ymax_for_xy_with_M(M, xy, caps) for xy in xys], dtype=float)
+    return ymax_for_many_with_M(M, xys, caps)
 
 # 人眼敏感色 
 sRGB_test_colors_xy = [
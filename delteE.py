@@ -2,15 +2,26 @@ import numpy as np
 from convert_utils import *
 from meta_data import *
 
+# XYZdeltaE2000 使用的参考白（1000 nit D65，PQ 归一化），只计算一次
+D65_1000NIT_WHITE_XYZ = xyY_to_XYZ([*D65_WHITE_POINT, 1000])
+
 def deltaE2000(lab1, lab2, kL=1, kC=1, kH=1):
-    L1, a1, b1 = lab1
-    L2, a2, b2 = lab2
+    """
+    CIEDE2000 色差，向量化实现。
+    lab1, lab2: 形状 (3,) 或 (...,3) 的 Lab，两者可互相广播
+    返回: 标量或形状 (...) 的 dE2000
+    """
+    lab1 = np.asarray(lab1, dtype=float)
+    lab2 = np.asarray(lab2, dtype=float)
+    L1, a1, b1 = lab1[..., 0], lab1[..., 1], lab1[..., 2]
+    L2, a2, b2 = lab2[..., 0], lab2[..., 1], lab2[..., 2]
 
     C1 = np.hypot(a1, b1)
     C2 = np.hypot(a2, b2)
     avg_C = (C1 + C2) / 2.0
 
-    G = 0.5 * (1 - np.sqrt((avg_C**7) / (avg_C**7 + 25**7)))
+    avg_C7 = avg_C**7
+    G = 0.5 * (1 - np.sqrt(avg_C7 / (avg_C7 + 25**7)))
     a1p = (1 + G) * a1
     a2p = (1 + G) * a2
     C1p = np.hypot(a1p, b1)
@@ -23,20 +34,20 @@ def deltaE2000(lab1, lab2, kL=1, kC=1, kH=1):
     dLp = L2 - L1
     dCp = C2p - C1p
 
+    # 色相差绕回到 [-180, 180]，任一彩度为 0 时色相差无意义，置 0
+    zero_c = (C1p * C2p) == 0
     dhp = h2p - h1p
-    if dhp > 180: dhp -= 360
-    elif dhp < -180: dhp += 360
-    if C1p * C2p == 0: dhp = 0.0
+    dhp = np.where(dhp > 180, dhp - 360, np.where(dhp < -180, dhp + 360, dhp))
+    dhp = np.where(zero_c, 0.0, dhp)
 
     dHp = 2 * np.sqrt(C1p * C2p) * np.sin(np.radians(dhp) / 2)
 
     avg_Lp = (L1 + L2) / 2.0
-    if abs(h1p - h2p) > 180:
-        avg_hp = (h1p + h2p + 360) / 2.0
-    else:
-        avg_hp = (h1p + h2p) / 2.0
-    if C1p * C2p == 0:
-        avg_hp = h1p + h2p
+    h_sum = h1p + h2p
+    avg_hp = np.where(np.abs(h1p - h2p) > 180,
+                      np.where(h_sum < 360, h_sum + 360, h_sum - 360) / 2.0,
+                      h_sum / 2.0)
+    avg_hp = np.where(zero_c, h_sum, avg_hp)
 
     T = (1
          - 0.17 * np.cos(np.radians(avg_hp - 30))
@@ -45,22 +56,25 @@ def deltaE2000(lab1, lab2, kL=1, kC=1, kH=1):
          - 0.20 * np.cos(np.radians(4 * avg_hp - 63)))
 
     d_ro = 30 * np.exp(-((avg_hp - 275) / 25)**2)
-    RC = 2 * np.sqrt((avg_Cp**7) / (avg_Cp**7 + 25**7))
+    avg_Cp7 = avg_Cp**7
+    RC = 2 * np.sqrt(avg_Cp7 / (avg_Cp7 + 25**7))
     SL = 1 + (0.015 * (avg_Lp - 50)**2) / np.sqrt(20 + (avg_Lp - 50)**2)
     SC = 1 + 0.045 * avg_Cp
     SH = 1 + 0.015 * avg_Cp * T
     RT = -np.sin(np.radians(2 * d_ro)) * RC
 
-    return np.sqrt(
-        (dLp / (kL * SL))**2 +
-        (dCp / (kC * SC))**2 +
-        (dHp / (kH * SH))**2 +
-        RT * (dCp / (kC * SC)) * (dHp / (kH * SH))
-    )
+    tL = dLp / (kL * SL)
+    tC = dCp / (kC * SC)
+    tH = dHp / (kH * SH)
+    return np.sqrt(tL**2 + tC**2 + tH**2 + RT * tC * tH)
 
 def XYZdeltaE2000(XYZ1, XYZ2):
-    lab1 = XYZ_to_Lab_pqnorm(XYZ1, xyY_to_XYZ([*D65_WHITE_POINT, 1000]).tolist())
-    lab2 = XYZ_to_Lab_pqnorm(XYZ2, xyY_to_XYZ([*D65_WHITE_POINT, 1000]).tolist())
+    """
+    PQ 归一化 XYZ 之间的 dE2000（参考白为 1000 nit D65）。
+    XYZ1, XYZ2: 形状 (3,) 或 (...,3)，可互相广播，一次调用完成整批计算
+    """
+    lab1 = XYZ_to_Lab_pqnorm(XYZ1, D65_1000NIT_WHITE_XYZ)
+    lab2 = XYZ_to_Lab_pqnorm(XYZ2, D65_1000NIT_WHITE_XYZ)
     return deltaE2000(lab1, lab2)
 
 def XYZdeltaE_ITP(XYZ1, XYZ2):
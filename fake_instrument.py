@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+模拟仪器：用 Python 进程代替 spotread.exe / dogegen.exe，协议与原程序一致，
+用于在没有色度计、非 Windows 的环境下运行与计时测量流程。
+
+    python fake_instrument.py dogegen            # 读 stdin 的 mode/window/draw 命令，每条回复一行
+    python fake_instrument.py spotread [args]    # 输出提示符，收到按键后输出 "Result is XYZ:"
+
+两个进程通过 RWHC_FAKE_STATE 指向的 json 文件共享当前显示的画面。
+面板模型：HDR 信号为 BT.2020 + PQ，面板原色为 P3-D65，按通道在峰值亮度处截断，
+叠加黑位；SDR 信号为 sRGB 原色 + gamma 2.2。可用环境变量调整：
+    RWHC_FAKE_PEAK       峰值亮度 nit（默认 1000）
+    RWHC_FAKE_SDR_WHITE  SDR 白亮度 nit（默认 200）
+    RWHC_FAKE_BLACK      黑位亮度 nit（默认 0.05）
+    RWHC_FAKE_NOISE      读数相对噪声标准差（默认 0）
+    RWHC_FAKE_READ_TIME  每次读数耗时 秒（默认 0）
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from meta_data import BT2020_xy, P3D65_xy, sRGB_xy, D65_WHITE_POINT
+from convert_utils import pq_eotf, xyY_to_XYZ
+from matrix import build_rgb_to_xyz_from_primaries
+
+PROMPT = ("\nPlace instrument on spot to be measured,\n"
+          "and hit [A-Z] to read white and setup FWA compensation (keyed to letter)\n"
+          "[a-z] to read and make FWA compensated reading from keyed reference\n"
+          "'r' to set reference, 's' to save spectrum,\n"
+          "'h' to toggle high res., 'k' to do a calibration\n"
+          "Hit ESC or Q to exit, any other key to take a reading: ")
+
+MODE_BITS = {"10_hdr": (10, True), "8_hdr": (8, True), "10": (10, False), "8": (8, False)}
+
+
+def _env_float(name, default):
+    return float(os.environ.get(name, default))
+
+
+def state_path():
+    return os.environ.get("RWHC_FAKE_STATE") or os.path.join(
+        tempfile.gettempdir(), "rwhc_fake_display.json")
+
+
+def write_state(state):
+    path = state_path()
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+
+def read_state():
+    try:
+        with open(state_path(), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"bits": 10, "hdr": True, "rgb": [0.0, 0.0, 0.0]}
+
+
+def _primaries_M(xy):
+    return build_rgb_to_xyz_from_primaries(xy["red"], xy["green"], xy["blue"], xy["white"])
+
+
+def panel_XYZ(rgb, hdr=True):
+    """
+    rgb: 归一化信号 (0..1)
+    返回面板发出的绝对 XYZ（cd/m²）。内部按项目约定使用 10000nit 归一化的 XYZ。
+    """
+    rgb = np.clip(np.asarray(rgb, dtype=float), 0.0, 1.0)
+    if hdr:
+        # 信号 BT.2020 线性（10000nit 归一化）-> XYZ -> 面板 P3 线性
+        XYZ = _primaries_M(BT2020_xy) @ (pq_eotf(rgb) / 10000)
+    else:
+        white = _env_float("RWHC_FAKE_SDR_WHITE", 200)
+        XYZ = _primaries_M(sRGB_xy) @ (np.power(rgb, 2.2) * white / 10000)
+    M_panel = _primaries_M(P3D65_xy)
+    panel_rgb = np.linalg.solve(M_panel, XYZ)
+    peak = _env_float("RWHC_FAKE_PEAK", 1000) / 10000
+    panel_rgb = np.clip(panel_rgb, 0.0, peak)
+    black = xyY_to_XYZ([*D65_WHITE_POINT, _env_float("RWHC_FAKE_BLACK", 0.05)])
+    return (M_panel @ panel_rgb + black) * 10000
+
+
+def apply_command(line, state):
+    """
+    解析一条 dogegen 命令并更新 state（bits/hdr/rgb）。
+    返回 False 表示退出命令，空行/未知命令保持 state 不变。
+    """
+    tokens = line.split()
+    if not tokens:
+        return True
+    cmd = tokens[0]
+    if cmd == "mode" and len(tokens) > 1 and tokens[1] in MODE_BITS:
+        state["bits"], state["hdr"] = MODE_BITS[tokens[1]]
+    elif cmd in ("window", "draw"):
+        # window <size> r g b / draw x1 y1 x2 y2 <bg rgb> <fg rgb> ... 取前景色
+        # window 记录色块占 dogegen 窗口面积的百分比：window 取 size，draw 取矩形（坐标 -1..1）面积
+        values = tokens[2:5] if cmd == "window" else tokens[8:11]
+        scale = (1 << state["bits"]) - 1
+        state["rgb"] = [float(v) / scale for v in values]
+        if cmd == "window":
+            state["window"] = float(tokens[1])
+        else:
+            x1, y1, x2, y2 = (float(v) for v in tokens[1:5])
+            state["window"] = abs(x2 - x1) * abs(y2 - y1) / 4 * 100
+    elif cmd in ("quit", "exit"):
+        return False
+    return True
+
+
+def format_result(XYZ):
+    """spotread 读数输出行（含前后换行）。"""
+    s = max(float(np.sum(XYZ)), 1e-12)
+    return ("\n Result is XYZ: {:.6f} {:.6f} {:.6f}, Yxy: {:.6f} {:.6f} {:.6f}\n"
+            .format(*XYZ, XYZ[1], XYZ[0] / s, XYZ[1] / s))
+
+
+def run_dogegen():
+    state = read_state()
+    for line in sys.stdin:
+        if not line.split():
+            continue
+        if not apply_command(line, state):
+            break
+        write_state(state)
+        sys.stdout.write("OK\n")
+        sys.stdout.flush()
+
+
+def run_spotread(args):
+    rng = np.random.default_rng()
+    noise = _env_float("RWHC_FAKE_NOISE", 0)
+    read_time = _env_float("RWHC_FAKE_READ_TIME", 0)
+    out = sys.stdout
+    out.write("Spot read: fake instrument\n")
+    out.write(PROMPT)
+    out.flush()
+    stdin = sys.stdin.buffer
+    while True:
+        key = stdin.read(1)
+        if not key or key in (b"q", b"Q", b"\x1b"):
+            out.write("\n")
+            out.flush()
+            return
+        if read_time > 0:
+            time.sleep(read_time)
+        state = read_state()
+        XYZ = panel_XYZ(state["rgb"], state["hdr"])
+        if noise > 0:
+            XYZ = XYZ * (1 + noise * rng.standard_normal(3))
+        out.write(format_result(XYZ))
+        out.write(PROMPT)
+        out.flush()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ("spotread", "dogegen"):
+        sys.stderr.write("usage: fake_instrument.py spotread|dogegen [args...]\n")
+        sys.exit(2)
+    if sys.argv[1] == "dogegen":
+        run_dogegen()
+    else:
+        run_spotread(sys.argv[2:])
@@ -1,17 +1,140 @@
+import copy
+import functools
+import hashlib
+import mmap
 import struct
 import numpy as np
+
+
+def _tag_cached(tag=None):
+    """
+    lazy 模式下缓存 tag 的解码结果（返回深拷贝，调用方可以随意修改）。
+    tag 为 None 时取方法的第一个参数作为 tag 名。write_tag 该 tag 或 rebuild 后失效。
+    """
+    def deco(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            if not self.lazy:
+                return func(self, *args, **kwargs)
+            name = tag if tag is not None else args[0]
+            key = (name, func.__name__, args, tuple(sorted(kwargs.items())))
+            if key not in self._decoded:
+                self._decoded[key] = func(self, *args, **kwargs)
+            return copy.deepcopy(self._decoded[key])
+        return wrapper
+    return deco
+
+
+def eval_parametric_curve(func_type, params, x):
+    """
+    ICC parametricCurveType 求值（functionType 0..4），x 可为任意形状的数组，输入裁剪到 [0, 1]。
+    幂运算的底数小于 0 时按 0 处理。
+    """
+    x = np.clip(np.asarray(x, dtype=float), 0.0, 1.0)
+    if func_type == 0:
+        g, = params
+        return np.power(x, g)
+    if func_type == 1:
+        g, a, b = params
+        base = a * x + b
+        return np.where(base > 0, np.power(np.maximum(base, 0.0), g), 0.0)
+    if func_type == 2:
+        g, a, b, c = params
+        base = a * x + b
+        return np.where(base > 0, np.power(np.maximum(base, 0.0), g), 0.0) + c
+    if func_type == 3:
+        g, a, b, c, d = params
+        return np.where(x >= d, np.power(np.maximum(a * x + b, 0.0), g), c * x)
+    if func_type == 4:
+        g, a, b, c, d, e, f = params
+        return np.where(x >= d, np.power(np.maximum(a * x + b, 0.0), g) + e, c * x + f)
+    raise ValueError("Unsupported functionType")
+
+
 class ICCProfile:
-    def __init__(self, path):
-        with open(path, 'rb') as f:
-            self.data = bytearray(f.read())
+    def __init__(self, path, lazy=False):
+        """
+        lazy: True 时以只读 mmap 映射文件（无法映射时退回一次性读入 bytes），
+              tag 数据为映射上的 memoryview 切片，不复制；各 read_* 首次访问时才解码并缓存。
+              写入只替换对应 tag（写时复制），未修改的 tag 在 rebuild/save 前不会被复制。
+              映射期间文件保持打开，用完应调用 close() 或使用 with 语句。
+        """
+        self.lazy = lazy
+        self._mmap = None
+        self._decoded = {}
+        if not lazy:
+            with open(path, 'rb') as f:
+                self.data = bytearray(f.read())
+        else:
+            with open(path, 'rb') as f:
+                try:
+                    self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    self.data = memoryview(self._mmap)
+                except (ValueError, OSError):
+                    # 空文件或不支持映射的文件系统
+                    f.seek(0)
+                    self.data = memoryview(f.read())
+        self.tags = self._read_tag_table()
+
+    @classmethod
+    def from_bytes(cls, data, lazy=True):
+        """从内存中的配置文件构造；lazy 时 tag 为 data 上的零拷贝切片。"""
+        profile = cls.__new__(cls)
+        profile.lazy = lazy
+        profile._mmap = None
+        profile._decoded = {}
+        profile.data = memoryview(data).toreadonly() if lazy else bytearray(data)
+        profile.tags = profile._read_tag_table()
+        return profile
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """释放文件映射。数据（含已写入、未 rebuild 的 tag）先复制到内存，之后仍可读写。"""
+        if self._mmap is not None:
+            self._detach()
+
+    def _release_map(self):
+        if self._mmap is None:
+            return
+        for info in self.tags.values():
+            original = info.get('original_data')
+            if isinstance(original, memoryview):
+                original.release()
+                info.pop('original_data')
+        if isinstance(self.data, memoryview):
+            self.data.release()
+        self._decoded.clear()
+        self._mmap.close()
+        self._mmap = None
+
+    def _detach(self):
+        """
+        数据不是可写的 bytearray（文件映射或 from_bytes 的只读视图）时复制到内存，
+        释放映射，保留已写入的 new_data。
+        """
+        if isinstance(self.data, bytearray):
+            return
+        data = bytearray(self.data)
+        new_data = {tag: info['new_data'] for tag, info in self.tags.items() if 'new_data' in info}
+        added = {tag: dict(info) for tag, info in self.tags.items() if 'original_data' not in info}
+        self._release_map()
+        self.data = data
         self.tags = self._read_tag_table()
+        self.tags.update(added)
+        for tag, block in new_data.items():
+            self.tags[tag]['new_data'] = block
 
     def _read_tag_table(self):
         count = struct.unpack('>I', self.data[128:132])[0]
         tags = {}
         for i in range(count):
             pos = 132 + i * 12
-            tag = self.data[pos:pos+4].decode('ascii')
+            tag = bytes(self.data[pos:pos+4]).decode('ascii')
             offset = struct.unpack('>I', self.data[pos+4:pos+8])[0]
             size = struct.unpack('>I', self.data[pos+8:pos+12])[0]
             tags[tag] = {
@@ -29,6 +152,16 @@ class ICCProfile:
     def _encode_s15fixed16(self, value: float) -> bytes:
         return struct.pack(">i", int(round(value * 65536)))
 
+    def _decode_s15fixed16_array(self, raw) -> np.ndarray:
+        # 按大端 int32 视图整体解码，raw 长度须为 4 的倍数
+        return np.frombuffer(raw, dtype='>i4').astype(np.float64) / 65536.0
+
+    def _encode_s15fixed16_array(self, values) -> bytes:
+        fixed = np.round(np.asarray(values, dtype=np.float64).ravel() * 65536)
+        if fixed.size and (fixed.min() < -2**31 or fixed.max() > 2**31 - 1):
+            raise ValueError("s15Fixed16 值超出范围 [-32768, 32768)")
+        return fixed.astype('>i4').tobytes()
+
     def write_tag(self, tag_name: str, tag_bytes: bytes):
         # tag_name = tag_name.upper()
         if tag_name not in self.tags:
@@ -40,7 +173,10 @@ class ICCProfile:
         # 对齐 tag 内容
         tag_bytes += b'\x00' * ((4 - len(tag_bytes) % 4) % 4)
         self.tags[tag_name]['new_data'] = tag_bytes
+        if self._decoded:
+            self._decoded = {k: v for k, v in self._decoded.items() if k[0] != tag_name}
 
+    @_tag_cached()
     def read_XYZType(self, tag):
         # tag = tag.upper()
         if tag not in self.tags: return None
@@ -60,6 +196,7 @@ class ICCProfile:
             block += struct.pack('>iii', int(x * 65536), int(y * 65536), int(z * 65536))
         self.write_tag(tag, block)
     
+    @_tag_cached()
     def read_textType(self, tag):
         if tag not in self.tags:
             return None
@@ -67,22 +204,22 @@ class ICCProfile:
         sig = self.data[offset:offset+4]
         if sig == b'desc':
             length = struct.unpack('>I', self.data[offset+8:offset+12])[0]
-            return self.data[offset+12:offset+12+length].decode('ascii', errors='replace')
+            return bytes(self.data[offset+12:offset+12+length]).decode('ascii', errors='replace')
         elif sig == b'mluc':
             count = struct.unpack('>I', self.data[offset+8:offset+12])[0]
             records = []
             for i in range(count):
                 base = offset + 16 + i * 12
-                lang = self.data[base:base+2].decode('ascii')
-                country = self.data[base+2:base+4].decode('ascii')
+                lang = bytes(self.data[base:base+2]).decode('ascii')
+                country = bytes(self.data[base+2:base+4]).decode('ascii')
                 length, roffset = struct.unpack('>II', self.data[base+4:base+12])
                 text_bytes = self.data[offset+roffset : offset+roffset+length]
-                text = text_bytes.decode('utf-16-be')
+                text = bytes(text_bytes).decode('utf-16-be')
                 records.append({'lang': lang, 'country': country, 'text': text})
             return records
         elif sig == b'text':  # 新增: 纯 textType (MSCA 使用)
             size = self.tags[tag]['size']
-            raw = self.data[offset+8: offset+size]
+            raw = bytes(self.data[offset+8: offset+size])
             raw = raw.rstrip(b'\x00')
             return raw.decode('ascii', errors='replace')
         return None
@@ -123,15 +260,19 @@ class ICCProfile:
         else:
             raise ValueError("文本写入仅支持 str 或（desc）多语言 list")
     
-    def read_vcgt(self):
+    @_tag_cached('vcgt')
+    def read_vcgt(self, as_array=False):
         """
-        没测试
         读取 'vcgt' 标签.
-        支持两种常见头格式:
-        A) (Apple/某些工具) offset8..15 = rCount,gCount,bCount,bytesPerEntry
+        支持的头格式:
+        table/formula) (Apple 规范) offset8..11 = gammaType (uint32)
+           gammaType=0 表格: offset12..17 = channels(1|3), entryCount, entrySize(字节 1|2)，数据从 18 开始
+           gammaType=1 公式: offset12..47 = R/G/B 各 (gamma, min, max)，s15Fixed16
+        A) (某些工具/本项目写入) offset8..15 = rCount,gCount,bCount,bytesPerEntry
         B) (通用/另一格式)  offset8..15 = type(0/1), channels(1|3), entryCount, entrySize(bits)
            若 type=1 且 channels=3 -> 三通道表; entrySize=8/16
-        返回 dict 或 None
+        as_array: True 时各通道以 ndarray (float64, 0~1) 返回
+        返回 dict 或 None；公式格式的各通道为 {'gamma', 'min', 'max'}
         """
         tag = 'vcgt'
         if tag not in self.tags:
@@ -153,10 +294,32 @@ class ICCProfile:
             if len(raw) < count * bpe:
                 return None
             if bpe == 1:
-                return [v / 255.0 for v in raw]
-            else:
-                return [struct.unpack(">H", raw[i:i+2])[0] / 65535.0
-                        for i in range(0, len(raw), 2)]
+                return np.frombuffer(raw, dtype=np.uint8) / 255.0
+            return np.frombuffer(raw, dtype='>u2') / 65535.0
+
+        def out(arr):
+            return arr if as_array else arr.tolist()
+
+        # 规范格式：gammaType 高 16 位为 0（格式 A 的 rCount 必须 > 0，不会混淆）
+        if h1 == 0 and h2 == 0 and size >= 18:
+            channels, entry_count, bpe = struct.unpack(">HHH", block[12:18])
+            if channels in (1, 3) and bpe in (1, 2) and entry_count > 0:
+                all_vals = read_channel_bytes(18, channels * entry_count, bpe)
+                if all_vals is not None:
+                    rows = all_vals.reshape(channels, entry_count)
+                    # 单通道，复制
+                    r, g, b = rows if channels == 3 else (rows[0],) * 3
+                    return {
+                        "format": "table",
+                        "red": out(r), "green": out(g), "blue": out(b),
+                        "bytes_per_entry": bpe
+                    }
+        if h1 == 0 and h2 == 1 and size >= 48:
+            params = self._decode_s15fixed16_array(block[12:48]).reshape(3, 3)
+            result = {"format": "formula"}
+            for channel, (gamma, vmin, vmax) in zip(("red", "green", "blue"), params.tolist()):
+                result[channel] = {"gamma": gamma, "min": vmin, "max": vmax}
+            return result
 
         # 尝试格式 A
         fmtA_ok = False
@@ -171,11 +334,11 @@ class ICCProfile:
                 r = read_channel_bytes(pos, r_count, bpe); pos += r_count * bpe
                 g = read_channel_bytes(pos, g_count, bpe); pos += g_count * bpe
                 b = read_channel_bytes(pos, b_count, bpe)
-                if None not in (r, g, b):
+                if all(v is not None for v in (r, g, b)):
                     fmtA_ok = True
                     vcgtA = {
                         "format": "A",
-                        "red": r, "green": g, "blue": b,
+                        "red": out(r), "green": out(g), "blue": out(b),
                         "bytes_per_entry": bpe
                     }
 
@@ -189,18 +352,16 @@ class ICCProfile:
                 if expected <= size:
                     pos = 16
                     all_vals = read_channel_bytes(pos, total_entries, bpe)
-                    if all_vals:
+                    if all_vals is not None:
                         if channels == 1:
                             # 单通道，复制
                             r = g = b = all_vals
                         else:
-                            r = all_vals[0:entry_count]
-                            g = all_vals[entry_count:2*entry_count]
-                            b = all_vals[2*entry_count:3*entry_count]
+                            r, g, b = all_vals.reshape(3, entry_count)
                         return {
                             "format": "B",
                             "type": v_type,
-                            "red": r, "green": g, "blue": b,
+                            "red": out(r), "green": out(g), "blue": out(b),
                             "bytes_per_entry": bpe
                         }
             # 都不匹配
@@ -208,15 +369,15 @@ class ICCProfile:
 
         return vcgtA
 
-    def write_vcgt(self, red, green=None, blue=None, bytes_per_entry=2):
+    def write_vcgt(self, red, green=None, blue=None, bytes_per_entry=2, layout="A"):
         """
-        没测试
         写入/更新 'vcgt' 标签。
         red/green/blue: 可为长度相同的 list/ndarray(0~1). 若仅提供 red 且 green/blue 为 None, 复制为灰阶。
         bytes_per_entry: 1 或 2 (默认 16bit 精度).
+        layout: "A" 写 rCount,gCount,bCount,bytesPerEntry 头；"table" 写 Apple 规范的表格格式
         """
         tag = 'vcgt'
-        red = list(red)
+        red = np.asarray(red, dtype=float).ravel()
         if green is None: green = red
         if blue is None: blue = red
         if not (len(red) == len(green) == len(blue)):
@@ -225,27 +386,41 @@ class ICCProfile:
             raise ValueError("bytes_per_entry 仅支持 1 或 2")
         count = len(red)
 
-        def clamp01(v): return 0.0 if v < 0 else (1.0 if v > 1 else v)
-
         def pack_channel(arr):
+            arr = np.clip(np.asarray(arr, dtype=float), 0.0, 1.0)
             if bytes_per_entry == 1:
-                return bytes(int(round(clamp01(v) * 255)) & 0xFF for v in arr)
-            else:
-                out = bytearray()
-                for v in arr:
-                    out += struct.pack(">H", int(round(clamp01(v) * 65535)) & 0xFFFF)
-                return bytes(out)
+                return np.round(arr * 255).astype(np.uint8).tobytes()
+            return np.round(arr * 65535).astype('>u2').tobytes()
+
+        if layout not in ("A", "table"):
+            raise ValueError("layout 仅支持 'A' 或 'table'")
 
         payload = bytearray()
         # type signature + reserved
         payload += b'vcgt' + b'\x00\x00\x00\x00'
-        # counts + bytesPerEntry
-        payload += struct.pack(">HHHH", count, count, count, bytes_per_entry)
+        if layout == "table":
+            # gammaType=0, channels, entryCount, entrySize
+            payload += struct.pack(">IHHH", 0, 3, count, bytes_per_entry)
+        else:
+            # counts + bytesPerEntry
+            payload += struct.pack(">HHHH", count, count, count, bytes_per_entry)
         payload += pack_channel(red)
         payload += pack_channel(green)
         payload += pack_channel(blue)
         self.write_tag(tag, bytes(payload))
     
+    def write_vcgt_formula(self, gamma, vmin=0.0, vmax=1.0):
+        """
+        写入公式格式的 'vcgt'：输出 = min + (max - min) * x^gamma。
+        gamma/vmin/vmax: 标量（三通道相同）或长度为 3 的 R/G/B 序列
+        """
+        params = np.empty((3, 3))
+        for i, value in enumerate((gamma, vmin, vmax)):
+            params[:, i] = np.broadcast_to(np.asarray(value, dtype=float), (3,))
+        payload = b'vcgt' + b'\x00\x00\x00\x00' + struct.pack(">I", 1)
+        payload += self._encode_s15fixed16_array(params)
+        self.write_tag('vcgt', payload)
+
     def read_MSCA(self):
         return self.read_textType('MSCA')
 
@@ -269,7 +444,11 @@ class ICCProfile:
         tag = 'cprt'
         self.write_textType(tag, value)
 
-    def read_MHC2(self):
+    @_tag_cached('MHC2')
+    def read_MHC2(self, as_array=False):
+        """
+        as_array: True 时 matrix 与三条 LUT 以 ndarray (float64) 返回，省去转换为 list 的开销
+        """
         tag = 'MHC2'
         if tag not in self.tags:
             return None
@@ -290,17 +469,17 @@ class ICCProfile:
         def read_lut(offset):
             if offset == 0: return None
             if block[offset:offset+4] != b'sf32': return None
-            return [
-                self._decode_s15fixed16(block[offset+8+i:offset+12+i])
-                for i in range(0, count*4, 4)
-            ]
+            lut = self._decode_s15fixed16_array(block[offset+8:offset+8+count*4])
+            return lut if as_array else lut.tolist()
 
         matrix = None
         if matrix_offset:
             mdata = self.data[offset + matrix_offset : offset + matrix_offset + 48]
-            raw = [self._decode_s15fixed16(mdata[i:i+4]) for i in range(0, 48, 4)]
-            matrix = [raw[i] for i in range(12) if i % 4 != 3]
-        
+            # 3x4 矩阵，第 4 列为偏移量（写入时固定为 0）
+            matrix = self._decode_s15fixed16_array(mdata).reshape(3, 4)[:, :3].ravel()
+            if not as_array:
+                matrix = matrix.tolist()
+
 
         return {
             'entry_count': count,
@@ -333,27 +512,21 @@ class ICCProfile:
         sub_blocks = {}
 
         # 写 matrix
-        if matrix:
+        if matrix is not None and len(matrix):
             assert len(matrix) == 9
             pos = len(block)
             sub_blocks['matrix'] = pos
-            for i in range(3):
-                for j in range(3):
-                    block += self._encode_s15fixed16(matrix[i*3 + j])
-                block += self._encode_s15fixed16(0.0)
-            if len(block) % 4 != 0:
-                block += b'\x00' * (4 - len(block) % 4)
+            m34 = np.zeros((3, 4))
+            m34[:, :3] = np.asarray(matrix, dtype=np.float64).reshape(3, 3)
+            block += self._encode_s15fixed16_array(m34)
 
         def write_lut(name, lut, block):
-            if not lut:
+            if lut is None or not len(lut):
                 return
             pos = len(block)
             sub_blocks[name] = pos
             block.extend(b'sf32' + b'\x00\x00\x00\x00')
-            for v in lut:
-                block += self._encode_s15fixed16(v)
-            if len(block) % 4 != 0:
-                block += b'\x00' * (4 - len(block) % 4)
+            block += self._encode_s15fixed16_array(lut)
 
         write_lut('red', r, block)
         write_lut('green', g, block)
@@ -392,25 +565,25 @@ class ICCProfile:
     #
     # 备注: 未修改的未知 TRC 会原样保留 (不调用 write_TRC 即可)
 
-    def _read_TRC_curve(self, off, size):
-        if size < 14:  # signature+reserved+count(4)+至少1个uint16
+    def _read_TRC_curve(self, off, size, as_array=False):
+        if size < 12:  # signature+reserved+count(4)；count=0 表示恒等曲线
             return None
         count = struct.unpack(">I", self.data[off+8:off+12])[0]
         if count == 0:
-            return {'type': 'curve', 'values': []}
+            return {'type': 'curve', 'values': np.zeros(0) if as_array else []}
         # 位置
         start = off + 12
         end = start + count * 2
         if end > off + size:
             return None
-        vals = struct.unpack(">" + "H"*count, self.data[start:end])
+        vals = np.frombuffer(self.data[start:end], dtype='>u2')
         if count == 1:
             # gamma = value / 256
-            g = vals[0] / 256.0 if vals[0] > 0 else 1.0
+            g = int(vals[0]) / 256.0 if vals[0] > 0 else 1.0
             return {'type': 'gamma', 'gamma': g}
         else:
-            arr = [v / 65535.0 for v in vals]
-            return {'type': 'curve', 'values': arr}
+            arr = vals / 65535.0
+            return {'type': 'curve', 'values': arr if as_array else arr.tolist()}
 
     def _read_TRC_parametric(self, off, size):
         if size < 16:
@@ -429,41 +602,7 @@ class ICCProfile:
             params.append(self._decode_s15fixed16(self.data[pos:pos+4]))
             pos += 4
 
-        def _eval(x):
-            x = np.asarray(x, dtype=float)
-            x = np.clip(x, 0.0, 1.0)
-            if func_type == 0:
-                g = params[0]
-                return np.power(x, g, where=x>0)
-            if func_type == 1:
-                g,a,b = params
-                cut = -b / a if a != 0 else -1e9
-                y = np.zeros_like(x)
-                mask = x >= cut
-                y[mask] = np.power(a*x[mask] + b, g, where=(a*x[mask]+b)>0)
-                return y
-            if func_type == 2:
-                g,a,b,c = params
-                cut = -b / a if a != 0 else -1e9
-                y = np.full_like(x, c)
-                mask = x >= cut
-                y[mask] = np.power(a*x[mask] + b, g, where=(a*x[mask]+b)>0) + c
-                return y
-            if func_type == 3:
-                g,a,b,c,d = params
-                y = np.empty_like(x)
-                mask = x >= d
-                y[mask] = np.power(a*x[mask] + b, g, where=(a*x[mask]+b)>0)
-                y[~mask] = c * x[~mask]
-                return y
-            if func_type == 4:
-                g,a,b,c,d,e,f = params
-                y = np.empty_like(x)
-                mask = x >= d
-                y[mask] = np.power(a*x[mask] + b, g, where=(a*x[mask]+b)>0) + e
-                y[~mask] = c * x[~mask] + f
-                return y
-            return x
+        _eval = functools.partial(eval_parametric_curve, func_type, tuple(params))
 
         return {
             'type': 'parametric',
@@ -472,7 +611,9 @@ class ICCProfile:
             'eval': _eval
         }
 
-    def read_TRC(self, tag):
+    @_tag_cached()
+    def read_TRC(self, tag, as_array=False):
+        """as_array: True 时 curve 类型的 values 以 ndarray 返回"""
         if tag not in self.tags:
             return None
         info = self.tags[tag]
@@ -481,11 +622,30 @@ class ICCProfile:
             return None
         sig = self.data[off:off+4]
         if sig == b'curv':
-            return self._read_TRC_curve(off, size)
+            return self._read_TRC_curve(off, size, as_array=as_array)
         if sig == b'para':
             return self._read_TRC_parametric(off, size)
         return None  # 其他类型未支持
 
+    def eval_TRC(self, tag, x):
+        """
+        对任意形状的数组 x (0..1) 求 TRC 输出，可直接用于整幅图像或密集采样
+        （例如 np.linspace(0, 1, 65536)）。curve 类型按采样点线性插值。
+        tag 不存在或类型不支持时返回 None。
+        """
+        trc = self.read_TRC(tag, as_array=True)
+        if trc is None:
+            return None
+        x = np.clip(np.asarray(x, dtype=float), 0.0, 1.0)
+        if trc['type'] == 'gamma':
+            return np.power(x, trc['gamma'])
+        if trc['type'] == 'curve':
+            values = trc['values']
+            if len(values) == 0:
+                return x.copy()
+            return np.interp(x, np.linspace(0.0, 1.0, len(values)), values)
+        return trc['eval'](x)
+
     def read_rgbTRC(self):
         """
         返回:
@@ -528,15 +688,15 @@ class ICCProfile:
             self.write_tag(tag, block)
 
     def _write_curve_samples(self, tag, values):
+        # 空 values 写入 count=0，即恒等曲线
         vals = np.asarray(values, dtype=float)
-        if vals.ndim != 1 or vals.size == 0:
-            raise ValueError("curve values must be 1-D non-empty")
+        if vals.ndim != 1:
+            raise ValueError("curve values must be 1-D")
         vals = np.clip(vals, 0.0, 1.0)
         block = bytearray()
         block += b'curv' + b'\x00\x00\x00\x00'
         block += struct.pack(">I", vals.size)
-        for v in vals:
-            block += struct.pack(">H", int(round(v * 65535)) & 0xFFFF)
+        block += np.round(vals * 65535).astype('>u2').tobytes()
         if len(block) % 4: block += b'\x00'*(4-len(block)%4)
         self.write_tag(tag, block)
 
@@ -661,9 +821,50 @@ class ICCProfile:
         if rgbTRC is not None:
             self.write_rgbTRC(data=rgbTRC, mode=trc_mode)
 
+    def _patch_in_place(self):
+        """
+        快速路径：所有修改过的 tag 新数据与原大小相同、且不与其他 tag 共享数据区时，
+        直接覆盖 self.data 中对应字节，不重新排布。文件大小不变，tag 表无需改写。
+        返回是否成功；否则由 rebuild 走完整重排。
+        """
+        changed = {tag: info for tag, info in self.tags.items() if 'new_data' in info}
+        for tag, info in changed.items():
+            if 'original_data' not in info or len(info['new_data']) != info['size']:
+                return False
+            start, end = info['offset'], info['offset'] + info['size']
+            for other, oinfo in self.tags.items():
+                if other != tag and oinfo['offset'] < end and start < oinfo['offset'] + oinfo['size']:
+                    return False
+        # lazy 模式下数据只读，先复制到内存（仅此一次）
+        self._detach()
+        for tag, info in self.tags.items():
+            if 'new_data' not in info:
+                continue
+            block = info.pop('new_data')
+            self.data[info['offset']:info['offset'] + info['size']] = block
+            info['original_data'] = bytes(block)
+        return True
+
+    def _clear_profile_id(self):
+        """
+        header 84..99 为 Profile ID（MD5）。内容改变后原 ID 失效，按 ICC 规范置 0 表示未计算
+        （比重新计算整个文件的 MD5 便宜，预览循环中每次都会调用）。
+        """
+        if any(self.data[84:100]):
+            self.data[84:100] = bytes(16)
+
     def rebuild(self):
+        """
+        把写入的 tag 合成为完整的配置文件数据。
+        只改了等长 tag（例如同条目数的 MHC2、等长的预览名称）时原地覆盖，否则重新排布全部 tag。
+        """
+        self._decoded.clear()
+        if self._patch_in_place():
+            self._clear_profile_id()
+            return
+
         # 拷贝 ICC header（前128字节）
-        header = self.data[:128]
+        header = bytearray(self.data[:128])
         tag_count = len(self.tags)
 
         # 构建 tag table（tag count + 每个tag的entry）
@@ -680,7 +881,7 @@ class ICCProfile:
 
             # 对齐 tag 内容到 4 字节
             if len(data) % 4 != 0:
-                data += b'\x00' * (4 - len(data) % 4)
+                data = bytes(data) + b'\x00' * (4 - len(data) % 4)
 
             # 添加 tag entry
             tag_table += tag.encode('ascii')
@@ -696,13 +897,33 @@ class ICCProfile:
         # 修正 header 中的文件大小（bytes 0–3）
         final[0:4] = struct.pack('>I', len(final))
 
-        # 更新 self.data
+        # 更新 self.data，lazy 模式下此时才释放原文件映射
+        self._release_map()
         self.data = final
+        self._clear_profile_id()
 
         # rebuild 后应重新生成 tag 表
         self.tags = self._read_tag_table()
 
+    def content_hash(self, exclude=("desc",)):
+        """
+        配置文件内容的 sha256（十六进制）：按 tag 名排序，对 tag 数据（含未 rebuild 的修改）求哈希。
+        exclude 中的 tag 不参与，默认忽略描述，使同一内容不同名称的预览配置哈希相同。
+        """
+        h = hashlib.sha256()
+        for tag in sorted(self.tags):
+            if tag in exclude:
+                continue
+            info = self.tags[tag]
+            data = bytes(info.get('new_data', info.get('original_data')))
+            h.update(tag.encode('ascii'))
+            h.update(struct.pack('>I', len(data)))
+            h.update(data)
+        return h.hexdigest()
+
     def save(self, path):
+        # 可能覆盖被映射的源文件，先复制到内存
+        self._detach()
         with open(path, 'wb') as f:
             f.write(self.data)
 
@@ -1,5 +1,6 @@
 from convert_utils import *
 import numpy as np
+import functools
 import copy
 
 
@@ -48,43 +49,64 @@ def convert_transfer(v, src=("gamma", 2.2), dst=("srgb", None),
     return np.clip(out, 0.0, 1.0)
 
 
-def bt2390eetf(V: float, Lb: float, Lw: float, Lmin: float, Lmax: float) -> float:
+def bt2390eetf(V, Lb: float, Lw: float, Lmin: float, Lmax: float):
         """
         BT.2390 EETF
         对 PQ 信号 V 根据黑场/白场限制进行电子-电子传递函数调整。
+        V: PQ 信号，标量或 ndarray（向量化，膝点参数只计算一次）
         Lb, Lw: 参考黑场和白场亮度(0-10000 nit)
         Lmin, Lmax: 目标显示的黑场和白场亮度(0-10000 nit)
-        返回调整后的PQ信号值。
+        返回调整后的PQ信号值，形状与 V 相同（标量输入返回 float）。
         """
         # 将输入PQ值规范化为 EETF 空间 [0,1]
         Vb = pq_oetf(Lb)
         Vw = pq_oetf(Lw)
-        E1 = (V - Vb) / (Vw - Vb)
+        span = Vw - Vb
+        E1 = (np.asarray(V, dtype=float) - Vb) / span
         # 计算目标显示的归一化最小/最大亮度值
-        minLum = (pq_oetf(Lmin) - Vb) / (Vw - Vb)
-        maxLum = (pq_oetf(Lmax) - Vb) / (Vw - Vb)
+        minLum = (pq_oetf(Lmin) - Vb) / span
+        maxLum = (pq_oetf(Lmax) - Vb) / span
         # 膝点和黑场参数:contentReference[oaicite:35]{index=35}
         KS = 1.5 * maxLum - 0.5
         b = minLum
-        # 定义 Hermite 样条辅助函数
-        T = lambda A: (A - KS) / (1 - KS) if KS != 1 else 0.0
-        P = lambda B: (2 * T(B)**3 - 3 * T(B)**2 + 1) * KS \
-                    + (T(B)**3 - 2 * T(B)**2 + T(B)) * (1 - KS) \
-                    + (-2 * T(B)**3 + 3 * T(B)**2) * maxLum
+        # Hermite 样条，T 只计算一次
+        T = (E1 - KS) / (1 - KS) if KS != 1 else np.zeros_like(E1)
+        T2 = T * T
+        T3 = T2 * T
+        P = (2 * T3 - 3 * T2 + 1) * KS \
+            + (T3 - 2 * T2 + T) * (1 - KS) \
+            + (-2 * T3 + 3 * T2) * maxLum
         # 按照 BT.2390 Step 3.1 & 3.2 计算 E2, E3
-        if E1 < KS:
-            E2 = E1
-        elif KS <= E1 <= 1:
-            E2 = P(E1)
-        else:
-            E2 = E1  # 万一 E1>1（理应不会），则不改变
-        E3 = E2
-        if 0 <= E2 <= 1:
-            E3 = E2 + b * (1 - E2) ** 4  # 黑场提升
+        # E1 < KS 或 E1 > 1（理应不会）时不改变
+        E2 = np.where((E1 >= KS) & (E1 <= 1), P, E1)
+        # 黑场提升
+        E3 = np.where((E2 >= 0) & (E2 <= 1), E2 + b * (1 - E2) ** 4, E2)
         # 反规范化回 PQ 信号
-        E4 = E3 * (Vw - Vb) + Vb
+        E4 = E3 * span + Vb
+        if E4.ndim == 0:
+            return float(E4)
         return E4
 
+@functools.lru_cache(maxsize=32)
+def _bt2390eetf_curve_cached(source_min, source_max, monitor_min, monitor_max, length):
+    curve = bt2390eetf(np.linspace(0, 1, length), source_min, source_max, monitor_min, monitor_max)
+    curve.setflags(write=False)
+    return curve
+
+def bt2390eetf_curve(source_min, source_max, monitor_min, monitor_max, length=4096):
+    """
+    在 [0..1] 上均匀采样 length 点的 BT.2390 EETF 曲线。
+    结果按 (source_min, source_max, monitor_min, monitor_max, length) 做 LRU 缓存，
+    重复生成同一组参数的配置文件时直接复用；返回的数组只读。
+    """
+    return _bt2390eetf_curve_cached(float(source_min), float(source_max),
+                                    float(monitor_min), float(monitor_max), int(length))
+
+def eetf_curve_from_args(eetf_args, length=4096):
+    """按 eetf_args 字典（source_min/source_max/monitor_min/monitor_max）取 EETF 曲线"""
+    return bt2390eetf_curve(eetf_args["source_min"], eetf_args["source_max"],
+                            eetf_args["monitor_min"], eetf_args["monitor_max"], length)
+
 def find_nearest_idx(arr, value):
     """
     在数组中找到等于或最近的数字的索引
@@ -99,36 +121,44 @@ def max_uniform_target(n, limit=4096):
     k = (limit - n) // (n - 1)
     return n + k * (n - 1), k
 
-def linear_interpolate(arr, target_len):
+def _segment_layout(n_points, target_len):
+    """
+    linear_interpolate 系列的输出布局：每段插入点数相同，余数依次分配在前面的若干段。
+    返回 (seg, t)：输出第 k 个点所在段号，以及段内位置 t∈[0,1)（末尾端点单独处理）
+    """
+    intervals = n_points - 1
+    total_insert = target_len - n_points
+    base = total_insert // intervals
+    remainder = total_insert % intervals
+    # 每段输出 起点 + 内点 个点（不含终点）
+    counts = np.full(intervals, base + 1, dtype=np.int64)
+    counts[:remainder] += 1
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    seg = np.repeat(np.arange(intervals), counts)
+    k = np.arange(target_len - 1) - starts[seg]
+    t = k / counts[seg]
+    return seg, t
+
+def linear_interpolate(arr, target_len, dtype=float):
     """
     线性插值扩展数组到指定长度，每两个数字之间插入的数量相等
     arr: 原数组 (1D)
     target_len: 目标长度 (>= len(arr))
+    dtype: 输出类型，可用 np.float32 降低上采样曲线的内存占用
     """
     arr = np.asarray(arr, dtype=float)
     n_points = len(arr)
     if target_len <= n_points:
-        return arr
-
-    # 每段插入的点数（不包括端点）
-    intervals = n_points - 1
-    total_insert = target_len - n_points
-    insert_per_interval = total_insert // intervals
-    remainder = total_insert % intervals
+        return arr.astype(dtype, copy=False)
 
-    result = []
-    for i in range(intervals):
-        start = arr[i]
-        end = arr[i+1]
-        # 当前段插值数量，分配余数
-        n_insert = insert_per_interval + (1 if i < remainder else 0)
-        # 当前段的插值（包括起点，不包括终点）
-        segment = np.linspace(start, end, n_insert + 2)[:-1]
-        result.extend(segment)
-    result.append(arr[-1])
-    return np.array(result)
+    seg, t = _segment_layout(n_points, target_len)
+    result = np.empty(target_len, dtype=dtype)
+    start = arr[seg]
+    result[:-1] = start + (arr[seg + 1] - start) * t
+    result[-1] = arr[-1]
+    return result
 
-def linear_interpolate_plateau_fix(arr, target_len):
+def linear_interpolate_plateau_fix(arr, target_len, dtype=float):
     """
     线性插值扩展数组到指定长度。
     要求:
@@ -138,80 +168,42 @@ def linear_interpolate_plateau_fix(arr, target_len):
          则把这整段平坦区 + 紧随的那个不同值视作一个“大区间”做线性拆分。
          平坦区内部各原始间隔被赋予逐步递增(或递减)的子区间端点，避免重复值导致插值退化。
          若平坦区位于末尾(后面没有不同值)，保持原样。
+    dtype: 输出类型，同 linear_interpolate
     """
     arr = np.asarray(arr, dtype=float)
     n_points = len(arr)
     if target_len <= n_points:
-        return arr.copy()
-
-    intervals = n_points - 1
-    total_insert = target_len - n_points
-    base = total_insert // intervals
-    remainder = total_insert % intervals  # 前 remainder 段每段多插 1 个
-
-    # 预计算每段需要插入的点数
-    inserts_per_interval = [base + (1 if i < remainder else 0) for i in range(intervals)]
+        return arr.astype(dtype, copy=True)
 
     # 计算“有效”区间端点(处理平坦区)
-    # 默认 start/end 就是相邻值
-    effective_starts = np.empty(intervals, dtype=float)
-    effective_ends = np.empty(intervals, dtype=float)
-
-    i = 0
-    while i < intervals:
-        v0 = arr[i]
-        v1 = arr[i + 1]
-        if v0 != v1:
-            # 普通区间
-            effective_starts[i] = v0
-            effective_ends[i] = v1
-            i += 1
-            continue
-
-        # 平坦区开始 (arr[i] == arr[i+1])
-        plateau_start = i
-        # 扩展直到值改变或到末尾
-        j = i + 1
-        while j < n_points and arr[j] == v0:
-            j += 1
-        # 现在 plateau 索引范围 [plateau_start, j-1] (值都等于 v0)
-        # 下一个不同值位置 j (如果 j < n_points)，对应的值 arr[j]
-        if j < n_points:
-            # 存在后续不同值，拆分为 (j - plateau_start) 个子区间
-            plateau_intervals = j - plateau_start
-            v_next = arr[j]
-            # 在 v0 -> v_next 之间线性划分 plateau_intervals 份
-            for k in range(plateau_intervals):
-                idx = plateau_start + k
-                t0 = k / plateau_intervals
-                t1 = (k + 1) / plateau_intervals
-                effective_starts[idx] = v0 + (v_next - v0) * t0
-                effective_ends[idx] = v0 + (v_next - v0) * t1
-            i = plateau_start + plateau_intervals
-        else:
-            # 平坦区到末尾(没有不同值)，保持原样
-            for idx in range(plateau_start, intervals):
-                effective_starts[idx] = arr[idx]
-                effective_ends[idx] = arr[idx + 1]
-            break  # 已到末尾
-
-    # 生成结果
-    result = []
-    for idx in range(intervals):
-        start = effective_starts[idx]
-        end = effective_ends[idx]
-        n_insert = inserts_per_interval[idx]
-        # 该段需要输出: 起点 + n_insert 个内点 (不含终点，终点在下一段或最后统一追加)
-        if n_insert == 0:
-            # 只放起点
-            result.append(start)
-        else:
-            segment = np.linspace(start, end, n_insert + 2)[:-1]  # 去掉终点
-            result.extend(segment)
-
+    # 平坦区 = 连续相等值的游程；游程 [s, e] 后若还有不同值 arr[e+1]，
+    # 则 [s, e+1] 之间的 (e+1-s) 个原始间隔在 arr[s] -> arr[e+1] 上均分
+    intervals = n_points - 1
+    change = np.flatnonzero(arr[1:] != arr[:-1]) + 1       # 新游程的起点
+    run_start = np.concatenate(([0], change))
+    run_len = np.diff(np.concatenate((run_start, [n_points])))
+    run_of = np.repeat(np.arange(run_start.size), run_len)  # 每个点所属游程
+    i = np.arange(intervals)
+    r = run_of[i]
+    s = run_start[r]
+    nxt = s + run_len[r]                                     # 游程后第一个不同值的位置
+    spread = nxt < n_points                                  # 末尾平坦区保持原样
+    nxt_safe = np.minimum(nxt, n_points - 1)
+    v0 = arr[s]
+    dv = arr[nxt_safe] - v0
+    parts = (nxt_safe - s).astype(float)
+    parts[~spread] = 1.0
+    effective_starts = np.where(spread, v0 + dv * ((i - s) / parts), arr[i])
+    effective_ends = np.where(spread, v0 + dv * ((i - s + 1) / parts), arr[i + 1])
+
+    # 生成结果：起点 + 内点 (不含终点，终点在下一段或最后统一追加)
+    seg, t = _segment_layout(n_points, target_len)
+    result = np.empty(target_len, dtype=dtype)
+    start = effective_starts[seg]
+    result[:-1] = start + (effective_ends[seg] - start) * t
     # 最后追加最终端点
-    result.append(arr[-1])
-    return np.array(result, dtype=float)
+    result[-1] = arr[-1]
+    return result
 
 def lut_scale(pq_values, scale):
     scale = float(scale)
@@ -225,45 +217,65 @@ def lut_scale(pq_values, scale):
 def generate_pq_lut(target_len=4096):
     return np.linspace(0, 1, target_len)
 
-def generate_inversed_lut(lut):
+def generate_inversed_lut(lut, out_len=None, fill="nearest", collision="last"):
+    """
+    反转 1D LUT（向量化）：输入第 i 项 (位置 i/(n-1)) 的值 y 被散射到输出槽 round(y*(out_len-1))，
+    输出槽保存对应的输入位置，空槽再按 fill 填充。
+    参数:
+      - lut: 1D LUT，值域 0..1，长度 n >= 2
+      - out_len: 输出长度，默认与输入等长
+      - fill: 空槽填充方式
+          "nearest" 取最近的已知槽（距离相同取左侧）
+          "linear"  在相邻已知槽之间线性插值，两端保持端点值
+      - collision: 多个输入落到同一输出槽时的取值（非单调输入时可预期的规则）
+          "last"  取位置最大的输入（与旧实现一致）
+          "first" 取位置最小的输入
+          "mean"  取这些输入位置的平均
+    返回:
+      - np.ndarray, shape=(out_len,)
+    """
     a = np.asarray(lut, dtype=float).ravel()
     if a.size < 2:
         raise ValueError("lut length must be >= 2")
-    L = a.size - 1
-    out = np.full(L + 1, np.nan, dtype=float)
-    
-    for i, y in enumerate(a):
-        j = int(round(y * L))
-        j = 0 if j < 0 else (L if j > L else j)
-        out[j] = i / L
-    
-    nan_mask = np.isnan(out)
-    if np.all(nan_mask):
+    if np.all(np.isnan(a)):
         raise ValueError("generate reserverd lut failed: all values are NaN")
-    
-    # fallback linear interpolation for NaN positions
-    pos = np.arange(L + 1)
-    known_idx = pos[~nan_mask]
-    known_val = out[~nan_mask]
-    insert_pos = pos  
-    j = np.searchsorted(known_idx, insert_pos, side="left")
-
-    left_exist = j > 0
-    left_idx = np.where(left_exist, known_idx[j - 1], -1)
-    left_val = np.where(left_exist, known_val[j - 1], np.nan)
-    dl = np.where(left_exist, insert_pos - left_idx, np.inf)
-
-    right_exist = j < known_idx.size
-    right_idx = np.where(right_exist, known_idx[j], -1)
-    right_val = np.where(right_exist, known_val[j], np.nan)
-    dr = np.where(right_exist, right_idx - insert_pos, np.inf)
-
-    choose_left = dl <= dr
-    filled = np.where(choose_left, left_val, right_val)
-
-    out[nan_mask] = filled[nan_mask]
-
-    return out
+    n = a.size
+    out_len = n if out_len is None else int(out_len)
+    if out_len < 2:
+        raise ValueError("out_len must be >= 2")
+    L = out_len - 1
+
+    valid = ~np.isnan(a)
+    src_pos = (np.arange(n) / (n - 1))[valid]
+    slot = np.clip(np.rint(a[valid] * L), 0, L).astype(np.int64)
+
+    # 散射：src_pos 已按输入位置升序排列
+    if collision == "last":
+        uniq, first_rev = np.unique(slot[::-1], return_index=True)
+        known_val = src_pos[::-1][first_rev]
+    elif collision == "first":
+        uniq, first = np.unique(slot, return_index=True)
+        known_val = src_pos[first]
+    elif collision == "mean":
+        uniq, inv = np.unique(slot, return_inverse=True)
+        known_val = np.bincount(inv, weights=src_pos) / np.bincount(inv)
+    else:
+        raise ValueError("collision must be 'last', 'first' or 'mean'")
+    known_idx = uniq
+
+    pos = np.arange(out_len)
+    if fill == "linear":
+        return np.interp(pos, known_idx, known_val)
+    if fill != "nearest":
+        raise ValueError("fill must be 'nearest' or 'linear'")
+
+    # 最近邻填充：比较左右两侧已知槽的距离，相同取左侧
+    j = np.searchsorted(known_idx, pos, side="right")
+    left = np.clip(j - 1, 0, known_idx.size - 1)
+    right = np.clip(j, 0, known_idx.size - 1)
+    dl = np.where(j > 0, pos - known_idx[left], np.inf)
+    dr = np.where(j < known_idx.size, known_idx[right] - pos, np.inf)
+    return np.where(dl <= dr, known_val[left], known_val[right])
 
 def generate_bright_pq_lut(target_len=4096):
     lut = generate_pq_lut(target_len)
@@ -271,9 +283,47 @@ def generate_bright_pq_lut(target_len=4096):
     # lut = np.clip(lut * 1.1, 0.0, 1.0)
     return lut
 
-def generate_mhc2_lut_from_measure_data(real_nit, target_pq=None, max_nit=10000, ratio=1, eetf_args=None):
+def monotone_denoise(curve):
+    """
+    去除测量噪声：假定显示器实际响应不会随着输入亮度增加而下降，
+    用累积最大值把曲线修正为单调不减（向量化，不修改输入）。
+    """
+    return np.maximum.accumulate(np.asarray(curve, dtype=float).ravel())
+
+def invert_monotone_curve(curve, targets):
+    """
+    单调曲线求反函数（分段线性，向量化）。
+    curve: 在输入 [0..1] 上均匀采样的输出值，内部先做 monotone_denoise
+    targets: 需要反查的输出值，标量或 ndarray
+    返回:
+      - 与 targets 同形状的输入位置(0..1)，使 curve(x) == target。
+        平坦区取最左端；低于曲线最小值返回 0，高于最大值返回首次到达最大值的位置。
+    与旧的“插值到 40960 点 + 逐个 argmin”相比，结果不再量化到固定分辨率，
+    代价为 O((n + m) log n)。
+    """
+    y = monotone_denoise(curve)
+    n = y.size
+    if n < 2:
+        raise ValueError("curve length must be >= 2")
+    t = np.asarray(targets, dtype=float)
+
+    # idx: 第一个 y[idx] >= t 的位置
+    idx = np.searchsorted(y, t, side="left")
+    lo = np.clip(idx - 1, 0, n - 1)
+    hi = np.clip(idx, 0, n - 1)
+    y0 = y[lo]
+    span = y[hi] - y0
+    frac = np.where(span > 0, (t - y0) / np.where(span > 0, span, 1.0), 0.0)
+    pos = lo + np.clip(frac, 0.0, 1.0)
+    # 超出最大值：取首次到达最大值的位置
+    top = np.searchsorted(y, y[-1], side="left")
+    pos = np.where(idx >= n, top, pos)
+    return pos / (n - 1)
+
+def generate_mhc2_lut_from_measure_data(real_nit, target_pq=None, max_nit=10000, ratio=1, eetf_args=None,
+                                        lut_len=4096):
     """
-    依据实测灰阶亮度曲线生成 PQ→PQ 的 1D LUT来校准显示器亮度响应（长度 4096）。
+    依据实测灰阶亮度曲线生成 PQ→PQ 的 1D LUT来校准显示器亮度响应（默认长度 4096）。
     原理：用实测曲线（输入PQ→设备输出PQ）求其“近似反函数”，再按目标曲线（可选 BT.2390 EETF）
     在 [0..1] 上采样，得到前向补偿 LUT：给定目标输出PQ，返回需要送入设备的输入PQ。
 
@@ -294,82 +344,281 @@ def generate_mhc2_lut_from_measure_data(real_nit, target_pq=None, max_nit=10000,
               "monitor_max": 设备峰值白 (nit)
             }
           若为 None，则目标曲线为线性 PQ ramp（恒等目标）。
+      - lut_len: int = 4096
+          未提供 target_pq 时生成的 LUT 长度。
 
     返回:
-      - np.ndarray, shape=(4096,), dtype=float
-          1D LUT：索引 i 表示“目标输出 PQ”= i/4095，对应的值为“应该送入设备的输入 PQ”。
+      - np.ndarray, shape=(lut_len,), dtype=float
+          1D LUT：索引 i 表示“目标输出 PQ”= i/(lut_len-1)，对应的值为“应该送入设备的输入 PQ”。
     """
-    DEFAULT_LUT_LEN = 4096
-    real_nit = copy.deepcopy(real_nit)
     # 去除噪声(假定显示器实际响应不会随着输入亮度增加而下降)
-    for idx, itm in enumerate(real_nit):
-        if idx == 0:
-            continue
-        if itm < real_nit[idx-1]:
-            real_nit[idx] = real_nit[idx-1]
-    monitor_real_pq = []
+    real_nit = monotone_denoise(real_nit)
     max_pq = pq_oetf(max_nit/ratio)
-    for idx, itm in enumerate(real_nit):
-        if itm <= max_nit:
-            pq = pq_oetf(itm/ratio)
-        else:
-            pq = max_pq
-        monitor_real_pq.append(pq)
-    if not target_pq:
-        target_pq = np.linspace(0, 1, DEFAULT_LUT_LEN)
+    monitor_real_pq = np.where(real_nit <= max_nit, pq_oetf(real_nit/ratio), max_pq)
+    if target_pq is None or len(target_pq) == 0:
+        target_pq = np.linspace(0, 1, lut_len)
     else:
         target_pq = np.array(target_pq, dtype=float)
     # target_pq = np.clip(target_pq*1.1, 0.0, 1.0)
     if eetf_args:
-        target_pq_eetf = []
         lt = len(target_pq)
-        for idx in range(lt):
-            V = idx/(lt-1)
-            Lb = eetf_args["source_min"]
-            Lw = eetf_args["source_max"]
-            Lmin = eetf_args["monitor_min"]
-            Lmax = eetf_args["monitor_max"]
-            NV_index = int(round(float(bt2390eetf(V, Lb, Lw, Lmin, Lmax))*(lt-1)))
-            NV = target_pq[NV_index]
-            target_pq_eetf.append(NV)
-        target_pq = np.array(target_pq_eetf)
-    
-    m, k1 = max_uniform_target(len(monitor_real_pq), DEFAULT_LUT_LEN*10)
-    monitor_real_pq = linear_interpolate(np.array(monitor_real_pq), m)
-    convert_idx = []
-    len_idx_real = m
-    for itm in target_pq:
-        idx= find_nearest_idx(monitor_real_pq, itm)
-        pq = idx/(len_idx_real-1)
-        convert_idx.append(pq)
+        NV_index = np.rint(eetf_curve_from_args(eetf_args, lt) * (lt-1)).astype(np.int64)
+        target_pq = target_pq[np.clip(NV_index, 0, lt-1)]
+
+    convert_idx = invert_monotone_curve(monitor_real_pq, target_pq)
     if not eetf_args:
         convert_idx[0] = 0
         convert_idx[1] = 1
-    return np.array(convert_idx)
-
+    return convert_idx
 
-def generate_mhc2_lut_from_measured_pq(real_pq, target_pq=None):
-    DEFAULT_LUT_LEN = 4096
-    for idx, itm in enumerate(real_pq):
-        if idx == 0:
-            continue
-        if itm < real_pq[idx-1]:
-            real_pq[idx] = real_pq[idx-1]
 
-    if not target_pq:
-        target_pq = np.linspace(0, 1, DEFAULT_LUT_LEN)
+def generate_mhc2_lut_from_measured_pq(real_pq, target_pq=None, lut_len=4096):
+    """
+    依据实测灰阶 PQ 曲线（输入PQ均匀采样 → 设备输出PQ）生成补偿 LUT。
+    target_pq: 目标输出曲线，None 时为长度 lut_len 的线性 PQ ramp
+    返回: 与 target_pq 等长的 LUT，值为应送入设备的输入 PQ(0..1)
+    """
+    if target_pq is None or len(target_pq) == 0:
+        target_pq = np.linspace(0, 1, lut_len)
     else:
         target_pq = np.array(target_pq, dtype=float)
-    
-    m, k1 = max_uniform_target(len(real_pq), DEFAULT_LUT_LEN*10)
-    real_pq = linear_interpolate(np.array(real_pq), m)
-    convert_idx = []
-    len_idx_real = m
-    for itm in target_pq:
-        idx= find_nearest_idx(real_pq, itm)
-        pq = idx/(len_idx_real-1)
-        convert_idx.append(pq)
-    return np.array(convert_idx)
+    return invert_monotone_curve(real_pq, target_pq)
+
+
+def _pchip_edge_slope(h0, h1, d0, d1):
+    # 端点三点单侧差分，保持单调（同 Fritsch–Carlson 的端点处理）
+    d = ((2 * h0 + h1) * d0 - h0 * d1) / (h0 + h1)
+    d = np.where(np.sign(d) != np.sign(d0), 0.0, d)
+    return np.where((np.sign(d0) != np.sign(d1)) & (np.abs(d) > 3 * np.abs(d0)), 3 * d0, d)
+
+
+def pchip_interpolate(x, y, xi):
+    """
+    分段三次 Hermite 保形插值（Fritsch–Carlson，向量化），单调数据插值后仍单调。
+    x: (N,) 严格递增的采样位置
+    y: (N,) 或 (N, C)，多通道沿第 0 维插值
+    xi: 查询位置，超出 [x[0], x[-1]] 时按端点段外推
+    返回: xi.shape + y.shape[1:]
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if x.ndim != 1 or x.size < 2 or y.shape[0] != x.size:
+        raise ValueError("x must be 1-D with at least 2 points matching y")
+    yy = y.reshape(x.size, -1)
+    h = np.diff(x)[:, None]
+    delta = np.diff(yy, axis=0) / h
+    m = np.empty_like(yy)
+    if x.size == 2:
+        m[:] = delta[0]
+    else:
+        h0, h1 = h[:-1], h[1:]
+        d0, d1 = delta[:-1], delta[1:]
+        w1, w2 = 2 * h1 + h0, h1 + 2 * h0
+        same = d0 * d1 > 0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mid = (w1 + w2) / (w1 / d0 + w2 / d1)
+        m[1:-1] = np.where(same, mid, 0.0)
+        m[0] = _pchip_edge_slope(h[0], h[1], delta[0], delta[1])
+        m[-1] = _pchip_edge_slope(h[-1], h[-2], delta[-1], delta[-2])
+
+    xi = np.asarray(xi, dtype=float)
+    flat = xi.ravel()
+    k = np.clip(np.searchsorted(x, flat, side="right") - 1, 0, x.size - 2)
+    hk = (x[k + 1] - x[k])[:, None]
+    t = ((flat - x[k]) / hk[:, 0])[:, None]
+    t2, t3 = t * t, t * t * t
+    out = ((2 * t3 - 3 * t2 + 1) * yy[k] + (t3 - 2 * t2 + t) * hk * m[k]
+           + (-2 * t3 + 3 * t2) * yy[k + 1] + (t3 - t2) * hk * m[k + 1])
+    return out.reshape(xi.shape + y.shape[1:])
+
+
+def resample_measured_pq(codes, measured_pq, n=1024, code_max=1023):
+    """
+    把非均匀码值上测得的输出 PQ 保形插值到输入 PQ 均匀的 n 个点，
+    结果可直接交给 generate_mhc2_lut_from_measured_pq。
+    codes: (N,) 升序码值；measured_pq: (N,) 或 (N, C)
+    """
+    codes = np.asarray(codes, dtype=float)
+    return pchip_interpolate(codes, measured_pq, np.linspace(0, code_max, n))
+
+
+def fit_pq_toe(points, black, code_max=1023):
+    """
+    暗部模型：Y(c) = black + s · pq_eotf(max(c - c0, 0) / code_max)，
+    即面板在偏移 c0 个码值后按比例 s 跟随 PQ（c0 > 0 为暗部压死，c0 < 0 为黑位抬升）。
+    points: [(码值, Y nit), ...]，Y 需高于 black；一个点时假定 c0 = 0，
+            多个点时取码值最小的两个求解 c0 与 s
+    返回: (c0, s)
+    """
+    pts = sorted((float(c), float(y) - black) for c, y in points if y > black)
+    if not pts:
+        raise ValueError("need at least one point above black")
+    (c1, y1) = pts[0]
+    if len(pts) == 1 or pts[1][0] == c1:
+        return 0.0, y1 / max(float(pq_eotf(c1 / code_max)), 1e-12)
+    (c2, y2) = pts[1]
+    ratio = y2 / y1
+
+    def model_ratio(c0):
+        return float(pq_eotf((c2 - c0) / code_max)) / max(float(pq_eotf((c1 - c0) / code_max)), 1e-12)
+
+    # c0 越接近 c1，两点比值越大；在 [-code_max, c1) 上二分
+    lo, hi = -float(code_max), c1 - 1e-6
+    if ratio <= model_ratio(lo):
+        c0 = lo
+    elif ratio >= model_ratio(hi):
+        c0 = hi
+    else:
+        for _ in range(60):
+            mid = 0.5 * (lo + hi)
+            if model_ratio(mid) < ratio:
+                lo = mid
+            else:
+                hi = mid
+        c0 = 0.5 * (lo + hi)
+    return c0, y1 / max(float(pq_eotf((c1 - c0) / code_max)), 1e-12)
+
+
+def predict_activation_code(points, black, delta, code_max=1023):
+    """
+    按 fit_pq_toe 的模型预测亮度首次超过 black + delta 的最小码值。
+    """
+    c0, s = fit_pq_toe(points, black, code_max)
+    c = c0 + code_max * float(pq_oetf(min(delta / s, 10000.0)))
+    return int(np.floor(c)) + 1
+
+
+# 灰阶输出 I ≈ PQ(Y)，ΔE_ITP = 720·sqrt(ΔI² + ΔT² + ΔP²)，纯亮度误差时约为 720·ΔPQ
+ITP_PER_PQ = 720.0
+
+
+def plan_gray_refinement(codes, measured_pq, budget=1.0, max_new=None, min_gap=2):
+    """
+    自适应灰阶采样：估计相邻已测码值之间插值的误差，返回需要加测的码值。
+    每个区间的误差取以下两者较大值（换算为 ΔE_ITP，多通道取最大）：
+      - 曲率：区间中点处保形三次插值与线性插值之差
+      - 残差：去掉区间端点后由其余点插值预测该点的偏差（留一法，除以 4 折算到当前间距）
+    codes: (N,) 升序、不重复的已测码值
+    measured_pq: (N,) 或 (N, C) 对应的输出 PQ
+    budget: 允许的 ΔE_ITP
+    max_new: 最多返回的码值数，误差大的区间优先
+    min_gap: 区间宽度小于 2*min_gap 时不再细分
+    返回: (新码值列表（升序）, 预测的最大 ΔE_ITP)
+    """
+    x = np.asarray(codes, dtype=float)
+    y = np.asarray(measured_pq, dtype=float).reshape(x.size, -1)
+    if x.size < 3:
+        raise ValueError("need at least 3 measured codes")
+    if np.any(np.diff(x) <= 0):
+        raise ValueError("codes must be strictly increasing")
+
+    mids = 0.5 * (x[:-1] + x[1:])
+    linear = 0.5 * (y[:-1] + y[1:])
+    curvature = np.max(np.abs(pchip_interpolate(x, y, mids) - linear), axis=1)
+
+    residual = np.zeros(x.size)
+    keep = np.ones(x.size, dtype=bool)
+    for i in range(1, x.size - 1):
+        keep[i] = False
+        pred = pchip_interpolate(x[keep], y[keep], x[i:i + 1])[0]
+        keep[i] = True
+        residual[i] = np.max(np.abs(pred - y[i]))
+    loo = 0.25 * np.maximum(residual[:-1], residual[1:])
+
+    err = ITP_PER_PQ * np.maximum(curvature, loo)
+    width = np.diff(x)
+    candidates = np.flatnonzero((err > budget) & (width >= 2 * min_gap))
+    candidates = candidates[np.argsort(-err[candidates], kind="stable")]
+    if max_new is not None:
+        candidates = candidates[:max(int(max_new), 0)]
+    new_codes = sorted({int(round(mids[k])) for k in candidates} - set(x.astype(int).tolist()))
+    return new_codes, float(err.max())
+
+
+class WhiteScaleSolver:
+    """
+    灰阶白点校准：同时求解 R/G/B 三个通道的 LUT 缩放系数，使该灰阶的实测 PQ 等于目标。
+    残差取 (实测 XYZ - 目标 XYZ) / 目标 Y，初始雅可比由 BT.2020→XYZ 矩阵与 PQ 解码的斜率得到
+    （假设通道 c 的驱动 PQ 为 target * s_c），之后每次读数用 Broyden 秩一更新修正，
+    学到显示器原色与 BT.2020 不一致带来的通道串扰。每次读数更新全部三个通道。
+    用法:
+        solver = WhiteScaleSolver(target_pq)
+        while not solver.done:
+            写入 solver.scales 并测量
+            solver.update(XYZ)
+        结果: solver.best_scales
+    """
+
+    def __init__(self, target_pq, scales=None, tol=0.002, max_step=0.05, max_iter=8):
+        """
+        target_pq: 目标 PQ 值 (0..1)，三个通道相同
+        scales: 初始缩放系数 (3,)，默认全 1（可用上一灰阶的结果热启动）
+        tol: 各通道实测/目标 PQ 比值与 1 的最大允许偏差
+        max_step: 单次迭代每个通道缩放系数的最大变化
+        max_iter: 最多读数次数
+        """
+        self.target = float(target_pq)
+        if not 0 < self.target <= 1:
+            raise ValueError("target_pq 必须在 (0, 1] 内")
+        self.scales = np.ones(3) if scales is None else np.array(scales, dtype=float)
+        self.tol = float(tol)
+        self.max_step = float(max_step)
+        self.max_iter = int(max_iter)
+        self.target_xyz = BT2020_linear_to_XYZ(pq_decode(np.full(3, self.target))) * 10000
+        self.jacobian = self._model_jacobian(self.scales)
+        self.readings = 0
+        self.done = False
+        self.ratio = None
+        self.best_scales = self.scales.copy()
+        self.best_error = np.inf
+        self._last = None
+
+    def _model_jacobian(self, scales):
+        # d(XYZ / Y_target) / d(s_c) = BT2020_to_XYZ 第 c 列 * 10000 * pq_decode'(t * s_c) * t
+        h = 1e-4
+        drive = np.clip(self.target * scales, h, 1 - h)
+        slope = (pq_decode(drive + h) - pq_decode(drive - h)) / (2 * h) * self.target * 10000
+        return BT2020_linear_to_XYZ(np.eye(3)).reshape(3, 3) * slope / self.target_xyz[1]
+
+    def update(self, XYZ):
+        """
+        提交当前 scales 下的实测 XYZ (nit)，更新雅可比并给出下一组 scales。
+        返回 True 表示已收敛或达到读数上限。
+        """
+        XYZ = np.asarray(XYZ, dtype=float)
+        self.readings += 1
+        residual = (XYZ - self.target_xyz) / self.target_xyz[1]
+        self.ratio = XYZ_to_BT2020_PQ_rgb(XYZ / 10000) / self.target
+        error = float(np.max(np.abs(self.ratio - 1)))
+        if error < self.best_error:
+            self.best_error = error
+            self.best_scales = self.scales.copy()
+
+        if self._last is not None:
+            last_scales, last_residual = self._last
+            ds = self.scales - last_scales
+            norm = float(ds @ ds)
+            if norm > 0:
+                dr = residual - last_residual
+                self.jacobian = self.jacobian + np.outer(dr - self.jacobian @ ds, ds) / norm
+
+        if error <= self.tol or self.readings >= self.max_iter:
+            self.done = True
+            return True
+        step = np.linalg.lstsq(self.jacobian, -residual, rcond=None)[0]
+        step = np.clip(step, -self.max_step, self.max_step)
+        self._last = (self.scales.copy(), residual)
+        self.scales = np.maximum(self.scales + step, 1e-3)
+        return False
+
+
+def fixed_step_readings(scales, step=0.00390625, passes=2):
+    """
+    估计旧的逐通道定步长搜索达到 scales 所需的读数：第一轮每个通道走到越过目标，
+    之后每一轮每个通道至少需要两次读数确认。
+    """
+    first = np.ceil(np.abs(np.asarray(scales, dtype=float) - 1) / step) + 1
+    return int(first.sum() + 2 * len(first) * (passes - 1))
 
 
 def eetf_from_lut(lut, eetf_args=None):
@@ -379,26 +628,16 @@ def eetf_from_lut(lut, eetf_args=None):
     TARGET_LEN = 4096
     idx_target = np.linspace(0, 1, TARGET_LEN)
     if eetf_args:
-        Lb = eetf_args["source_min"]
-        Lw = eetf_args["source_max"]
-        Lmin = eetf_args["monitor_min"]
-        Lmax = eetf_args["monitor_max"]
-        idx_target_eetf = []
-        for idx in range(len(idx_target)):
-            V = idx_target[idx]
-            idx_target_eetf.append(float(bt2390eetf(V, Lb, Lw, Lmin, Lmax)))
-        idx_target = np.array(idx_target_eetf)
+        idx_target = np.array(eetf_curve_from_args(eetf_args, TARGET_LEN))
     if lut == [0, 1]:
         return idx_target
+    lut = np.asarray(lut, dtype=float)
     len_lut = len(lut)
-    convert_idx = []
-    for itm in idx_target:
-        idx= int(round(itm * (len_lut-1)))
-        pq = lut[idx]
-        convert_idx.append(pq)
+    idx = np.clip(np.rint(idx_target * (len_lut-1)).astype(np.int64), 0, len_lut-1)
+    convert_idx = lut[idx]
     # When pq idx 0, turn off the mini‑LED backlight or power down the OLED.
     convert_idx[0] = 0
-    return np.array(convert_idx)
+    return convert_idx
 
 # 示例：生成 LUT 数据并输出（可根据需要修改参数）
 if __name__ == "__main__":
@@ -1,6 +1,8 @@
 import numpy as np
 from convert_utils import *
 
+# dropY 系列拟合只比较色度，统一换算到该亮度 (nit) 的 XYZ
+DROPY_Y_ABS = 10.0
 
 def build_rgb_to_xyz_from_primaries(xy_R, xy_G, xy_B, xy_W):
     """
@@ -97,6 +99,29 @@ def calc_rgb_mapping_matrix_non_normalized(source_primaries, target_primaries):
     return mapping
 
 
+def _weighted_normal_equations(XYZ_measured, XYZ_target, w=None):
+    """
+    组装 C @ x_i ≈ y_i 的加权正规方程。
+    vec(C)（行优先）的 9x9 系统 A^T W A = I3 ⊗ G 是块对角的，每行共享同一个 3x3 Gram 矩阵，
+    因此无需构造 (3n x 9) 的 kron 设计矩阵:
+      G = X^T W X   (3,3)
+      B = Y^T W X   (3,3)，第 k 行即第 k 个输出通道的右端项
+    返回 (G, B)
+    """
+    XYZ_measured = np.asarray(XYZ_measured, float)
+    XYZ_target  = np.asarray(XYZ_target,  float)
+    n = XYZ_measured.shape[0]
+    if w is None:
+        Xw = XYZ_measured
+    else:
+        w = np.asarray(w, float).reshape(-1)
+        if w.size != n:
+            raise ValueError("weights length mismatch")
+        Xw = XYZ_measured * w[:, None]
+    G = Xw.T @ XYZ_measured
+    B = XYZ_target.T @ Xw
+    return G, B
+
 def fit_XYZ2XYZ_wlock(XYZ_measured, XYZ_target, XYZ_w_measured, XYZ_w_target, w=None, l2=0.0):
     """
     拟合 3x3 矩阵 C，使得 C @ X_meas ≈ X_tgt，并满足白点硬约束 C @ Xw_meas = Xw_tgt。
@@ -110,66 +135,41 @@ def fit_XYZ2XYZ_wlock(XYZ_measured, XYZ_target, XYZ_w_measured, XYZ_w_target, w=
     返回:
       C: (3,3)  校正矩阵（XYZ→XYZ）
     """
-    XYZ_measured = np.asarray(XYZ_measured, float)
-    XYZ_target  = np.asarray(XYZ_target,  float)
     XYZ_w_measured = np.asarray(XYZ_w_measured, float).reshape(3)
     XYZ_w_target  = np.asarray(XYZ_w_target,  float).reshape(3)
-    n = XYZ_measured.shape[0]
-    I3 = np.eye(3)
 
-    # 构造普通样本的 A、b：  vec(C) 的未知量个数=9
-    # 对每个样本 i： (I3 ⊗ X_meas[i]^T) · vec(C) ≈ X_tgt[i]
-    A = np.zeros((3*n, 9))
-    b = XYZ_target.reshape(-1)
-    for i in range(n):
-        xi = XYZ_measured[i].reshape(1,3)               # (1,3)
-        A[3*i:3*i+3, :] = np.kron(I3, xi)         # (3,9)
-
-    # 加权（可选）
-    if w is not None:
-        w = np.asarray(w, float).reshape(-1)
-        W = np.repeat(np.sqrt(w), 3)              # 对XYZ 3维同步加权
-        A = A * W[:,None]
-        b = b * W
-
-    # 白点硬约束： C @ Xw_meas = Xw_tgt
-    # 约束矩阵 Cc 满足： (I3 ⊗ Xw_meas^T) · vec(C) = Xw_tgt
-    Cc = np.kron(I3, XYZ_w_measured.reshape(1,3))        # (3,9)
-    d  = XYZ_w_target.reshape(3)
-
-    # L2 正则（可选）：在 ATA 对角线上加 l2
-    ATA = A.T @ A
-    ATb = A.T @ b
+    # 正规方程按行分块：每一行 c_k 满足 G c_k = B[k]
+    G, B = _weighted_normal_equations(XYZ_measured, XYZ_target, w)
+    # L2 正则（可选）：在 G 对角线上加 l2
     if l2 > 0:
-        ATA = ATA + l2 * np.eye(9)
-
-    # 组装 KKT 系统：
-    # [ ATA   Cc^T ] [m]   = [ATb]
-    # [ Cc     0  ] [λ]     [ d ]
-    KKT = np.block([
-        [ATA,        Cc.T],
-        [Cc,  np.zeros((3,3))]
-    ])
-    rhs = np.concatenate([ATb, d])
+        G = G + l2 * np.eye(3)
+
+    # 白点硬约束 C @ Xw_meas = Xw_tgt 同样按行分解为 c_k · Xw_meas = Xw_tgt[k]
+    # 原 12x12 KKT 系统因此化为一个 4x4 系统、3 个右端项：
+    # [ G        Xw ] [c_k]   = [B[k]     ]
+    # [ Xw^T     0  ] [λ_k]     [Xw_tgt[k]]
+    KKT = np.zeros((4, 4))
+    KKT[:3, :3] = G
+    KKT[:3, 3] = XYZ_w_measured
+    KKT[3, :3] = XYZ_w_measured
+    rhs = np.vstack([B.T, XYZ_w_target.reshape(1, 3)])  # (4,3)，第 k 列对应 C 的第 k 行
 
     sol = np.linalg.solve(KKT, rhs)
-    m = sol[:9]  # vec(C)
-    # 注意这里 vec 是按行块构造的： (I3 ⊗ x^T)，因此还原时用行优先
-    C = m.reshape(3,3, order='C')
+    C = sol[:3, :].T
     return C
 
-def fit_XYZ2XYZ_wlock_dropY(XYZ_measured, XYZ_target, XYZ_w_measured, XYZ_w_target, w=None, l2=0.0):
+def _dropY_samples(XYZ_measured, XYZ_target, w=None):
+    """
+    dropY 系列的公共预处理：只保留色度，把样本统一换算到固定亮度 (Y=10 nit) 的 XYZ。
+    返回 (X_meas_fixed, X_tgt_fixed, w_valid, valid)，valid 为原始样本中参与拟合的掩码。
+    """
     XYZ_measured = np.asarray(XYZ_measured, float)
     XYZ_target  = np.asarray(XYZ_target,  float)
-    XYZ_w_measured = np.asarray(XYZ_w_measured, float).reshape(3)
-    XYZ_w_target  = np.asarray(XYZ_w_target,  float).reshape(3)
     if XYZ_measured.ndim != 2 or XYZ_measured.shape[1] != 3 or XYZ_target.shape != XYZ_measured.shape:
         raise ValueError("X_meas/X_tgt must be (n,3) with the same shape")
 
     xy_measured = XYZ_to_xy(XYZ_measured)  # (n,2) with possible nan for invalid rows
     xy_target  = XYZ_to_xy(XYZ_target)
-    xy_w_measured = XYZ_to_xy(XYZ_w_measured)
-    xy_w_target  = XYZ_to_xy(XYZ_w_target)
 
     valid = (
         np.all(np.isfinite(xy_measured), axis=1) &
@@ -182,16 +182,12 @@ def fit_XYZ2XYZ_wlock_dropY(XYZ_measured, XYZ_target, XYZ_w_measured, XYZ_w_targ
 
     xy_measured = xy_measured[valid]
     xy_target  = xy_target[valid]
-    
 
-    Y_abs = 10.0
-    xyY_measured = np.column_stack([xy_measured, np.full(xy_measured.shape[0], Y_abs, dtype=float)])
-    xyY_target  = np.column_stack([xy_target,  np.full(xy_target.shape[0],  Y_abs, dtype=float)])
+    xyY_measured = np.column_stack([xy_measured, np.full(xy_measured.shape[0], DROPY_Y_ABS, dtype=float)])
+    xyY_target  = np.column_stack([xy_target,  np.full(xy_target.shape[0],  DROPY_Y_ABS, dtype=float)])
 
-    xyz_measured_fixed = xyY_to_XYZ(xyY_measured)  
-    xyz_target_fixed  = xyY_to_XYZ(xyY_target)
-    xyz_w_measured_fixed = xyY_to_XYZ([*xy_w_measured, Y_abs])
-    xyz_w_target_fixed  = xyY_to_XYZ([*xy_w_target,  Y_abs])
+    X_meas_fixed = xyY_to_XYZ(xyY_measured)
+    X_tgt_fixed  = xyY_to_XYZ(xyY_target)
 
     ww = None
     if w is not None:
@@ -199,45 +195,114 @@ def fit_XYZ2XYZ_wlock_dropY(XYZ_measured, XYZ_target, XYZ_w_measured, XYZ_w_targ
         if w.size != XYZ_measured.shape[0]:
             raise ValueError("weights length mismatch")
         ww = w[valid]
+    return X_meas_fixed, X_tgt_fixed, ww, valid
+
+def _dropY_white(XYZ_w):
+    xy_w = XYZ_to_xy(np.asarray(XYZ_w, float).reshape(3))
+    return xyY_to_XYZ([*xy_w, DROPY_Y_ABS])
+
+def fit_XYZ2XYZ_wlock_dropY(XYZ_measured, XYZ_target, XYZ_w_measured, XYZ_w_target, w=None, l2=0.0):
+    xyz_measured_fixed, xyz_target_fixed, ww, _ = _dropY_samples(XYZ_measured, XYZ_target, w)
+    xyz_w_measured_fixed = _dropY_white(XYZ_w_measured)
+    xyz_w_target_fixed  = _dropY_white(XYZ_w_target)
 
     C = fit_XYZ2XYZ_wlock(xyz_measured_fixed, xyz_target_fixed, xyz_w_measured_fixed, xyz_w_target_fixed, w=ww, l2=l2)
     return C
 
-def fit_XYZ2XYZ_dropY(XYZ_measured, XYZ_target, w=None, l2=0.0):
+def robust_weights(u, method="huber", c=None):
+    """
+    IRLS 的鲁棒权重。
+    u: 标准化残差 |r| / s
+    method: "huber"（默认 c=1.345）或 "tukey"（双权，默认 c=4.685，超过 c 的样本权重为 0）
+    """
+    u = np.abs(np.asarray(u, float))
+    if method == "huber":
+        c = 1.345 if c is None else c
+        return np.where(u <= c, 1.0, c / np.maximum(u, 1e-300))
+    if method == "tukey":
+        c = 4.685 if c is None else c
+        return np.where(u < c, (1 - (u / c)**2)**2, 0.0)
+    raise ValueError("method must be 'huber' or 'tukey'")
+
+def fit_XYZ2XYZ_wlock_robust(XYZ_measured, XYZ_target, XYZ_w_measured, XYZ_w_target, w=None, l2=0.0,
+                             method="huber", c=None, max_iter=30, tol=1e-8, outlier_threshold=3.0):
+    """
+    白点锁定拟合的鲁棒版本：迭代重加权最小二乘 (IRLS)，每轮用 Huber/Tukey 权重压低大残差样本。
+    白点硬约束 C @ Xw_meas = Xw_tgt 在每一轮都保持。
+    参数:
+      w: 可选的先验权重，与鲁棒权重相乘
+      method/c: 见 robust_weights
+      max_iter/tol: 迭代上限；矩阵相对变化小于 tol 时停止
+      outlier_threshold: 标准化残差超过该值的样本标记为离群点
+    返回:
+      C: (3,3)
+      info: {
+        "residuals": (n,) 每个样本的残差 ||C @ x_i - y_i||,
+        "scaled_residuals": (n,) 残差 / 鲁棒尺度 (1.4826 * median),
+        "weights": (n,) 最终鲁棒权重,
+        "outliers": (n,) bool,
+        "scale": float,
+        "iterations": int
+      }
+    """
     XYZ_measured = np.asarray(XYZ_measured, float)
     XYZ_target  = np.asarray(XYZ_target,  float)
-    if XYZ_measured.ndim != 2 or XYZ_measured.shape[1] != 3 or XYZ_target.shape != XYZ_measured.shape:
-        raise ValueError("X_meas/X_tgt must be (n,3) with the same shape")
-
-    xy_measured = XYZ_to_xy(XYZ_measured)  # (n,2) with possible nan for invalid rows
-    xy_target  = XYZ_to_xy(XYZ_target)
-
-    valid = (
-        np.all(np.isfinite(xy_measured), axis=1) &
-        np.all(np.isfinite(xy_target),  axis=1) &
-        (xy_measured[:, 1] > 0) &
-        (xy_target[:,  1] > 0)
-    )
-    if not np.any(valid):
-        raise ValueError("No valid samples after xy conversion")
-
-    xy_measured = xy_measured[valid]
-    xy_target  = xy_target[valid]
-
-    Y_abs = 10.0
-    xyY_measured = np.column_stack([xy_measured, np.full(xy_measured.shape[0], Y_abs, dtype=float)])
-    xyY_target  = np.column_stack([xy_target,  np.full(xy_target.shape[0],  Y_abs, dtype=float)])
-
-    X_meas_fixed = xyY_to_XYZ(xyY_measured)  
-    X_tgt_fixed  = xyY_to_XYZ(xyY_target)
-
-    ww = None
-    if w is not None:
-        w = np.asarray(w, float).reshape(-1)
-        if w.size != XYZ_measured.shape[0]:
-            raise ValueError("weights length mismatch")
-        ww = w[valid]
+    n = XYZ_measured.shape[0]
+    prior = np.ones(n) if w is None else np.asarray(w, float).reshape(-1)
+    if prior.size != n:
+        raise ValueError("weights length mismatch")
+
+    rw = np.ones(n)
+    C = fit_XYZ2XYZ_wlock(XYZ_measured, XYZ_target, XYZ_w_measured, XYZ_w_target, w=prior, l2=l2)
+    iterations = 0
+    for iterations in range(1, max_iter + 1):
+        r = np.linalg.norm(XYZ_measured @ C.T - XYZ_target, axis=1)
+        s = 1.4826 * np.median(r)
+        if s <= np.finfo(float).tiny:
+            break
+        rw_new = robust_weights(r / s, method, c)
+        # Tukey 可能把过多样本权重清零，剩余样本不足以定解时保留上一轮结果
+        if np.count_nonzero(rw_new * prior) < 3:
+            break
+        rw = rw_new
+        C_new = fit_XYZ2XYZ_wlock(XYZ_measured, XYZ_target, XYZ_w_measured, XYZ_w_target, w=prior * rw, l2=l2)
+        delta = np.abs(C_new - C).max()
+        C = C_new
+        if delta <= tol * max(np.abs(C).max(), 1e-300):
+            break
+
+    r = np.linalg.norm(XYZ_measured @ C.T - XYZ_target, axis=1)
+    s = 1.4826 * np.median(r)
+    u = r / s if s > np.finfo(float).tiny else np.zeros(n)
+    info = {
+        "residuals": r,
+        "scaled_residuals": u,
+        "weights": rw,
+        "outliers": u > outlier_threshold,
+        "scale": float(s),
+        "iterations": iterations,
+    }
+    return C, info
+
+def fit_XYZ2XYZ_wlock_dropY_robust(XYZ_measured, XYZ_target, XYZ_w_measured, XYZ_w_target, w=None, l2=0.0,
+                                   method="huber", c=None, max_iter=30, tol=1e-8, outlier_threshold=3.0):
+    """
+    fit_XYZ2XYZ_wlock_dropY 的鲁棒版本（参数同 fit_XYZ2XYZ_wlock_robust）。
+    info 中的逐样本数组与输入样本一一对应；xy 无效而未参与拟合的样本残差为 nan、不标记为离群。
+    """
+    X_fixed, Y_fixed, ww, valid = _dropY_samples(XYZ_measured, XYZ_target, w)
+    C, sub = fit_XYZ2XYZ_wlock_robust(X_fixed, Y_fixed, _dropY_white(XYZ_w_measured), _dropY_white(XYZ_w_target),
+                                      w=ww, l2=l2, method=method, c=c, max_iter=max_iter, tol=tol,
+                                      outlier_threshold=outlier_threshold)
+    info = dict(sub)
+    for key, fill in (("residuals", np.nan), ("scaled_residuals", np.nan), ("weights", 0.0), ("outliers", False)):
+        full = np.full(valid.shape[0], fill, dtype=np.asarray(sub[key]).dtype)
+        full[valid] = sub[key]
+        info[key] = full
+    return C, info
 
+def fit_XYZ2XYZ_dropY(XYZ_measured, XYZ_target, w=None, l2=0.0):
+    X_meas_fixed, X_tgt_fixed, ww, _ = _dropY_samples(XYZ_measured, XYZ_target, w)
     C = fit_XYZ2XYZ(X_meas_fixed, X_tgt_fixed, w=ww, l2=l2)
     return C
 
@@ -254,40 +319,21 @@ def fit_XYZ2XYZ(XYZ_measured, XYZ_target, w=None, l2=0.0):
       C: (3,3) mapping matrix
     """
     XYZ_measured = np.asarray(XYZ_measured, float)
-    XYZ_target  = np.asarray(XYZ_target,  float)
     n = XYZ_measured.shape[0]
     if n == 0:
         raise ValueError("No samples provided")
 
-    I3 = np.eye(3)
-    # Build A (3n x 9) and b (3n,)
-    A = np.zeros((3 * n, 9))
-    b = XYZ_target.reshape(-1)
-    for i in range(n):
-        xi = XYZ_measured[i].reshape(1, 3)
-        A[3*i:3*i+3, :] = np.kron(I3, xi)
-
-    # Apply weights if given (same scheme as white-lock version)
-    if w is not None:
-        w = np.asarray(w, float).reshape(-1)
-        if w.size != n:
-            raise ValueError("weights length mismatch")
-        W = np.repeat(np.sqrt(w), 3)
-        A = A * W[:, None]
-        b = b * W
-
-    ATA = A.T @ A
-    ATb = A.T @ b
+    # Block-diagonal normal equations: every row of C shares the same 3x3 Gram matrix
+    G, B = _weighted_normal_equations(XYZ_measured, XYZ_target, w)
     if l2 > 0:
-        ATA = ATA + l2 * np.eye(9)
+        G = G + l2 * np.eye(3)
 
-    # Solve normal equations; fallback to lstsq if singular
+    # Solve G @ C^T = B^T; fallback to the minimum-norm solution if singular
     try:
-        m = np.linalg.solve(ATA, ATb)
+        C = np.linalg.solve(G, B.T).T
     except np.linalg.LinAlgError:
-        m, *_ = np.linalg.lstsq(A, b, rcond=None)
-
-    C = m.reshape(3, 3, order='C')
+        Ct, *_ = np.linalg.lstsq(G, B.T, rcond=None)
+        C = Ct.T
     return C
 
 
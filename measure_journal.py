@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+测量日志：每次读数立即追加写入 SQLite，程序崩溃、spotread 超时或中途关闭后可从
+最后一个完成的色块继续，而不是从头重测。
+
+每条读数记录 会话 / 阶段 / 阶段内序号 / 色块 RGB / 当前配置文件内容哈希 / 仪器 / 时间戳。
+续测时按阶段重放：同一阶段、同一配置文件下序号与 RGB 都一致的读数直接复用，
+第一次不一致（或没有记录）后该阶段转为实测。测量流程由前面的读数决定后面的色块，
+重放相同读数会得到相同的色块序列，因此二分查找等自适应步骤也能正确续测。
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+JOURNAL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "measurements.db")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    display TEXT NOT NULL,
+    instrument TEXT NOT NULL,
+    started REAL NOT NULL,
+    finished REAL
+);
+CREATE TABLE IF NOT EXISTS readings (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session INTEGER NOT NULL REFERENCES sessions(id),
+    stage TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    rgb TEXT NOT NULL,
+    profile TEXT NOT NULL,
+    instrument TEXT NOT NULL,
+    ts REAL NOT NULL,
+    X REAL NOT NULL,
+    Y REAL NOT NULL,
+    Z REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS readings_stage ON readings(session, stage, profile, seq);
+"""
+
+
+def _rgb_key(rgb):
+    return json.dumps([round(float(v), 6) for v in rgb])
+
+
+class MeasurementJournal:
+    def __init__(self, path=JOURNAL_PATH, display="", instrument=""):
+        """
+        path: SQLite 文件路径
+        display / instrument: 当前显示器与仪器描述，用于匹配可续测的会话
+        """
+        self.path = path
+        self.display = display or ""
+        self.instrument = instrument or ""
+        # 读数在测量线程写入，会话在界面线程开启，共用一个连接并加锁
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._conn.commit()
+        self.session = None
+        self.stage_name = None
+        self.profile = ""
+        self.replayed = 0
+        self.recorded = 0
+        self._seq = 0
+        self._cached = {}
+        self._replaying = False
+
+    # ---------------- 会话 ----------------
+    def find_unfinished(self, kind):
+        """同一显示器、仪器、流程下最近一次未完成的会话，返回 (session_id, 读数数) 或 None。"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT s.id, COUNT(r.id) FROM sessions s "
+                "LEFT JOIN readings r ON r.session = s.id "
+                "WHERE s.kind = ? AND s.display = ? AND s.instrument = ? AND s.finished IS NULL "
+                "GROUP BY s.id ORDER BY s.id DESC LIMIT 1",
+                (kind, self.display, self.instrument)).fetchone()
+        if row is None or row[1] == 0:
+            return None
+        return row[0], row[1]
+
+    def start(self, kind, resume=None):
+        """
+        开始会话。resume 为 find_unfinished 返回的会话 id 时在该会话上继续，
+        否则新建会话。
+        """
+        with self._lock:
+            if resume is None:
+                cur = self._conn.execute(
+                    "INSERT INTO sessions (kind, display, instrument, started) VALUES (?, ?, ?, ?)",
+                    (kind, self.display, self.instrument, time.time()))
+                self._conn.commit()
+                self.session = cur.lastrowid
+            else:
+                self.session = int(resume)
+        self.replayed = 0
+        self.recorded = 0
+        self.stage_name = None
+        return self.session
+
+    def finish(self):
+        """流程正常完成，之后不再作为续测候选。"""
+        if self.session is None:
+            return
+        with self._lock:
+            self._conn.execute("UPDATE sessions SET finished = ? WHERE id = ?",
+                               (time.time(), self.session))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # ---------------- 阶段与读数 ----------------
+    def stage(self, name, profile=None):
+        """
+        进入测量阶段。profile: 当前生效配置文件的内容哈希（None 表示未加载预览配置）。
+        载入该阶段已有读数用于重放。
+        """
+        self.stage_name = name
+        self.profile = profile or ""
+        self._seq = 0
+        self._cached = {}
+        if self.session is None:
+            self._replaying = False
+            return
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, rgb, X, Y, Z FROM readings "
+                "WHERE session = ? AND stage = ? AND profile = ? ORDER BY id",
+                (self.session, name, self.profile)).fetchall()
+        for seq, rgb, X, Y, Z in rows:
+            # 同一序号多次记录（之前的续测分叉）时以最新的为准
+            self._cached[(seq, rgb)] = np.array([X, Y, Z])
+        self._replaying = bool(self._cached)
+
+    def next_seq(self):
+        seq = self._seq
+        self._seq += 1
+        return seq
+
+    def replay(self, seq, rgb):
+        """返回已记录的 XYZ (ndarray)；没有记录时返回 None，并结束本阶段的重放。"""
+        if not self._replaying:
+            return None
+        XYZ = self._cached.get((seq, _rgb_key(rgb)))
+        if XYZ is None:
+            self._replaying = False
+            return None
+        self.replayed += 1
+        return XYZ.copy()
+
+    def record(self, seq, rgb, XYZ):
+        if self.session is None or self.stage_name is None or XYZ is None:
+            return
+        X, Y, Z = (float(v) for v in XYZ)
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO readings (session, stage, seq, rgb, profile, instrument, ts, X, Y, Z) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.session, self.stage_name, seq, _rgb_key(rgb), self.profile,
+                 self.instrument, time.time(), X, Y, Z))
+            self._conn.commit()
+        self.recorded += 1
+
+    def readings(self, session=None, stage=None):
+        """按写入顺序返回读数 [(stage, seq, rgb, profile, ts, [X, Y, Z]), ...]。"""
+        session = self.session if session is None else session
+        sql = "SELECT stage, seq, rgb, profile, ts, X, Y, Z FROM readings WHERE session = ?"
+        params = [session]
+        if stage is not None:
+            sql += " AND stage = ?"
+            params.append(stage)
+        with self._lock:
+            rows = self._conn.execute(sql + " ORDER BY id", params).fetchall()
+        return [(s, q, json.loads(rgb), p, ts, [X, Y, Z]) for s, q, rgb, p, ts, X, Y, Z in rows]
@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+"""
+虚拟 HDR 面板：在进程内同时模拟显示器与色度计，用于端到端评估校准耗时与校准后色差。
+
+设置 RWHC_INSTRUMENT=sim 后 ColorReader/ColorWriter 自动接到共享的虚拟面板上，
+app 的 set_icc/clean_icc 改为把 MHC2 矩阵与 LUT 加载到面板，不再调用系统色彩管理。
+面板参数可通过 RWHC_SIM_CONFIG（json 文件路径或 json 字符串）覆盖 VirtualPanel 的构造参数。
+
+信号链（均为 10000nit 归一化）：
+  BT.2020 PQ 信号 -> [MHC2: XYZ 矩阵 -> BT.2020 PQ -> 每通道 LUT]
+  -> 面板：每通道非理想 PQ 响应与增益 -> 按标称 P3 映射到原生原色（实际原色有偏差）
+  -> 峰值截断 -> ABL（按窗口面积限制总亮度）-> 加黑位 -> 预热漂移 -> 稳定滞后
+  -> 色度计：积分延迟 + 读数噪声
+所有等待都走模拟时钟（time_scale=0 时不真实 sleep），整个校准几秒即可跑完。
+"""
+import collections
+import json
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+from meta_data import BT2020_xy, P3D65_xy, sRGB_xy, D65_WHITE_POINT
+from convert_utils import (pq_encode, pq_decode, xyY_to_XYZ, XYZ_to_bt2020_linear,
+                           BT2020_linear_to_XYZ, XYZ_to_BT2020_PQ_rgb)
+from matrix import build_rgb_to_xyz_from_primaries
+from delteE import XYZdeltaE2000, XYZdeltaE_ITP
+from color_rw import TransportEOF
+from fake_instrument import PROMPT, apply_command, format_result
+
+SIM_CONFIG_ENV = "RWHC_SIM_CONFIG"
+
+# 默认原生原色：略偏离 P3，白点偏冷
+NATIVE_PRIMARIES = {
+    "red":   [0.6760, 0.3180],
+    "green": [0.2700, 0.6720],
+    "blue":  [0.1490, 0.0580],
+    "white": [0.3090, 0.3230],
+}
+
+
+def _primaries_M(xy):
+    return build_rgb_to_xyz_from_primaries(xy["red"], xy["green"], xy["blue"], xy["white"])
+
+
+class SimClock:
+    """模拟时钟。time_scale > 0 时按比例真实 sleep（用于观察界面），默认不 sleep。"""
+    def __init__(self, time_scale=0.0):
+        self.now = 0.0
+        self.time_scale = float(time_scale)
+
+    def sleep(self, seconds):
+        if seconds <= 0:
+            return
+        self.now += seconds
+        if self.time_scale > 0:
+            time.sleep(seconds * self.time_scale)
+
+
+class VirtualPanel:
+    def __init__(self, primaries=None, peak=800.0, black=0.03,
+                 pq_gamma=(1.04, 0.98, 1.01), pq_gain=(1.0, 0.97, 1.02),
+                 window=10.0, abl_full=300.0, noise=0.002, noise_floor=0.0005,
+                 settle_tau=0.08, drift=0.03, drift_tau=900.0, read_latency=0.6,
+                 time_scale=0.0, seed=0):
+        """
+        primaries: 原生原色与白点 xy（默认 NATIVE_PRIMARIES），面板按标称 P3 做映射
+        peak / black: 峰值亮度与黑位 (nit)
+        pq_gamma / pq_gain: 每通道 PQ 响应偏差，code' = code^gamma，线性亮度再乘 gain
+        window / abl_full: dogegen 窗口占屏百分比；全屏可持续亮度 (nit)。色块面积 =
+                           window * 命令中的窗口大小（window size / draw 矩形，百分比），
+                           面积*亮度超过 abl_full*100 时整体压暗
+        noise / noise_floor: 读数相对噪声标准差与绝对噪声 (nit)
+        settle_tau: 切换画面后输出按指数趋近目标的时间常数 (s)
+        drift / drift_tau: 冷机时亮度偏低的比例与预热时间常数 (s)
+        read_latency: 每次读数的积分耗时 (s)
+        time_scale: 模拟时间折算为真实 sleep 的比例
+        seed: 噪声随机种子，相同测量序列得到相同结果
+        """
+        self.primaries = primaries or NATIVE_PRIMARIES
+        self.peak = float(peak)
+        self.black = float(black)
+        self.pq_gamma = np.asarray(pq_gamma, dtype=float)
+        self.pq_gain = np.asarray(pq_gain, dtype=float)
+        self.window = float(window)
+        self.abl_full = float(abl_full)
+        self.noise = float(noise)
+        self.noise_floor = float(noise_floor)
+        self.settle_tau = float(settle_tau)
+        self.drift = float(drift)
+        self.drift_tau = float(drift_tau)
+        self.read_latency = float(read_latency)
+        self.clock = SimClock(time_scale)
+        self.rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+
+        # 面板内部：BT.2020 线性 -> 标称 P3 原生 RGB；实际发光按真实原色
+        self._to_native = np.linalg.solve(_primaries_M(P3D65_xy), _primaries_M(BT2020_xy))
+        self._native_M = _primaries_M(self.primaries)
+        self._black_XYZ = xyY_to_XYZ([*D65_WHITE_POINT, self.black])
+
+        self.mhc2 = None
+        self._target = self._black_XYZ.copy()
+        self._prev = self._black_XYZ.copy()
+        self._t_change = 0.0
+        self.reset_stats()
+
+    # ---------------- MHC2 ----------------
+    def load_mhc2(self, mhc2):
+        """加载 MHC2（read_MHC2 / app.MHC2 格式的 dict）；None 表示不做校准（直通）。"""
+        if mhc2 is None:
+            self.mhc2 = None
+            return
+        matrix = mhc2.get("matrix")
+        luts = [mhc2.get(f"{c}_lut") for c in ("red", "green", "blue")]
+        self.mhc2 = {
+            "matrix": None if matrix is None else np.asarray(matrix, dtype=float).reshape(3, 3),
+            "luts": [None if l is None else np.asarray(l, dtype=float) for l in luts],
+        }
+
+    def load_icc(self, path):
+        from icc_rw import ICCProfile
+        with ICCProfile(path, lazy=True) as profile:
+            self.load_mhc2(profile.read_MHC2(as_array=True))
+
+    def apply_mhc2(self, rgb_pq):
+        """BT.2020 PQ 信号经过当前 MHC2 后送给面板的 PQ 信号。"""
+        rgb_pq = np.clip(np.asarray(rgb_pq, dtype=float), 0.0, 1.0)
+        if self.mhc2 is None:
+            return rgb_pq
+        if self.mhc2["matrix"] is not None:
+            XYZ = self.mhc2["matrix"] @ BT2020_linear_to_XYZ(pq_decode(rgb_pq))
+            rgb_pq = pq_encode(np.clip(XYZ_to_bt2020_linear(XYZ), 0.0, 1.0))
+        out = np.empty(3)
+        for c, lut in enumerate(self.mhc2["luts"]):
+            if lut is None or lut.size < 2:
+                out[c] = rgb_pq[c]
+            else:
+                out[c] = np.interp(rgb_pq[c], np.linspace(0.0, 1.0, lut.size), lut)
+        return np.clip(out, 0.0, 1.0)
+
+    # ---------------- 面板 ----------------
+    def steady_XYZ(self, rgb_pq, hdr=True, apply_calibration=True, size=100.0):
+        """
+        信号稳定、预热完成后的输出 XYZ（10000nit 归一化，无噪声）。
+        rgb_pq: 归一化信号；SDR 模式按 sRGB 原色 + gamma 2.2（200nit 白）换算为 PQ
+        size: 色块占 dogegen 窗口面积的百分比，决定 ABL 压暗程度
+        """
+        rgb = np.clip(np.asarray(rgb_pq, dtype=float), 0.0, 1.0)
+        if not hdr:
+            XYZ = _primaries_M(sRGB_xy) @ (np.power(rgb, 2.2) * 200 / 10000)
+            rgb = XYZ_to_BT2020_PQ_rgb(XYZ)
+        if apply_calibration:
+            rgb = self.apply_mhc2(rgb)
+        lin = pq_decode(np.power(rgb, self.pq_gamma)) * self.pq_gain
+        native = np.clip(self._to_native @ lin, 0.0, self.peak / 10000)
+        XYZ = self._native_M @ native
+        Y = XYZ[1] * 10000
+        area = self.window * float(size) / 100
+        if Y * area > self.abl_full * 100:
+            XYZ = XYZ * (self.abl_full * 100 / (Y * area))
+        return XYZ + self._black_XYZ
+
+    def _settled_at(self, t):
+        if self.settle_tau <= 0:
+            return self._target
+        k = np.exp(-max(t - self._t_change, 0.0) / self.settle_tau)
+        return self._target + (self._prev - self._target) * k
+
+    def _output_at(self, t):
+        warm = 1.0 - self.drift * np.exp(-t / self.drift_tau) if self.drift_tau > 0 else 1.0
+        return self._settled_at(t) * warm
+
+    def show(self, rgb, hdr=True, size=100.0):
+        """切换画面（rgb 为归一化信号，size 为色块占 dogegen 窗口面积的百分比）。"""
+        with self._lock:
+            now = self.clock.now
+            self._prev = self._settled_at(now)
+            self._target = self.steady_XYZ(rgb, hdr, size=size)
+            self._t_change = now
+            self.patches += 1
+
+    def read_XYZ(self):
+        """色度计读数（绝对 XYZ，cd/m²），在积分时间中点取值并推进时钟。"""
+        with self._lock:
+            t = self.clock.now + self.read_latency / 2
+            XYZ = self._output_at(t) * 10000
+            self.clock.sleep(self.read_latency)
+            XYZ = XYZ * (1 + self.noise * self.rng.standard_normal(3)) \
+                + self.noise_floor * self.rng.standard_normal(3)
+            self.readings += 1
+            return np.maximum(XYZ, 0.0)
+
+    # ---------------- 统计 ----------------
+    def reset_stats(self):
+        self.readings = 0
+        self.patches = 0
+        self._sim_start = self.clock.now
+        self._wall_start = time.perf_counter()
+
+    def residual_dE(self, targets_XYZ, mhc2=None):
+        """
+        以 mhc2（默认当前已加载）显示目标色，返回 (dE2000, dE_ITP) 数组。
+        targets_XYZ: (N,3)，10000nit 归一化；信号按 10bit 量化，与 app 一致。
+        """
+        saved = self.mhc2
+        if mhc2 is not None:
+            self.load_mhc2(mhc2)
+        try:
+            targets = np.asarray(targets_XYZ, dtype=float).reshape(-1, 3)
+            out = []
+            for XYZ in targets:
+                code = np.round(XYZ_to_BT2020_PQ_rgb(XYZ) * 1023) / 1023
+                out.append(self.steady_XYZ(code))
+            out = np.array(out)
+        finally:
+            self.mhc2 = saved
+        de_itp = np.array([XYZdeltaE_ITP(a, b) for a, b in zip(out, targets)])
+        return XYZdeltaE2000(out, targets), de_itp
+
+    def default_test_XYZ(self):
+        """默认评估色：灰阶 + sRGB/P3 测试色（20 nit，纯蓝附近也不超出面板能力）。"""
+        from color_test_suit import sRGB_test_colors_xy, P3D65_test_colors_xy
+        xyY = [[*D65_WHITE_POINT, Y] for Y in np.geomspace(1, 0.6 * self.peak, 8)]
+        xyY += [[*xy, 20] for xy in sRGB_test_colors_xy + P3D65_test_colors_xy]
+        return xyY_to_XYZ(np.array(xyY))
+
+    def report(self, mhc2=None, targets_XYZ=None):
+        """读数次数、画面数、模拟耗时（真实仪器下的预计耗时）、实际耗时与残余色差。"""
+        if targets_XYZ is None:
+            targets_XYZ = self.default_test_XYZ()
+        de2000, de_itp = self.residual_dE(targets_XYZ, mhc2)
+        return {
+            "readings": self.readings,
+            "patches": self.patches,
+            "simulated_time": round(self.clock.now - self._sim_start, 3),
+            "wall_time": round(time.perf_counter() - self._wall_start, 3),
+            "dE2000_mean": float(np.mean(de2000)),
+            "dE2000_max": float(np.max(de2000)),
+            "dE_ITP_mean": float(np.mean(de_itp)),
+            "dE_ITP_max": float(np.max(de_itp)),
+        }
+
+    # ---------------- 传输后端 ----------------
+    def spotread_transport(self):
+        return _SpotreadTransport(self)
+
+    def dogegen_transport(self):
+        return _DogegenTransport(self)
+
+
+class _SpotreadTransport:
+    """按 spotread 的提示符 / "Result is XYZ:" 协议输出虚拟面板读数（读数端协议）。"""
+    def __init__(self, panel):
+        self.panel = panel
+        self._out = queue.Queue()
+        self._closed = False
+        self._out.put("Spot read: virtual panel\n" + PROMPT)
+
+    def read(self, size=1000):
+        chunk = self._out.get()
+        if chunk is None:
+            self._out.put(None)
+            raise TransportEOF("virtual spotread exited")
+        return chunk
+
+    def send(self, s):
+        if self._closed:
+            raise TransportEOF("virtual spotread exited")
+        for key in s:
+            if key in ("q", "Q", "\x1b"):
+                self.close()
+                return
+            self._out.put(format_result(self.panel.read_XYZ()) + PROMPT)
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._out.put("\n")
+            self._out.put(None)
+
+
+class _DogegenTransport:
+    """按 dogegen 的 mode/window/draw 命令切换虚拟面板画面，每条命令回复一行（画面端协议）。"""
+    def __init__(self, panel):
+        self.panel = panel
+        self._state = {"bits": 10, "hdr": True, "rgb": [0.0, 0.0, 0.0]}
+        self._replies = collections.deque()
+        self._closed = False
+
+    def send(self, s):
+        if self._closed:
+            raise TransportEOF("virtual dogegen exited")
+        for line in s.splitlines():
+            if not line.split():
+                continue
+            if not apply_command(line, self._state):
+                self.close()
+                return
+            if line.split()[0] in ("window", "draw"):
+                self.panel.show(self._state["rgb"], hdr=self._state["hdr"],
+                                size=self._state.get("window", 100.0))
+            self._replies.append("OK\n")
+
+    def readline(self):
+        if not self._replies:
+            raise TransportEOF("virtual dogegen has no pending reply")
+        return self._replies.popleft()
+
+    def sleep(self, seconds):
+        self.panel.clock.sleep(seconds)
+
+    def now(self):
+        return self.panel.clock.now
+
+    def close(self):
+        self._closed = True
+
+
+_shared = None
+
+
+def shared_panel():
+    """进程内共享的虚拟面板，参数取自 RWHC_SIM_CONFIG。"""
+    global _shared
+    if _shared is None:
+        config = os.environ.get(SIM_CONFIG_ENV, "").strip()
+        kwargs = {}
+        if config:
+            if os.path.isfile(config):
+                with open(config, "r", encoding="utf-8") as f:
+                    kwargs = json.load(f)
+            else:
+                kwargs = json.loads(config)
+        _shared = VirtualPanel(**kwargs)
+    return _shared
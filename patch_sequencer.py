@@ -0,0 +1,451 @@
+# -*- coding: utf-8 -*-
+"""
+测量序列器：统一「写色块 -> 等待稳定 -> 读数」循环，并做流水线。
+
+run() 在一次读数完成后立刻下发下一个色块、开始计稳定时间，然后才把当前读数交给
+调用方（解析、日志、拟合），调用方的处理时间与下一块的稳定等待重叠。
+后一块依赖前一块读数的步骤（二分查找、迭代调整 LUT）用 measure() 逐块测量。
+
+稳定等待由 SettlePolicy 决定：按跳变大小估算等待时间、必要时连续读数直到收敛，
+并在会话中学习当前显示器的响应时间常数，统计相对固定延迟节省的时间。
+
+run() / measure() 可传入 AveragingPolicy：暗色块重复读数取平均，直到置信区间满足
+与亮度相关的容差；亮色块仍只读一次。
+
+设置了 journal（MeasurementJournal）时每个读数都写入测量日志；续测时日志里已有的
+读数直接重放，不再下发色块。
+"""
+import math
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from convert_utils import pq_eotf, pq_oetf
+
+
+class Patch(namedtuple("Patch", ["rgb", "settle", "meta"])):
+    """
+    rgb: 写给 ColorWriter 的码值
+    settle: 本块的稳定等待 (s)，None 表示使用序列器的策略
+    meta: 调用方附带的任意数据，原样出现在结果里
+    """
+    __slots__ = ()
+
+    def __new__(cls, rgb, settle=None, meta=None):
+        return super().__new__(cls, rgb, settle, meta)
+
+
+# timing: {"settle": 要求的稳定时间, "waited": 实际等待, "read": 读数耗时（含收敛检查的追加读数）,
+#          "reads": 读数次数, "cycle": 距上一个结果}；从测量日志重放的结果 timing 为 {"replayed": True}
+PatchResult = namedtuple("PatchResult", ["patch", "XYZ", "timing"])
+
+_END = object()
+
+
+class SettlePolicy:
+    """
+    稳定等待策略。把显示器响应看作线性亮度上的指数趋近：切换后残余误差约为
+    Δ·exp(-t/tau)，Δ 为亮度跳变相对目标亮度的比例（各通道取最大），等到残余低于
+    tol 需要 t = tau·ln(Δ/tol)，再夹在 [min_delay, max_delay]。
+    mode:
+      "fixed"     使用 Patch.settle / 序列器基准延迟（旧行为）
+      "adaptive"  按跳变估算延迟；会话开始的 learn_patches 个大跳变色块、之后每
+                  probe_every 个大跳变色块做一次探测，用来学习 tau
+      "converge"  每个色块都连续读数，直到相邻两次 XYZ 在容差内一致（最多 max_reads 次）
+    探测：等待缩短为 probe_scale 倍，然后连续读数直到相邻两次一致。
+    学习 tau：连续三次以上读数时，相邻差值之比 r = exp(-间隔/tau) 直接给出 tau；
+    缩短等待后首末读数在噪声范围内一致说明 tau 偏大，tau 缩小；读数沿跳变方向明显移动
+    （仍在趋近目标）时 tau 增大。只有超出容差两倍的变化才算移动，单纯的读数噪声不改变 tau。
+    只有缩短等待的探测才会缩小 tau：读数本身耗时较长时，按原等待读数一致并不能说明等待偏长。
+    """
+    def __init__(self, mode="adaptive", tau=0.02, tol=0.005, min_delay=0.0, max_delay=5.0,
+                 converge_rel=0.005, converge_abs=0.02, max_reads=5,
+                 learn_patches=4, probe_every=20, probe_transition=0.5, probe_scale=0.5,
+                 code_max=1023, black=0.05):
+        """
+        tau: 初始响应时间常数 (s)，会话中学习更新
+        tol: 可接受的残余误差（相对目标亮度）
+        converge_rel / converge_abs: 相邻读数一致的相对容差与绝对容差 (nit)
+        probe_transition: 只有相对跳变大于此值的色块才用于学习
+        probe_scale: 探测时等待时间的缩短比例
+        code_max: 码值满量程（10bit 为 1023），码值按 PQ 换算亮度
+        black: 计算相对跳变时的亮度下限 (nit)，近似面板黑位
+        """
+        if mode not in ("fixed", "adaptive", "converge"):
+            raise ValueError("mode must be 'fixed', 'adaptive' or 'converge'")
+        self.mode = mode
+        self.tau = float(tau)
+        self.tol = float(tol)
+        self.min_delay = float(min_delay)
+        self.max_delay = float(max_delay)
+        self.converge_rel = float(converge_rel)
+        self.converge_abs = float(converge_abs)
+        self.max_reads = int(max_reads)
+        self.learn_patches = int(learn_patches)
+        self.probe_every = int(probe_every)
+        self.probe_transition = float(probe_transition)
+        self.probe_scale = float(probe_scale)
+        self.code_max = float(code_max)
+        self.black = float(black)
+        self.patches = 0
+        self.probes = 0
+        self.extra_reads = 0
+        self.baseline_time = 0.0
+        self.settle_time = 0.0
+        self._since_probe = 0
+
+    def transition(self, prev_rgb, rgb):
+        """prev_rgb -> rgb 的相对亮度跳变；prev_rgb 为 None（首块）时按满幅跳变处理。"""
+        cur = pq_eotf(np.asarray(rgb, dtype=float) / self.code_max)
+        if prev_rgb is None:
+            prev = np.full_like(cur, 10000.0)
+        else:
+            prev = pq_eotf(np.asarray(prev_rgb, dtype=float) / self.code_max)
+        return float(np.max(np.abs(cur - prev) / np.maximum(cur, self.black)))
+
+    def direction(self, prev_rgb, rgb):
+        """prev_rgb -> rgb 的亮度变化方向（+1 变亮 / -1 变暗），prev_rgb 为 None 时返回 0（未知）。"""
+        if prev_rgb is None:
+            return 0
+        cur = pq_eotf(np.asarray(rgb, dtype=float) / self.code_max)
+        prev = pq_eotf(np.asarray(prev_rgb, dtype=float) / self.code_max)
+        return int(np.sign(np.sum(cur - prev)))
+
+    def delay(self, transition, baseline):
+        if self.mode == "fixed":
+            return baseline
+        if transition <= self.tol:
+            return self.min_delay
+        t = self.tau * math.log(transition / self.tol)
+        return min(max(t, self.min_delay), self.max_delay)
+
+    def wants_probe(self, transition):
+        """本块是否做收敛检查。adaptive 模式下探测块的等待按 probe_scale 缩短。"""
+        if self.mode == "converge":
+            return True
+        if self.mode != "adaptive" or transition < self.probe_transition:
+            return False
+        if self.probes < self.learn_patches:
+            return True
+        self._since_probe += 1
+        return self._since_probe >= self.probe_every
+
+    def plan(self, transition, baseline):
+        """返回 (等待时间, 是否探测)。"""
+        probe = self.wants_probe(transition)
+        delay = self.delay(transition, baseline)
+        if probe and self.mode == "adaptive":
+            delay *= self.probe_scale
+        return delay, probe
+
+    def agree(self, XYZ_a, XYZ_b):
+        a = np.asarray(XYZ_a, dtype=float)
+        b = np.asarray(XYZ_b, dtype=float)
+        return bool(np.all(np.abs(a - b) <= self._tolerance(b)))
+
+    def _tolerance(self, Y):
+        return np.maximum(self.converge_rel * np.abs(Y), self.converge_abs)
+
+    def learn(self, samples, converged, direction=0):
+        """
+        samples: 收敛检查中的 [(读数开始时间, Y), ...]，时间取自与等待相同的时钟
+        converged: 最后两次读数是否一致
+        direction: 本块亮度跳变方向（direction()），0 表示未知
+        """
+        shortened = self.mode == "adaptive"
+        self.probes += 1
+        self._since_probe = 0
+        estimates = []
+        for (t0, y0), (t1, y1), (t2, y2) in zip(samples, samples[1:], samples[2:]):
+            d1, d2 = y1 - y0, y2 - y1
+            if d1 == 0 or d2 / d1 <= 0:
+                continue
+            r = d2 / d1
+            # 差值过小（噪声）或几乎不衰减时估计不可靠
+            if 0.02 < r < 0.98 and abs(d1) > 2 * self._tolerance(y1) and abs(d2) > self._tolerance(y2):
+                estimates.append((t2 - t1) / -math.log(r))
+        y_first, y_last = samples[0][1], samples[-1][1]
+        change = y_last - y_first
+        moved = abs(change) > 2 * self._tolerance(y_last) and (direction == 0 or change * direction > 0)
+        if estimates:
+            self.tau = 0.5 * self.tau + 0.5 * float(np.median(estimates))
+        elif not moved:
+            # 首次读数已经稳定，后续不一致只是噪声
+            if shortened:
+                self.tau *= 0.8
+        elif converged:
+            self.tau *= 1.5
+        else:
+            self.tau *= 2.0
+        self.tau = min(self.tau, self.max_delay)
+
+    def record(self, baseline, cost, extra_reads=0):
+        self.patches += 1
+        self.extra_reads += extra_reads
+        self.baseline_time += baseline
+        self.settle_time += cost
+
+    def report(self):
+        return {
+            "mode": self.mode,
+            "tau": round(self.tau, 4),
+            "patches": self.patches,
+            "extra_reads": self.extra_reads,
+            "settle_time": round(self.settle_time, 3),
+            "baseline_time": round(self.baseline_time, 3),
+            "time_saved": round(self.baseline_time - self.settle_time, 3),
+        }
+
+
+class AveragingPolicy:
+    """
+    暗色块的顺序平均。第一次读数 Y >= bright 时直接返回；否则至少读 min_reads 次，
+    用 Welford 累计 Y 与色度 x、y 的均值和方差，直到
+      - Y 的置信区间半宽 z·s/√n 不超过亮度容差：使 PQ 偏差不超过 budget/720
+        （灰阶 ΔE_ITP ≈ 720·ΔPQ），亮度越低容差越小；并不低于 abs_floor
+      - x、y 的置信区间半宽不超过 xy_tol·max(1, sqrt(xy_ref / Y))（越暗色度越难测准，放宽）
+    或读满 max_reads 次。返回所有读数的平均 XYZ。
+    """
+    def __init__(self, bright=5.0, budget=0.5, abs_floor=0.0005, xy_tol=0.002, xy_ref=1.0,
+                 z=1.96, min_reads=2, max_reads=6):
+        """
+        bright: 亮度不低于此值 (nit) 的色块只读一次
+        budget: 允许的平均值误差，ΔE_ITP
+        abs_floor: 亮度容差下限 (nit)，近似仪器分辨率
+        z: 置信区间系数（1.96 对应 95%）
+        """
+        if min_reads < 1 or max_reads < min_reads:
+            raise ValueError("need 1 <= min_reads <= max_reads")
+        self.bright = float(bright)
+        self.budget = float(budget)
+        self.abs_floor = float(abs_floor)
+        self.xy_tol = float(xy_tol)
+        self.xy_ref = float(xy_ref)
+        self.z = float(z)
+        self.min_reads = int(min_reads)
+        self.max_reads = int(max_reads)
+        self.patches = 0
+        self.averaged = 0
+        self.extra_reads = 0
+        self.capped = 0
+
+    def y_tolerance(self, Y):
+        """亮度 Y (nit) 处 PQ 偏移 budget/720 对应的亮度偏差。"""
+        pq = pq_oetf(max(Y, 0.0))
+        return max(float(pq_eotf(pq + self.budget / 720.0)) - Y, self.abs_floor)
+
+    def xy_tolerance(self, Y):
+        return self.xy_tol * max(1.0, math.sqrt(self.xy_ref / max(Y, 1e-6)))
+
+    def needs_more(self, stats):
+        """stats: _ReadingStats。返回是否还需要读数。"""
+        n = stats.n
+        if n >= self.max_reads:
+            return False
+        if n == 1 and stats.mean[0] >= self.bright:
+            return False
+        if n < self.min_reads:
+            return True
+        half = self.z * np.sqrt(stats.variance() / n)
+        Y = stats.mean[0]
+        return bool(half[0] > self.y_tolerance(Y) or np.any(half[1:] > self.xy_tolerance(Y)))
+
+    def record(self, reads, capped):
+        self.patches += 1
+        if reads > 1:
+            self.averaged += 1
+            self.extra_reads += reads - 1
+        if capped:
+            self.capped += 1
+
+    def report(self):
+        return {
+            "patches": self.patches,
+            "averaged": self.averaged,
+            "extra_reads": self.extra_reads,
+            "capped": self.capped,
+        }
+
+
+class _ReadingStats:
+    """按 Welford 累计 (Y, x, y) 的均值与方差，同时累计 XYZ 之和。"""
+    def __init__(self):
+        self.n = 0
+        self.mean = np.zeros(3)
+        self.m2 = np.zeros(3)
+        self.XYZ_sum = np.zeros(3)
+
+    def add(self, XYZ):
+        XYZ = np.asarray(XYZ, dtype=float)
+        s = max(float(np.sum(XYZ)), 1e-12)
+        v = np.array([XYZ[1], XYZ[0] / s, XYZ[1] / s])
+        self.n += 1
+        d = v - self.mean
+        self.mean += d / self.n
+        self.m2 += d * (v - self.mean)
+        self.XYZ_sum += XYZ
+
+    def variance(self):
+        return self.m2 / (self.n - 1) if self.n > 1 else np.zeros(3)
+
+    def XYZ(self):
+        return self.XYZ_sum / self.n
+
+
+def as_patch(item):
+    return item if isinstance(item, Patch) else Patch(item)
+
+
+class PatchSequencer:
+    def __init__(self, writer, reader, settle=0.1, baseline=0.1, journal=None):
+        """
+        writer / reader: ColorWriter / ColorReader
+        journal: MeasurementJournal，记录读数并在续测时重放
+        settle: 稳定策略：SettlePolicy、秒数或 callable(prev_rgb, rgb) -> 秒数
+        baseline: 未指定 Patch.settle 时的固定延迟。数字/callable 策略下 Patch.settle 优先；
+                  SettlePolicy 下 Patch.settle 与 baseline 只作为旧固定延迟，用于统计节省的时间
+        """
+        self.writer = writer
+        self.reader = reader
+        # 稳定时间与 writer.wait 用同一时钟（虚拟面板下为模拟时钟），否则学到的时间常数无意义
+        self.now = getattr(writer, "now", time.monotonic)
+        self.settle = settle
+        self.baseline = baseline
+        self.journal = journal
+        self.readings = 0
+        self._last_rgb = None
+        self._ready_at = 0.0
+        self._settle = 0.0
+        self._transition = 1.0
+        self._direction = 0
+        self._probe = False
+        self._last_done = None
+
+    @property
+    def policy(self):
+        return self.settle if isinstance(self.settle, SettlePolicy) else None
+
+    def baseline_for(self, patch):
+        return self.baseline if patch.settle is None else patch.settle
+
+    def settle_for(self, patch):
+        if self.policy is not None:
+            self._transition = self.policy.transition(self._last_rgb, patch.rgb)
+            self._direction = self.policy.direction(self._last_rgb, patch.rgb)
+            delay, self._probe = self.policy.plan(self._transition, self.baseline_for(patch))
+            return delay
+        settle = self.settle if patch.settle is None else patch.settle
+        if callable(settle):
+            settle = settle(self._last_rgb, patch.rgb)
+        return max(0.0, float(settle))
+
+    def _show(self, patch):
+        self._settle = self.settle_for(patch)
+        self.writer.write_rgb(patch.rgb, delay=0)
+        self._last_rgb = list(patch.rgb)
+        self._ready_at = self.now() + self._settle
+
+    def _replay(self, patch):
+        """取下一个日志序号；日志里有该色块的读数时返回重放结果，否则返回 None。"""
+        if self.journal is None:
+            return None, None
+        seq = self.journal.next_seq()
+        XYZ = self.journal.replay(seq, patch.rgb)
+        if XYZ is None:
+            return seq, None
+        # 屏幕上仍是重放前的画面，下一块按未知跳变处理
+        self._last_rgb = None
+        return seq, PatchResult(patch, XYZ, {"replayed": True})
+
+    def _read(self, patch, seq=None, averaging=None):
+        waited = max(0.0, self._ready_at - self.now())
+        if waited > 0:
+            self.writer.wait(waited)
+        t0 = self.now()
+        XYZ = self.reader.read_XYZ()
+        t1 = self.now()
+        self.readings += 1
+        reads = 1
+        policy = self.policy
+        if policy is not None:
+            # 收敛检查：连续读数直到相邻两次一致，取最后一次
+            if XYZ is not None and self._probe:
+                samples = [(t0, float(XYZ[1]))]
+                converged = False
+                while reads < policy.max_reads:
+                    prev = XYZ
+                    start = self.now()
+                    XYZ = self.reader.read_XYZ()
+                    self.readings += 1
+                    reads += 1
+                    if XYZ is None:
+                        break
+                    samples.append((start, float(XYZ[1])))
+                    if policy.agree(prev, XYZ):
+                        converged = True
+                        break
+                if XYZ is not None:
+                    policy.learn(samples, converged, self._direction)
+            extra = self.now() - t1
+            policy.record(self.baseline_for(patch), waited + extra, reads - 1)
+            t1 = self.now()
+        if averaging is not None and XYZ is not None:
+            # 顺序平均：从画面稳定后的这次读数开始累计
+            stats = _ReadingStats()
+            stats.add(XYZ)
+            while averaging.needs_more(stats):
+                more = self.reader.read_XYZ()
+                self.readings += 1
+                reads += 1
+                if more is None:
+                    break
+                stats.add(more)
+            averaging.record(stats.n, stats.n >= averaging.max_reads)
+            XYZ = stats.XYZ()
+            t1 = self.now()
+        timing = {
+            "settle": self._settle,
+            "waited": waited,
+            "read": t1 - t0,
+            "reads": reads,
+            "cycle": None if self._last_done is None else t1 - self._last_done,
+        }
+        self._last_done = t1
+        if self.journal is not None and seq is not None:
+            self.journal.record(seq, patch.rgb, XYZ)
+        return PatchResult(patch, XYZ, timing)
+
+    def measure(self, patch, averaging=None):
+        """测量单个色块（rgb 或 Patch），返回 PatchResult。averaging: AveragingPolicy"""
+        patch = as_patch(patch)
+        seq, replayed = self._replay(patch)
+        if replayed is not None:
+            return replayed
+        self._show(patch)
+        return self._read(patch, seq, averaging)
+
+    def _prepare(self, it):
+        """取出下一项：可重放则直接给出结果，否则下发色块开始计稳定时间。"""
+        patch = next(it, _END)
+        if patch is _END:
+            return _END
+        patch = as_patch(patch)
+        seq, replayed = self._replay(patch)
+        if replayed is None:
+            self._show(patch)
+        return patch, seq, replayed
+
+    def run(self, patches, averaging=None):
+        """
+        依次测量 patches（rgb / Patch 的序列或生成器），逐个 yield PatchResult。
+        下一项会在 yield 当前结果之前取出并下发，生成器不能依赖当前结果。
+        averaging: AveragingPolicy，暗色块重复读数取平均
+        """
+        it = iter(patches)
+        pending = self._prepare(it)
+        while pending is not _END:
+            patch, seq, replayed = pending
+            result = replayed if replayed is not None else self._read(patch, seq, averaging)
+            pending = self._prepare(it)
+            yield result
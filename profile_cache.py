@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+按内容寻址的配置文件缓存：预览 / 生成的 ICC 以 tag 内容哈希（ICCProfile.content_hash，
+不含 desc）为键，安装名由哈希得出。内容相同的状态（例如来回切换预览）直接复用已安装的
+配置文件，不再重新序列化、写临时文件和安装。
+
+缓存保留最近使用的若干个状态（序列化后的字节与安装名），超过容量时从系统色彩目录卸载
+最久未使用的配置文件。关联 / 取消关联由调用方负责，缓存只管理安装与卸载。
+"""
+import os
+import tempfile
+from collections import OrderedDict
+
+
+class ProfileCache:
+    def __init__(self, install, uninstall, capacity=8, prefix="CC_"):
+        """
+        install: install(path)，把 path 处的配置文件安装到系统（安装名为文件名）
+        uninstall: uninstall(name)，按名称（不含 .icc）卸载
+        capacity: 最多保留的已安装配置文件数
+        prefix: 安装名前缀，名称为 prefix + 哈希前 32 位十六进制（长度固定）
+        """
+        if capacity < 1:
+            raise ValueError("capacity must be >= 1")
+        self.install = install
+        self.uninstall = uninstall
+        self.capacity = int(capacity)
+        self.prefix = prefix
+        self._entries = OrderedDict()  # key -> {"name", "data"}
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def name_for(self, key):
+        return self.prefix + key[:32]
+
+    def acquire(self, profile):
+        """
+        返回 profile 当前内容对应的已安装配置文件 (key, name, data)。
+        未命中时写入 desc、rebuild、安装，并按需淘汰最久未使用的条目。
+        """
+        key = profile.content_hash()
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return key, entry["name"], entry["data"]
+
+        self.misses += 1
+        name = self.name_for(key)
+        profile.write_desc([{"lang": "en", "country": "US", "text": name}])
+        profile.rebuild()
+        data = bytes(profile.data)
+        path = os.path.join(tempfile.gettempdir(), name + ".icc")
+        with open(path, "wb") as f:
+            f.write(data)
+        try:
+            self.install(path)
+        finally:
+            os.remove(path)
+        self._entries[key] = {"name": name, "data": data}
+        self._evict(keep=key)
+        return key, name, data
+
+    def _evict(self, keep=None):
+        while len(self._entries) > self.capacity:
+            key = next(iter(self._entries))
+            if key == keep:
+                break
+            entry = self._entries.pop(key)
+            self.uninstall(entry["name"])
+
+    def clear(self):
+        """卸载所有缓存的配置文件。单个卸载失败不影响其余条目，最后抛出第一个错误。"""
+        error = None
+        while self._entries:
+            _, entry = self._entries.popitem(last=False)
+            try:
+                self.uninstall(entry["name"])
+            except Exception as e:
+                error = error or e
+        if error is not None:
+            raise error
+
+    def report(self):
+        return {"installed": len(self._entries), "hits": self.hits, "misses": self.misses}
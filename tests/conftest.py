@@ -0,0 +1,51 @@
+import os
+import struct
+import sys
+
+import pytest
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+
+def build_profile(tags):
+    """Serialise a minimal ICC profile from {tag name: tag bytes} (each padded to 4 bytes)."""
+    blocks = []
+    for name, block in tags.items():
+        block = bytes(block) + b'\x00' * ((4 - len(block) % 4) % 4)
+        blocks.append((name, block))
+    offset = 128 + 4 + 12 * len(blocks)
+    table = bytearray(struct.pack('>I', len(blocks)))
+    content = bytearray()
+    for name, block in blocks:
+        table += name.encode('ascii') + struct.pack('>II', offset + len(content), len(block))
+        content += block
+    header = bytearray(128)
+    header[36:40] = b'acsp'
+    data = header + table + content
+    data[0:4] = struct.pack('>I', len(data))
+    return bytes(data)
+
+
+def s15(v):
+    return struct.pack('>i', int(round(v * 65536)))
+
+
+def mhc2_block(count=4):
+    block = bytearray(b'MHC2' + bytes(4) + struct.pack('>I', count) + s15(0.0) + s15(1000.0))
+    block += struct.pack('>IIII', 36, 84, 92 + 4 * count, 100 + 8 * count)
+    for i in range(3):
+        block += b''.join(s15(1.0 if i == j else 0.0) for j in range(3)) + s15(0.0)
+    for _ in range(3):
+        block += b'sf32' + bytes(4) + b''.join(s15(i / (count - 1)) for i in range(count))
+    return bytes(block)
+
+
+@pytest.fixture
+def profile_bytes():
+    return build_profile({
+        'desc': b'desc' + bytes(4) + struct.pack('>I', 4) + b'test',
+        'rXYZ': b'XYZ ' + bytes(4) + s15(0.6) + s15(0.3) + s15(0.0),
+        'MHC2': mhc2_block(),
+    })
@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+
+import convert_utils as cu
+
+
+@pytest.mark.filterwarnings("error")
+@pytest.mark.parametrize("interp", ["linear", "cubic"])
+@pytest.mark.parametrize("dtype", [np.float32, np.float64])
+def test_transfer_fast_non_finite(interp, dtype):
+    x = np.array([0.25, np.nan, 0.5, np.inf, -np.inf, 1.0, np.nan], dtype=dtype)
+    y = cu.transfer_fast("gamma_encode", x, gamma=2.2, dtype=dtype, interp=interp)
+    assert y.dtype == dtype
+    assert np.array_equal(np.isnan(y), np.isnan(x))
+    finite = ~np.isnan(x)
+    exact = cu.gamma_encode.exact(x[finite], 2.2)
+    np.testing.assert_allclose(y[finite], exact, atol=1e-6)
+
+
+@pytest.mark.filterwarnings("error")
+def test_fast_path_nan_across_blocks():
+    x = np.linspace(0.0, 10000.0, cu.FAST_TRANSFER_MIN_SIZE + 3)
+    x[::5] = np.nan
+    y = cu.pq_oetf(x)
+    assert np.array_equal(np.isnan(y), np.isnan(x))
+    assert np.isnan(cu.transfer_fast("pq_oetf", np.nan))
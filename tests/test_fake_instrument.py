@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+import fake_instrument
+from color_rw import ColorReader, ColorWriter
+from patch_sequencer import Patch, PatchSequencer
+
+
+@pytest.fixture
+def fake_env(monkeypatch, tmp_path):
+    monkeypatch.setenv("RWHC_INSTRUMENT", "fake")
+    monkeypatch.setenv("RWHC_FAKE_STATE", str(tmp_path / "display.json"))
+    monkeypatch.setenv("RWHC_FAKE_NOISE", "0")
+
+
+def test_measurement_flow_over_pipes(fake_env):
+    rgbs = {"red": [592, 0, 0], "white": [1023, 1023, 1023], "black": [0, 0, 0], "gray": [300, 300, 300]}
+    writer = ColorWriter()
+    reader = ColorReader(["-x"])
+    try:
+        assert reader.status == "ready"
+        seq = PatchSequencer(writer, reader, settle=0)
+        patches = [Patch(rgb, meta=name) for name, rgb in rgbs.items()]
+        results = {r.patch.meta: r.XYZ for r in seq.run(patches)}
+        gray = seq.measure([512, 512, 512]).XYZ
+    finally:
+        reader.terminate()
+        writer.terminate()
+
+    assert list(results) == list(rgbs)
+    for name, rgb in rgbs.items():
+        expected = fake_instrument.panel_XYZ(np.array(rgb) / 1023)
+        # spotread prints six decimals
+        np.testing.assert_allclose(results[name], expected, rtol=1e-5, atol=1e-5)
+    np.testing.assert_allclose(gray, fake_instrument.panel_XYZ(np.full(3, 512 / 1023)), rtol=1e-5)
+    assert results["white"][1] > results["gray"][1] > results["black"][1]
+
+
+def test_app_skips_system_color_management(fake_env, monkeypatch, tmp_path):
+    pytest.importorskip("tkinter")
+    import app
+
+    def forbidden(*args, **kwargs):
+        raise AssertionError("system color management called in fake mode")
+
+    for name in ("install_icc", "uninstall_icc", "cp_add_display_association",
+                 "cp_remove_display_association"):
+        monkeypatch.setattr(app, name, forbidden, raising=False)
+    ui = app.HDRCalibrationUI.__new__(app.HDRCalibrationUI)
+    path = tmp_path / "test.icc"
+    path.write_bytes(b"")
+    ui.set_icc(str(path))
+    ui.associate_icc("test.icc")
+    ui.disassociate_icc("test.icc")
+    ui.clean_icc("test")
+    ui.install_cached_icc(str(path))
+    ui.uninstall_cached_icc("test")
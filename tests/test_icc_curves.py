@@ -0,0 +1,131 @@
+import struct
+
+import numpy as np
+import pytest
+
+from conftest import build_profile, s15
+from icc_rw import ICCProfile, eval_parametric_curve
+
+
+def roundtrip(write):
+    """Write into an in-memory profile, rebuild, and reload the bytes lazily."""
+    p = ICCProfile.from_bytes(build_profile({'desc': b'desc' + bytes(4) + struct.pack('>I', 1) + b'x'}))
+    write(p)
+    p.rebuild()
+    return ICCProfile.from_bytes(bytes(p.data), lazy=True)
+
+
+# ---------------- vcgt ----------------
+@pytest.mark.parametrize("layout", ["A", "table"])
+@pytest.mark.parametrize("bpe, scale", [(1, 255), (2, 65535)])
+def test_vcgt_table_roundtrip_exact(layout, bpe, scale):
+    rng = np.random.default_rng(bpe)
+    channels = [rng.integers(0, scale + 1, 256) / scale for _ in range(3)]
+    p = roundtrip(lambda p: p.write_vcgt(*channels, bytes_per_entry=bpe, layout=layout))
+    vcgt = p.read_vcgt(as_array=True)
+    assert vcgt['format'] == layout
+    assert vcgt['bytes_per_entry'] == bpe
+    for name, values in zip(('red', 'green', 'blue'), channels):
+        np.testing.assert_array_equal(vcgt[name], values)
+    assert p.read_vcgt()['red'] == channels[0].tolist()
+
+
+def test_vcgt_table_single_channel():
+    values = np.arange(16, dtype='>u2') * 4369
+    block = b'vcgt' + bytes(4) + struct.pack('>IHHH', 0, 1, 16, 2) + values.tobytes()
+    vcgt = ICCProfile.from_bytes(build_profile({'vcgt': block})).read_vcgt()
+    assert vcgt['format'] == 'table'
+    assert vcgt['red'] == vcgt['green'] == vcgt['blue'] == (values / 65535.0).tolist()
+
+
+def test_vcgt_formula_roundtrip_exact():
+    gamma, vmin, vmax = [1.0, 2.2, 0.5], [0.0, 0.125, 0.25], [1.0, 0.875, 0.75]
+    p = roundtrip(lambda p: p.write_vcgt_formula(gamma, vmin, vmax))
+    vcgt = p.read_vcgt()
+    assert vcgt['format'] == 'formula'
+    for i, name in enumerate(('red', 'green', 'blue')):
+        expect = [round(v * 65536) / 65536 for v in (gamma[i], vmin[i], vmax[i])]
+        assert [vcgt[name][k] for k in ('gamma', 'min', 'max')] == expect
+
+
+# ---------------- curv ----------------
+def test_curv_identity():
+    p = roundtrip(lambda p: p.write_TRC('rTRC', {'type': 'curve', 'values': []}))
+    assert p.read_TRC('rTRC') == {'type': 'curve', 'values': []}
+    x = np.linspace(0, 1, 11)
+    np.testing.assert_array_equal(p.eval_TRC('rTRC', x), x)
+
+
+def test_curv_gamma():
+    p = roundtrip(lambda p: p.write_TRC('gTRC', 2.2, prefer_parametric_gamma=False))
+    trc = p.read_TRC('gTRC')
+    assert trc == {'type': 'gamma', 'gamma': 563 / 256}
+    x = np.linspace(0, 1, 11)
+    np.testing.assert_allclose(p.eval_TRC('gTRC', x), x ** (563 / 256))
+
+
+def test_curv_table():
+    values = np.arange(0, 65536, 257) / 65535.0
+    p = roundtrip(lambda p: p.write_TRC('bTRC', {'type': 'curve', 'values': values}))
+    assert p.read_TRC('bTRC')['values'] == values.tolist()
+    np.testing.assert_array_equal(p.read_TRC('bTRC', as_array=True)['values'], values)
+    x = np.linspace(0, 1, 1001)
+    np.testing.assert_allclose(p.eval_TRC('bTRC', x),
+                               np.interp(x, np.linspace(0, 1, values.size), values))
+    image = np.random.default_rng(0).uniform(size=(4, 5, 3))
+    assert p.eval_TRC('bTRC', image).shape == image.shape
+
+
+# ---------------- para ----------------
+def reference_para(func_type, params, x):
+    """Scalar transcription of the ICC parametricCurveType formulas."""
+    x = min(max(x, 0.0), 1.0)
+    if func_type == 0:
+        g, = params
+        return x ** g
+    if func_type == 1:
+        g, a, b = params
+        return (a * x + b) ** g if x >= -b / a else 0.0
+    if func_type == 2:
+        g, a, b, c = params
+        return (a * x + b) ** g + c if x >= -b / a else c
+    if func_type == 3:
+        g, a, b, c, d = params
+        return (a * x + b) ** g if x >= d else c * x
+    g, a, b, c, d, e, f = params
+    return (a * x + b) ** g + e if x >= d else c * x + f
+
+
+PARA_CASES = [
+    (0, [2.2]),
+    (1, [2.4, 1.25, -0.25]),                           # breakpoint at x = 0.2
+    (2, [2.4, 1.25, -0.25, 0.0625]),                   # breakpoint at x = 0.2
+    (3, [2.4, 0.9478, 0.0521, 0.0774, 0.04045]),       # sRGB
+    (4, [2.4, 0.9478, 0.0521, 0.0774, 0.04045, 0.015625, 0.0078125]),
+]
+
+
+@pytest.mark.parametrize("func_type, params", PARA_CASES)
+def test_para_matches_scalar_reference(func_type, params):
+    p = roundtrip(lambda p: p.write_TRC('rTRC', {'type': 'parametric', 'functionType': func_type,
+                                                  'params': params}))
+    trc = p.read_TRC('rTRC')
+    assert trc['functionType'] == func_type
+    stored = trc['params']
+    assert stored == [round(v * 65536) / 65536 for v in params]
+
+    # dense grid plus points just either side of the breakpoint, and out-of-range inputs
+    x = np.concatenate([np.linspace(0, 1, 4097), [0.01, 0.03, 0.19, 0.2, 0.21, -0.5, 1.5]])
+    expect = np.array([reference_para(func_type, stored, v) for v in x])
+    np.testing.assert_allclose(trc['eval'](x), expect, rtol=1e-12, atol=1e-15)
+    np.testing.assert_allclose(eval_parametric_curve(func_type, stored, x), expect, rtol=1e-12, atol=1e-15)
+    np.testing.assert_allclose(p.eval_TRC('rTRC', x.reshape(-1, 1)), expect.reshape(-1, 1),
+                               rtol=1e-12, atol=1e-15)
+    below = x[(x >= 0) & (x < (stored[4] if func_type >= 3 else 0.2))]
+    if func_type:
+        assert below.size and np.all(np.isfinite(trc['eval'](below)))
+
+
+def test_para_rejects_unknown_type():
+    with pytest.raises(ValueError):
+        eval_parametric_curve(5, [1.0], [0.5])
@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+from icc_rw import ICCProfile
+
+
+def load(kind, data, tmp_path):
+    if kind == "eager":
+        return ICCProfile.from_bytes(data, lazy=False)
+    if kind == "lazy_bytes":
+        return ICCProfile.from_bytes(data, lazy=True)
+    path = tmp_path / "profile.icc"
+    path.write_bytes(data)
+    return ICCProfile(str(path), lazy=True)
+
+
+@pytest.mark.parametrize("kind", ["eager", "lazy_bytes", "lazy_mmap"])
+def test_same_size_update_patches_in_place(kind, profile_bytes, tmp_path):
+    p = load(kind, profile_bytes, tmp_path)
+    mhc2 = p.read_MHC2()
+    p.write_MHC2(mhc2)
+    p.rebuild()
+    assert bytes(p.data) == profile_bytes
+
+    mhc2['matrix'][0] = 0.5
+    mhc2['red_lut'] = [0.0, 0.25, 0.5, 0.75]
+    p.write_MHC2(mhc2)
+    p.rebuild()
+    assert isinstance(p.data, bytearray)
+    assert len(p.data) == len(profile_bytes)
+    assert p.read_MHC2()['matrix'][0] == 0.5
+    assert p.read_MHC2()['red_lut'] == [0.0, 0.25, 0.5, 0.75]
+    assert p.read_XYZType('rXYZ') == ICCProfile.from_bytes(profile_bytes).read_XYZType('rXYZ')
+    p.close()
+
+
+@pytest.mark.parametrize("kind", ["eager", "lazy_bytes", "lazy_mmap"])
+def test_size_change_relayouts(kind, profile_bytes, tmp_path):
+    p = load(kind, profile_bytes, tmp_path)
+    mhc2 = p.read_MHC2()
+    mhc2['entry_count'] = 8
+    for c in ('red', 'green', 'blue'):
+        mhc2[f'{c}_lut'] = np.linspace(0, 1, 8)
+    p.write_MHC2(mhc2)
+    p.rebuild()
+    assert len(p.data) == len(profile_bytes) + 3 * 4 * 4
+    np.testing.assert_allclose(p.read_MHC2(as_array=True)['green_lut'], np.linspace(0, 1, 8), atol=1e-5)
+    assert p.read_textType('desc') == 'test'
+    p.close()
+
+
+@pytest.mark.parametrize("kind", ["eager", "lazy_bytes", "lazy_mmap"])
+def test_patch_clears_profile_id(kind, profile_bytes, tmp_path):
+    data = bytearray(profile_bytes)
+    data[84:100] = b'\x01' * 16
+    p = load(kind, bytes(data), tmp_path)
+    p.write_MHC2(p.read_MHC2())
+    p.rebuild()
+    assert bytes(p.data[84:100]) == bytes(16)
+    p.close()
+
+
+def test_lazy_from_bytes_leaves_source_untouched(profile_bytes):
+    source = bytearray(profile_bytes)
+    p = ICCProfile.from_bytes(source, lazy=True)
+    mhc2 = p.read_MHC2()
+    mhc2['matrix'][4] = 2.0
+    p.write_MHC2(mhc2)
+    p.rebuild()
+    assert source == profile_bytes
+    assert p.read_MHC2()['matrix'][4] == 2.0
+
+
+@pytest.mark.parametrize("kind", ["eager", "lazy_bytes", "lazy_mmap"])
+def test_use_after_close(kind, profile_bytes, tmp_path):
+    p = load(kind, profile_bytes, tmp_path)
+    digest = p.content_hash()
+    mhc2 = p.read_MHC2()
+    mhc2['matrix'][0] = 0.5
+    p.write_MHC2(mhc2)
+    p.close()
+    assert p._mmap is None
+    assert p.read_textType('desc') == 'test'
+    assert p.content_hash() != digest
+    p.rebuild()
+    assert p.read_MHC2()['matrix'][0] == 0.5
+    assert p.read_XYZType('rXYZ') == ICCProfile.from_bytes(profile_bytes).read_XYZType('rXYZ')
+    p.close()
+    assert p.read_MHC2()['matrix'][0] == 0.5